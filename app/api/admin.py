@@ -0,0 +1,59 @@
+from fastapi import APIRouter, HTTPException
+import asyncio
+import os
+import uuid
+
+from app.checkpoints import get_import, is_running, stalled_imports
+from app.config import settings
+from app.importer import discard_sharded_import
+from app.queues import admit_import, import_queue, large_imports, queue_stats
+from app.readers import estimate_rows, upload_format
+from app.tasks import process_csv_upload
+
+router = APIRouter()
+
+@router.get("/admin/imports/stalled")
+async def list_stalled_imports():
+    # Failed imports and imports whose worker stopped heartbeating, with the
+    # checkpoint a restart would continue from
+    return await asyncio.to_thread(stalled_imports)
+
+@router.post("/admin/imports/{task_id}/restart")
+async def restart_import(task_id: uuid.UUID):
+    task_id = str(task_id)
+    entry = await asyncio.to_thread(get_import, task_id)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Unknown or finished import")
+    if await asyncio.to_thread(is_running, task_id):
+        raise HTTPException(status_code=409, detail="Import is still running")
+
+    info = entry["info"]
+    if not os.path.exists(info["file_path"]):
+        raise HTTPException(status_code=409, detail="The uploaded file no longer exists")
+
+    # Sharded imports start over, so drop whatever their shards had staged
+    await discard_sharded_import(task_id)
+    # Same queue as the upload went to; restarts skip the large import limit
+    rows = await asyncio.to_thread(estimate_rows, info["file_path"], upload_format(info["file_path"]))
+    queue = import_queue(rows)
+    # Redis and the broker are only reached through sync clients, so off the event loop
+    await asyncio.to_thread(admit_import, task_id, queue, force=True)
+    await asyncio.to_thread(
+        process_csv_upload.apply_async,
+        (info["file_path"], task_id, info.get("load_mode"), info.get("shards")),
+        {"content_hash": info.get("content_hash")},
+        queue=queue,
+    )
+    return {"task_id": task_id, "resumed_from": entry["checkpoint"], "queue": queue}
+
+@router.get("/admin/queues")
+async def get_queues():
+    # For sizing workers: messages waiting per queue, how long the oldest has
+    # waited, and the large imports holding a slot in admission order
+    return {
+        "queues": await asyncio.to_thread(queue_stats),
+        "large_imports": {
+            "limit": settings.IMPORT_LARGE_MAX_PENDING,
+            "admitted": await asyncio.to_thread(large_imports),
+        },
+    }
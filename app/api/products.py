@@ -1,38 +1,142 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from sqlalchemy import delete, func
-from typing import List, Optional
-from app.database import get_db
+from sqlalchemy import func
+from typing import List, Literal, Optional
+from app.database import get_db, get_read_db
 from app.models import Product
-from app.schemas import ProductCreate, ProductUpdate, ProductResponse
+from app.schemas import (
+    BulkDeleteRequest,
+    BulkPatchRequest,
+    BulkResponse,
+    BulkUpsertRequest,
+    ProductChangesResponse,
+    ProductCreate,
+    ProductResponse,
+    ProductUpdate,
+)
+from app.queries import decode_cursor, fetch_page, filter_products
+from app.export import EXPORT_FORMATS, export_products
+from app.cache import invalidate_product, invalidate_products, product_cache
+from app.bulk import bulk_delete, bulk_patch, bulk_upsert, summarize
+from app.stats import count_change, count_changes, product_counts
+from app.changes import MAX_CHANGES_PAGE, fetch_changes, last_feed_reset
+from app.uploads import catalogue_changed
+import hashlib
+import uuid
 
 router = APIRouter()
 
 @router.get("/products", response_model=List[ProductResponse])
 async def list_products(
+    response: Response,
     skip: int = 0,
     limit: int = 10,
+    cursor: Optional[str] = None,
     search: Optional[str] = None,
     is_active: Optional[bool] = None,
+    db: AsyncSession = Depends(get_read_db)
+):
+    # Simple case-insensitive search on SKU or Name
+    query = filter_products(select(Product), search, is_active)
+
+    if skip and not cursor:
+        # Legacy offset paging, kept for existing clients. Deep pages get
+        # slower the further they go; prefer the cursor.
+        query = query.order_by(Product.sku).offset(skip).limit(limit)
+        result = await db.execute(query)
+        return result.scalars().all()
+
+    try:
+        after = decode_cursor(cursor) if cursor else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    page = await fetch_page(db, query, limit, after=after)
+    if page.next_cursor:
+        # Pass this back as ?cursor= to get the next page
+        response.headers["X-Next-Cursor"] = page.next_cursor
+    return page.items
+
+@router.get("/products/stats")
+async def get_product_stats(db: AsyncSession = Depends(get_read_db)):
+    # Exact active/inactive counts from Redis; a planner estimate of the total
+    # ("estimate": true) until they have been computed
+    return await product_counts(db)
+
+@router.get("/products/changes", response_model=ProductChangesResponse)
+async def list_product_changes(
+    since: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=MAX_CHANGES_PAGE),
     db: AsyncSession = Depends(get_db)
 ):
-    query = select(Product)
-    
-    if search:
-        # Simple case-insensitive search on SKU or Name
-        search_filter = f"%{search}%"
-        query = query.filter(
-            (Product.sku.ilike(search_filter)) | 
-            (Product.name.ilike(search_filter))
-        )
-    
-    if is_active is not None:
-        query = query.filter(Product.is_active == is_active)
-    
-    query = query.offset(skip).limit(limit)
-    result = await db.execute(query)
-    return result.scalars().all()
+    # Incremental sync: creates, updates and deletes after the `since`
+    # position, oldest first. Start from 0 (or the since token of an
+    # import-completed webhook) and keep passing next_since back.
+    # Always on the primary, so consecutive pages never come from replicas
+    # that have replayed different amounts of it.
+    reset = await last_feed_reset(db)
+    if since and reset and since < reset:
+        raise HTTPException(status_code=410, detail="The catalogue was deleted since this position; sync again from 0")
+    page = await fetch_changes(db, since, limit)
+    return {"changes": page.changes, "next_since": page.next_since, "has_more": page.has_more}
+
+@router.get("/products/export")
+async def export_products_file(
+    format: Literal["csv", "ndjson"] = "csv",
+    search: Optional[str] = None,
+    is_active: Optional[bool] = None,
+    gzip: bool = False,
+):
+    # Streamed from a server-side cursor; uses its own connection for the
+    # whole download rather than a request session
+    media_type, extension = EXPORT_FORMATS[format]
+    filename = f"products.{extension}"
+    if gzip:
+        media_type, filename = "application/gzip", filename + ".gz"
+    return StreamingResponse(
+        export_products(format, search, is_active, gzip),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+async def emit_bulk_event(results):
+    # One event for the whole batch instead of one per product
+    changes = {}
+    for sku, status, _ in results:
+        if status in ("created", "updated", "deleted"):
+            changes.setdefault(status, []).append(sku)
+    if not changes:
+        return
+    await invalidate_products([sku for skus in changes.values() for sku in skus])
+    await catalogue_changed()
+    from app.outbox import emit_event
+    await emit_event("product.bulk_changed", changes)
+
+@router.post("/products/bulk", response_model=BulkResponse)
+async def bulk_upsert_products(request: BulkUpsertRequest, db: AsyncSession = Depends(get_db)):
+    results, changes = await bulk_upsert(db, request.items)
+    await db.commit()
+    await count_changes(changes)
+    await emit_bulk_event(results)
+    return summarize(results)
+
+@router.patch("/products/bulk", response_model=BulkResponse)
+async def bulk_patch_products(request: BulkPatchRequest, db: AsyncSession = Depends(get_db)):
+    results, changes = await bulk_patch(db, request.items)
+    await db.commit()
+    await count_changes(changes)
+    await emit_bulk_event(results)
+    return summarize(results)
+
+@router.post("/products/bulk/delete", response_model=BulkResponse)
+async def bulk_delete_products(request: BulkDeleteRequest, db: AsyncSession = Depends(get_db)):
+    results, changes = await bulk_delete(db, request.skus)
+    await db.commit()
+    await count_changes(changes)
+    await emit_bulk_event(results)
+    return summarize(results)
 
 from fastapi import Form, Request
 from fastapi.templating import Jinja2Templates
@@ -56,20 +160,41 @@ async def create_product(
     db.add(new_product)
     await db.commit()
     await db.refresh(new_product)
+    await catalogue_changed()
+    await count_change(None, True)
     
     # Trigger webhook
-    from app.tasks import trigger_webhooks
-    trigger_webhooks.delay("product.created", {"sku": sku})
+    from app.outbox import emit_event
+    await emit_event("product.created", {"sku": sku})
 
     return templates.TemplateResponse("partials/product_row.html", {"request": request, "product": new_product})
 
-@router.get("/products/{sku}", response_model=ProductResponse)
-async def get_product(sku: str, db: AsyncSession = Depends(get_db)):
+async def load_product_json(db, sku):
     result = await db.execute(select(Product).filter(Product.sku == sku))
     product = result.scalars().first()
     if not product:
+        return None
+    return ProductResponse.model_validate(product).model_dump_json()
+
+def etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    candidates = [value.strip().removeprefix("W/") for value in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates
+
+@router.get("/products/{sku}", response_model=ProductResponse)
+async def get_product(sku: str, request: Request, db: AsyncSession = Depends(get_db)):
+    # Misses are loaded from the primary: a lagging replica could put the
+    # version from before an update back into the cache right after it was
+    # invalidated. Hits never touch the database.
+    body = await product_cache.get_or_load("json", sku, lambda: load_product_json(db, sku))
+    if body is None:
         raise HTTPException(status_code=404, detail="Product not found")
-    return product
+
+    etag = '"' + hashlib.sha1(body.encode()).hexdigest() + '"'
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    return Response(content=body, media_type="application/json", headers={"ETag": etag})
 
 @router.put("/products/{sku}", response_model=ProductResponse)
 async def update_product(sku: str, product_update: ProductUpdate, db: AsyncSession = Depends(get_db)):
@@ -78,16 +203,20 @@ async def update_product(sku: str, product_update: ProductUpdate, db: AsyncSessi
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
     
+    was_active = product.is_active
     update_data = product_update.dict(exclude_unset=True)
     for key, value in update_data.items():
         setattr(product, key, value)
     
     await db.commit()
     await db.refresh(product)
+    await invalidate_product(sku)
+    await catalogue_changed()
+    await count_change(was_active, product.is_active)
     
     # Trigger webhook
-    from app.tasks import trigger_webhooks
-    trigger_webhooks.delay("product.updated", {"sku": sku})
+    from app.outbox import emit_event
+    await emit_event("product.updated", {"sku": sku})
     
     return product
 
@@ -98,23 +227,25 @@ async def delete_product(sku: str, db: AsyncSession = Depends(get_db)):
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
     
+    was_active = product.is_active
     await db.delete(product)
     await db.commit()
+    await invalidate_product(sku)
+    await catalogue_changed()
+    await count_change(was_active, None)
     
     # Trigger webhook
-    from app.tasks import trigger_webhooks
-    trigger_webhooks.delay("product.deleted", {"sku": sku})
+    from app.outbox import emit_event
+    await emit_event("product.deleted", {"sku": sku})
     
     return {"message": "Product deleted successfully"}
 
-@router.delete("/products")
-async def delete_all_products(db: AsyncSession = Depends(get_db)):
-    # Using delete() instead of truncate for compatibility, though truncate is faster
-    await db.execute(delete(Product))
-    await db.commit()
-    
-    # Trigger webhook
-    from app.tasks import trigger_webhooks
-    trigger_webhooks.delay("product.deleted_all", {})
-    
-    return {"message": "All products deleted successfully"}
+@router.delete("/products", status_code=202)
+async def delete_all_products():
+    # Runs in the background (TRUNCATE, or keyset-batched DELETEs when the
+    # table is busy); follow it on /api/progress/{task_id} like an import
+    from app.tasks import purge_products
+    task_id = str(uuid.uuid4())
+    purge_products.delay(task_id)
+
+    return {"task_id": task_id, "message": "Deleting all products in the background."}
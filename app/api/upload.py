@@ -1,48 +1,113 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException
-from fastapi.responses import StreamingResponse
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import FileResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from app.tasks import process_csv_upload
-import shutil
+import asyncio
 import os
 import uuid
-import asyncio
-import redis
+import json
 
 from app.config import settings
+from app.progress import progress_hub
+from app.queues import RETRY_AFTER_SECONDS, ImportQueueFull, admit_import, import_queue
+from app.readers import estimate_rows
+from app.rejects import rejects_path
+from app.uploads import UploadRejected, find_imported_upload, spool_multipart_upload
 
 router = APIRouter()
 
 UPLOAD_DIR = settings.UPLOAD_DIR
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
-redis_client = redis.Redis.from_url(settings.CELERY_BROKER_URL)
-
-@router.post("/upload")
-async def upload_products(file: UploadFile = File(...)):
-    if not file.filename.endswith('.csv'):
-        raise HTTPException(status_code=400, detail="Invalid file format. Please upload a CSV file.")
+# CSV and NDJSON may be gzip/zstd compressed; Parquet compresses internally
+ALLOWED_SUFFIXES = tuple(
+    base + compression
+    for base in (".csv", ".ndjson", ".jsonl")
+    for compression in ("", ".gz", ".zst")
+) + (".parquet",)
+# The worker tells the format from the stored file's suffix
+FORMAT_SUFFIXES = {"csv": ".csv", "ndjson": ".ndjson", "parquet": ".parquet"}
+COMPRESSION_SUFFIXES = {"gzip": ".gz", "zstd": ".zst"}
 
+@router.post("/upload", openapi_extra={
+    "requestBody": {
+        "required": True,
+        "content": {"multipart/form-data": {"schema": {
+            "type": "object",
+            "properties": {"file": {"type": "string", "format": "binary"}},
+            "required": ["file"],
+        }}},
+    },
+})
+async def upload_products(request: Request, force: bool = False):
+    # The body is streamed straight to disk; a missing column or a non-CSV file
+    # is rejected as soon as the header line has arrived.
     task_id = str(uuid.uuid4())
-    file_path = os.path.join(UPLOAD_DIR, f"{task_id}.csv")
+    spool_path = os.path.join(UPLOAD_DIR, f"{task_id}.part")
+    try:
+        upload = await spool_multipart_upload(request, spool_path, ALLOWED_SUFFIXES)
+    except UploadRejected as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+    if not force:
+        previous = await asyncio.to_thread(find_imported_upload, upload.content_hash)
+        if previous:
+            await run_in_threadpool(os.remove, spool_path)
+            return {
+                "task_id": previous["task_id"],
+                "duplicate": True,
+                "message": "This file was already imported and the catalogue hasn't changed since.",
+            }
 
-    task = process_csv_upload.delay(file_path, task_id)
+    # Large imports get their own queue and a limited number of slots. Redis
+    # and the broker are only reached through sync clients, so off the event loop.
+    rows = await asyncio.to_thread(estimate_rows, spool_path, upload.format)
+    queue = import_queue(rows)
+    try:
+        position = await asyncio.to_thread(admit_import, task_id, queue)
+    except ImportQueueFull as e:
+        await run_in_threadpool(os.remove, spool_path)
+        raise HTTPException(
+            status_code=429,
+            detail={"message": f"{e}. Try again later.", "queue_position": e.position},
+            headers={"Retry-After": str(RETRY_AFTER_SECONDS)},
+        )
 
-    return {"task_id": task_id, "message": "File uploaded successfully. Processing started."}
+    suffix = FORMAT_SUFFIXES[upload.format] + COMPRESSION_SUFFIXES.get(upload.compression, "")
+    file_path = os.path.join(UPLOAD_DIR, task_id + suffix)
+    await run_in_threadpool(os.replace, spool_path, file_path)
+
+    await asyncio.to_thread(
+        process_csv_upload.apply_async, (file_path, task_id), {"content_hash": upload.content_hash}, queue=queue,
+    )
+
+    return {
+        "task_id": task_id,
+        "duplicate": False,
+        "size": upload.size,
+        "sha256": upload.content_hash,
+        "queue": queue,
+        "queue_position": position,
+        "message": "File uploaded successfully. Processing started.",
+    }
 
 @router.get("/progress/{task_id}")
 async def get_progress(task_id: str):
+    # Pushed by the worker over Redis pub/sub; every client watching the same
+    # task shares one subscription. The stream ends on completion or failure.
     async def event_generator():
-        while True:
-            progress = redis_client.get(f"progress:{task_id}")
-            if progress:
-                yield f"data: {int(progress)}\n\n"
-                if int(progress) >= 100:
-                    break
+        async for event in progress_hub.stream(task_id):
+            if event is None:
+                yield ": keepalive\n\n"
             else:
-                yield f"data: 0\n\n"
-            
-            await asyncio.sleep(1)
+                yield f"data: {json.dumps(event)}\n\n"
 
     return StreamingResponse(event_generator(), media_type="text/event-stream")
+
+@router.get("/imports/{task_id}/rejects")
+async def download_rejects(task_id: uuid.UUID):
+    # Rows the import skipped: line, reason, then the row in the upload's columns
+    path = rejects_path(str(task_id))
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="No rejected rows for this import")
+    return FileResponse(path, media_type="text/csv", filename=f"{task_id}-rejects.csv")
@@ -2,10 +2,13 @@ from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 from sqlalchemy import delete
-from typing import List
+from typing import List, Literal
 from app.database import get_db
 from app.models import Webhook
 from app.schemas import WebhookCreate, WebhookResponse
+from app.webhook_delivery import deliver, record_deliveries
+from app.cache import invalidate_webhooks, read_stats
+import time
 
 router = APIRouter()
 
@@ -14,6 +17,15 @@ async def list_webhooks(db: AsyncSession = Depends(get_db)):
     result = await db.execute(select(Webhook))
     return result.scalars().all()
 
+@router.get("/webhooks/cache-stats")
+async def webhook_cache_stats():
+    # Hit/miss counters summed over all processes (flushed every few seconds)
+    stats = read_stats()
+    return {
+        "hits": stats.get("webhook_subscriptions:hits", 0),
+        "misses": stats.get("webhook_subscriptions:misses", 0),
+    }
+
 from fastapi import Form, Request
 from fastapi.templating import Jinja2Templates
 
@@ -24,13 +36,15 @@ async def create_webhook(
     request: Request,
     url: str = Form(...), 
     event_type: str = Form(...), 
+    delivery_mode: Literal["event", "batch"] = Form("event"),
     db: AsyncSession = Depends(get_db)
 ):
-    webhook_data = WebhookCreate(url=url, event_type=event_type)
+    webhook_data = WebhookCreate(url=url, event_type=event_type, delivery_mode=delivery_mode)
     new_webhook = Webhook(**webhook_data.dict())
     db.add(new_webhook)
     await db.commit()
     await db.refresh(new_webhook)
+    await invalidate_webhooks()
     
     return templates.TemplateResponse("partials/webhook_row.html", {"request": request, "webhook": new_webhook})
 
@@ -43,6 +57,7 @@ async def delete_webhook(webhook_id: int, db: AsyncSession = Depends(get_db)):
 
     await db.delete(webhook)
     await db.commit()
+    await invalidate_webhooks()
     return {"message": "Webhook deleted successfully"}
 
 @router.post("/webhooks/{webhook_id}/test")
@@ -52,27 +67,23 @@ async def test_webhook(request: Request, webhook_id: int, db: AsyncSession = Dep
     if not webhook:
         raise HTTPException(status_code=404, detail="Webhook not found")
     
-    import requests
-    import time
-    
-    start_time = time.time()
-    try:
-        response = requests.post(
-            webhook.url, 
-            json={
-                "event": "test", 
-                "message": "This is a test event from Acme Importer",
-                "timestamp": time.time()
-            }, 
-            timeout=5
-        )
-        duration = int((time.time() - start_time) * 1000)
-        status_code = response.status_code
-        success = 200 <= status_code < 300
-    except Exception as e:
-        duration = int((time.time() - start_time) * 1000)
-        status_code = "Error"
-        success = False
+    # Same pooled async client as the worker, so the event loop is never blocked
+    result = await deliver(
+        webhook.url,
+        {
+            "event": "test",
+            "message": "This is a test event from Acme Importer",
+            "timestamp": time.time()
+        },
+        "test",
+        webhook_id=webhook.id,
+        max_retries=0,
+    )
+    await record_deliveries([result])
+
+    duration = result["latency_ms"]
+    status_code = result["status_code"] if result["status_code"] is not None else "Error"
+    success = result["success"]
         
     return templates.TemplateResponse(
         "partials/webhook_test_result.html", 
@@ -0,0 +1,162 @@
+from collections import Counter
+
+from sqlalchemy import text
+
+from app.importer import SKIP_UNCHANGED_SQL
+from app.readers import MAX_NAME_LENGTH, MAX_SKU_LENGTH
+
+# Each batch is one statement over unnest()ed arrays: four parameters however
+# many items there are, and one round trip instead of one per product. The
+# outer SELECT still sees the table as it was before the upsert, which gives
+# the previous is_active for the stats counts.
+BULK_UPSERT_SQL = f"""
+WITH upserted AS (
+    INSERT INTO products (sku, name, description, is_active)
+    SELECT * FROM unnest(
+        CAST(:skus AS varchar[]), CAST(:names AS varchar[]),
+        CAST(:descriptions AS text[]), CAST(:is_active AS boolean[])
+    )
+    ON CONFLICT (sku) DO UPDATE SET
+        name = EXCLUDED.name,
+        description = EXCLUDED.description,
+        is_active = EXCLUDED.is_active,
+        updated_at = now()
+    WHERE {SKIP_UNCHANGED_SQL}
+    RETURNING sku, (xmax = 0) AS inserted, is_active
+)
+SELECT upserted.sku, upserted.inserted, products.is_active AS old_active, upserted.is_active
+FROM upserted
+LEFT JOIN products ON products.sku = upserted.sku
+"""
+
+# The set_* flags tell a field that was left out of the patch from one
+# explicitly set to null. The final SELECT sees the table as it was before the
+# UPDATE, which is what tells unchanged products from missing ones.
+BULK_PATCH_SQL = """
+WITH patch AS (
+    SELECT * FROM unnest(
+        CAST(:skus AS varchar[]),
+        CAST(:names AS varchar[]), CAST(:set_names AS boolean[]),
+        CAST(:descriptions AS text[]), CAST(:set_descriptions AS boolean[]),
+        CAST(:is_active AS boolean[]), CAST(:set_is_active AS boolean[])
+    ) AS patch(sku, name, set_name, description, set_description, is_active, set_is_active)
+),
+changed AS (
+    UPDATE products SET
+        name = CASE WHEN patch.set_name THEN patch.name ELSE products.name END,
+        description = CASE WHEN patch.set_description THEN patch.description ELSE products.description END,
+        is_active = CASE WHEN patch.set_is_active THEN patch.is_active ELSE products.is_active END,
+        updated_at = now()
+    FROM patch
+    WHERE products.sku = patch.sku
+      AND (products.name, products.description, products.is_active) IS DISTINCT FROM (
+          CASE WHEN patch.set_name THEN patch.name ELSE products.name END,
+          CASE WHEN patch.set_description THEN patch.description ELSE products.description END,
+          CASE WHEN patch.set_is_active THEN patch.is_active ELSE products.is_active END
+      )
+    RETURNING products.sku, products.is_active
+)
+SELECT patch.sku, changed.sku IS NOT NULL AS changed, products.sku IS NOT NULL AS found,
+       products.is_active AS old_active, changed.is_active
+FROM patch
+LEFT JOIN changed ON changed.sku = patch.sku
+LEFT JOIN products ON products.sku = patch.sku
+"""
+
+BULK_DELETE_SQL = "DELETE FROM products WHERE sku = ANY(CAST(:skus AS varchar[])) RETURNING sku, is_active"
+
+
+def item_error(sku, name=None, description=None):
+    # The checks imports apply per row. Any of these would fail the statement,
+    # and with it every other item in the request.
+    if not sku:
+        return "missing sku"
+    if any(value and "\x00" in value for value in (sku, name, description)):
+        return "contains a NUL character"
+    if len(sku) > MAX_SKU_LENGTH:
+        return f"sku is longer than {MAX_SKU_LENGTH} characters"
+    if name is not None and len(name) > MAX_NAME_LENGTH:
+        return f"name is longer than {MAX_NAME_LENGTH} characters"
+    return None
+
+
+def split_invalid(items):
+    valid, invalid = [], []
+    for item in items:
+        error = item_error(item.sku, item.name, item.description)
+        if error:
+            invalid.append((item.sku, "invalid", error))
+        else:
+            valid.append(item)
+    return valid, invalid
+
+
+def last_per_sku(items):
+    # A SKU listed twice would hit the same row twice in one statement, which
+    # Postgres refuses; the last occurrence wins, as in imports.
+    return list({item.sku: item for item in items}.values())
+
+
+# Each bulk_* function returns (results, changes): a (sku, status, error) per
+# item and the (old, new) is_active pairs for app.stats.count_changes. Invalid
+# items are reported with status "invalid" and left out of the statement.
+
+async def bulk_upsert(db, items):
+    items, invalid = split_invalid(items)
+    items = last_per_sku(items)
+    result = await db.execute(text(BULK_UPSERT_SQL), {
+        "skus": [item.sku for item in items],
+        "names": [item.name for item in items],
+        "descriptions": [item.description for item in items],
+        "is_active": [item.is_active for item in items],
+    })
+    written, changes = {}, []
+    for sku, inserted, old_active, is_active in result.all():
+        written[sku] = "created" if inserted else "updated"
+        changes.append((None if inserted else old_active, is_active))
+    return invalid + [(item.sku, written.get(item.sku, "unchanged"), None) for item in items], changes
+
+
+async def bulk_patch(db, items):
+    # Patches for the same SKU are merged in order before going to the database
+    items, invalid = split_invalid(items)
+    merged = {}
+    for item in items:
+        merged.setdefault(item.sku, {}).update(item.model_dump(exclude_unset=True, exclude={"sku"}))
+    skus = list(merged)
+
+    def column(field):
+        return [merged[sku].get(field) for sku in skus], [field in merged[sku] for sku in skus]
+
+    names, set_names = column("name")
+    descriptions, set_descriptions = column("description")
+    is_active, set_is_active = column("is_active")
+    result = await db.execute(text(BULK_PATCH_SQL), {
+        "skus": skus,
+        "names": names, "set_names": set_names,
+        "descriptions": descriptions, "set_descriptions": set_descriptions,
+        "is_active": is_active, "set_is_active": set_is_active,
+    })
+    statuses, changes = {}, []
+    for sku, changed, found, old_active, is_active in result.all():
+        statuses[sku] = "updated" if changed else "unchanged" if found else "not_found"
+        if changed:
+            changes.append((old_active, is_active))
+    return invalid + [(sku, statuses[sku], None) for sku in skus], changes
+
+
+async def bulk_delete(db, skus):
+    errors = {sku: error for sku in skus if (error := item_error(sku))}
+    invalid = [(sku, "invalid", errors[sku]) for sku in skus if sku in errors]
+    skus = list(dict.fromkeys(sku for sku in skus if sku not in errors))
+    result = await db.execute(text(BULK_DELETE_SQL), {"skus": skus})
+    deleted = dict(result.all())
+    changes = [(is_active, None) for is_active in deleted.values()]
+    return invalid + [(sku, "deleted" if sku in deleted else "not_found", None) for sku in skus], changes
+
+
+def summarize(results):
+    return {
+        "results": [{"sku": sku, "status": status, "error": error} for sku, status, error in results],
+        "counts": dict(Counter(status for _, status, _ in results)),
+    }
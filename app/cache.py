@@ -0,0 +1,333 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import NamedTuple
+
+import redis
+import redis.asyncio
+
+from app.config import settings
+
+INVALIDATION_CHANNEL = "cache:invalidate"
+STATS_KEY = "cache:stats"
+STATS_FLUSH_INTERVAL = 10
+
+redis_client = redis.Redis.from_url(settings.CELERY_BROKER_URL)
+# Used on the web app's request path, where a blocking call would stall the event loop
+async_redis_client = redis.asyncio.Redis.from_url(settings.CELERY_BROKER_URL)
+
+
+class InvalidationBus:
+    """Fans cache invalidations out to every web and worker process over Redis pub/sub.
+
+    Each process runs one daemon thread subscribed to INVALIDATION_CHANNEL and
+    calls the handlers registered for the message's "kind". The thread also
+    flushes the local hit/miss counters into the STATS_KEY hash, so counters
+    from all processes can be read in one place.
+    """
+
+    def __init__(self):
+        self._handlers = {}
+        self._counters = []
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def subscribe(self, kind, handler):
+        self._handlers.setdefault(kind, []).append(handler)
+
+    def track(self, cache):
+        self._counters.append(cache)
+
+    def publish(self, kind, **data):
+        message = {"kind": kind, **data}
+        # Apply locally right away; our own listener will see it again, which is harmless
+        self._dispatch(message)
+        redis_client.publish(INVALIDATION_CHANNEL, json.dumps(message))
+
+    async def publish_async(self, kind, **data):
+        # publish() for the web app's request path
+        message = {"kind": kind, **data}
+        self._dispatch(message)
+        await async_redis_client.publish(INVALIDATION_CHANNEL, json.dumps(message))
+
+    def ensure_started(self):
+        # Threads do not survive fork, so check per process
+        if self._pid == os.getpid() and self._thread and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="cache-invalidation", daemon=True)
+            self._thread.start()
+
+    def _dispatch(self, message):
+        kinds = self._handlers if message.get("kind") == "*" else [message.get("kind")]
+        for kind in kinds:
+            for handler in self._handlers.get(kind, []):
+                handler(message)
+
+    def _run(self):
+        last_flush = time.monotonic()
+        while True:
+            try:
+                pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(INVALIDATION_CHANNEL)
+                # Anything published while we were not subscribed is lost, so start clean
+                self._dispatch({"kind": "*"})
+                while True:
+                    message = pubsub.get_message(timeout=1.0)
+                    if message and message["type"] == "message":
+                        self._dispatch(json.loads(message["data"]))
+                    if time.monotonic() - last_flush >= STATS_FLUSH_INTERVAL:
+                        self._flush_stats()
+                        last_flush = time.monotonic()
+            except redis.RedisError:
+                time.sleep(1)
+
+    def _flush_stats(self):
+        pipe = redis_client.pipeline()
+        for cache in self._counters:
+            hits, misses = cache.take_counts()
+            if hits:
+                pipe.hincrby(STATS_KEY, f"{cache.name}:hits", hits)
+            if misses:
+                pipe.hincrby(STATS_KEY, f"{cache.name}:misses", misses)
+        pipe.execute()
+
+
+invalidation_bus = InvalidationBus()
+
+
+def read_stats():
+    return {key.decode(): int(value) for key, value in redis_client.hgetall(STATS_KEY).items()}
+
+
+class CountingCache:
+    name = None
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._reported = (0, 0)
+        invalidation_bus.track(self)
+
+    def take_counts(self):
+        # Counts since the previous call, for the bus's periodic stats flush
+        hits, misses = self.hits, self.misses
+        reported_hits, reported_misses = self._reported
+        self._reported = (hits, misses)
+        return hits - reported_hits, misses - reported_misses
+
+
+class Subscription(NamedTuple):
+    id: int
+    url: str
+    event_type: str
+    delivery_mode: str
+
+
+class SubscriptionCache(CountingCache):
+    """Per-process cache of active webhook subscriptions, keyed by event type."""
+
+    name = "webhook_subscriptions"
+
+    def __init__(self, ttl):
+        super().__init__()
+        self.ttl = ttl
+        self._entries = {}
+        # Bumped on every invalidation so a load that raced with one is not stored
+        self._generation = 0
+        invalidation_bus.subscribe("webhooks", self.clear)
+
+    def clear(self, message=None):
+        self._generation += 1
+        self._entries = {}
+
+    async def get(self, event_types, loader):
+        # loader(event_types) returns the active Webhook rows for those types
+        invalidation_bus.ensure_started()
+        now = time.monotonic()
+        found = []
+        missing = []
+        for event_type in event_types:
+            entry = self._entries.get(event_type)
+            if entry and entry[0] > now:
+                self.hits += 1
+                found.extend(entry[1])
+            else:
+                self.misses += 1
+                missing.append(event_type)
+
+        if missing:
+            generation = self._generation
+            loaded = {event_type: [] for event_type in missing}
+            for webhook in await loader(missing):
+                loaded[webhook.event_type].append(
+                    Subscription(webhook.id, webhook.url, webhook.event_type, webhook.delivery_mode)
+                )
+            if generation == self._generation:
+                expires_at = now + self.ttl
+                for event_type, subscriptions in loaded.items():
+                    self._entries[event_type] = (expires_at, subscriptions)
+            for subscriptions in loaded.values():
+                found.extend(subscriptions)
+
+        return found
+
+
+subscription_cache = SubscriptionCache(settings.WEBHOOK_CACHE_TTL)
+
+
+async def invalidate_webhooks():
+    await invalidation_bus.publish_async("webhooks")
+
+
+PRODUCT_VERSION_KEY = "cache:products:version"
+# "json": serialized ProductResponse, "row": rendered partials/product_row.html
+PRODUCT_CACHE_KINDS = ("json", "row")
+
+
+def product_cache_key(version, kind, sku):
+    return f"cache:product:{version}:{kind}:{sku}"
+
+
+def product_generation_key(sku):
+    # Bumped on every invalidation of the product, see FILL_PRODUCT_SCRIPT
+    return f"cache:product:generation:{sku}"
+
+
+# Only fills the cache if the product wasn't invalidated since its generation
+# was read, which was before loading it. Otherwise a reader that loaded the
+# old row could put it back right after the writer deleted the key.
+FILL_PRODUCT_SCRIPT = """
+if redis.call('GET', KEYS[2]) ~= (ARGV[3] ~= '' and ARGV[3] or false) then
+    return 0
+end
+redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+return 1
+"""
+fill_product_script = async_redis_client.register_script(FILL_PRODUCT_SCRIPT)
+
+
+class ProductCache(CountingCache):
+    """Read-through cache for single products: a small per-process LRU in front of Redis.
+
+    Redis keys embed a catalogue version, so bulk writes (imports, delete all)
+    invalidate everything with one INCR and the old keys simply expire.
+    Single products are filled with a compare-and-set on a per-SKU generation.
+    """
+
+    name = "products"
+
+    def __init__(self, max_entries, local_ttl, ttl):
+        super().__init__()
+        self.max_entries = max_entries
+        self.local_ttl = local_ttl
+        self.ttl = ttl
+        self._local = OrderedDict()
+        # The invalidation thread drops entries while requests read and reorder
+        # them; every access to _local and _generation holds this lock
+        self._lock = threading.Lock()
+        self._version = None
+        self._generation = 0
+        invalidation_bus.subscribe("product", self._drop_product)
+        invalidation_bus.subscribe("products", self._drop_all)
+
+    def _drop_product(self, message):
+        skus = message.get("skus") or ([message["sku"]] if message.get("sku") is not None else None)
+        if not skus:
+            self._drop_all(message)
+            return
+        with self._lock:
+            self._generation += 1
+            for sku in skus:
+                for kind in PRODUCT_CACHE_KINDS:
+                    self._local.pop((kind, sku), None)
+
+    def _drop_all(self, message):
+        with self._lock:
+            self._generation += 1
+            self._version = None
+            self._local = OrderedDict()
+
+    async def _current_version(self):
+        if self._version is None:
+            self._version = int(await async_redis_client.get(PRODUCT_VERSION_KEY) or 0)
+        return self._version
+
+    async def get_or_load(self, kind, sku, loader):
+        # loader() returns the value as a str, or None for a missing product (not cached)
+        invalidation_bus.ensure_started()
+        key = (kind, sku)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._local.get(key)
+            if entry and entry[0] > now:
+                self._local.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            generation = self._generation
+
+        version = await self._current_version()
+        redis_key = product_cache_key(version, kind, sku)
+        generation_key = product_generation_key(sku)
+        value, sku_generation = await async_redis_client.mget(redis_key, generation_key)
+        if value is not None:
+            self.hits += 1
+            value = value.decode()
+        else:
+            self.misses += 1
+            value = await loader()
+            if value is None:
+                return None
+            await fill_product_script(keys=[redis_key, generation_key], args=[value, self.ttl, sku_generation or ""])
+
+        with self._lock:
+            if generation == self._generation:
+                self._local[key] = (now + self.local_ttl, value)
+                self._local.move_to_end(key)
+                while len(self._local) > self.max_entries:
+                    self._local.popitem(last=False)
+        return value
+
+
+product_cache = ProductCache(
+    settings.PRODUCT_CACHE_LOCAL_SIZE,
+    settings.PRODUCT_CACHE_LOCAL_TTL,
+    settings.PRODUCT_CACHE_TTL,
+)
+
+
+async def _drop_products(skus):
+    version = int(await async_redis_client.get(PRODUCT_VERSION_KEY) or 0)
+    pipe = async_redis_client.pipeline(transaction=False)
+    # Bumped before the delete, so a fill landing in between is deleted too.
+    # The generation outlives any fill that started before this invalidation.
+    for sku in skus:
+        pipe.incr(product_generation_key(sku))
+        pipe.expire(product_generation_key(sku), product_cache.ttl * 2)
+    pipe.delete(*(product_cache_key(version, kind, sku) for sku in skus for kind in PRODUCT_CACHE_KINDS))
+    await pipe.execute()
+
+
+async def invalidate_product(sku):
+    await _drop_products([sku])
+    await invalidation_bus.publish_async("product", sku=sku)
+
+
+async def invalidate_products(skus):
+    # One round trip and one broadcast for a whole batch of products
+    if not skus:
+        return
+    await _drop_products(skus)
+    await invalidation_bus.publish_async("product", skus=list(skus))
+
+
+def invalidate_all_products():
+    # Only called from the worker, outside any event loop
+    version = redis_client.incr(PRODUCT_VERSION_KEY)
+    invalidation_bus.publish("products", version=version)
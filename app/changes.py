@@ -0,0 +1,65 @@
+from typing import NamedTuple
+
+from sqlalchemy import text
+
+from app.database import AsyncSessionLocal
+
+# Most changes one feed page may return
+MAX_CHANGES_PAGE = 1000
+
+# Both halves are index range scans on change_seq, each stopping after
+# :limit rows. A change is settled once its transaction is older than every
+# transaction still running: until then a transaction still in flight may
+# commit a lower change_seq, which a consumer already past it would miss.
+CHANGES_SQL = """
+WITH horizon AS (
+    SELECT age((pg_snapshot_xmin(pg_current_snapshot())::text::numeric % 4294967296)::text::xid) AS running_age
+), changes AS (
+    (SELECT change_seq, sku, name, description, is_active, coalesce(updated_at, created_at) AS changed_at,
+            false AS deleted, age(xmin) AS xmin_age
+     FROM products WHERE change_seq > :since ORDER BY change_seq LIMIT :limit)
+    UNION ALL
+    (SELECT change_seq, sku, NULL, NULL, NULL, deleted_at, true, age(xmin)
+     FROM product_tombstones WHERE change_seq > :since ORDER BY change_seq LIMIT :limit)
+)
+SELECT change_seq, sku, name, description, is_active, changed_at, deleted, xmin_age > running_age AS settled
+FROM changes, horizon
+ORDER BY change_seq
+LIMIT :limit
+"""
+
+# The highest change_seq handed out so far, committed or not
+CURRENT_SEQ_SQL = "SELECT CASE WHEN is_called THEN last_value ELSE 0 END FROM product_change_seq"
+
+
+class ChangePage(NamedTuple):
+    changes: list
+    next_since: int
+    has_more: bool
+
+
+async def current_change_seq():
+    async with AsyncSessionLocal() as session:
+        return (await session.execute(text(CURRENT_SEQ_SQL))).scalar()
+
+
+async def last_feed_reset(db):
+    # Positions before this one were invalidated by a delete-all
+    return (await db.execute(text("SELECT max(change_seq) FROM product_feed_resets"))).scalar()
+
+
+async def fetch_changes(db, since, limit):
+    """Product changes after `since` in change_seq order, stopping at the first unsettled one.
+
+    next_since is the position to pass back; it stays at `since` while
+    nothing new has settled. has_more tells the consumer to fetch again now
+    rather than poll later.
+    """
+    result = await db.execute(text(CHANGES_SQL), {"since": since, "limit": limit + 1})
+    rows = result.all()
+    changes = []
+    for row in rows[:limit]:
+        if not row.settled:
+            return ChangePage(changes, changes[-1].change_seq if changes else since, False)
+        changes.append(row)
+    return ChangePage(changes, changes[-1].change_seq if changes else since, len(rows) > limit)
@@ -0,0 +1,168 @@
+import asyncio
+import json
+import time
+
+import redis
+
+from app.config import settings
+
+# task_id -> time of the last heartbeat, for every import that hasn't finished
+ACTIVE_IMPORTS_KEY = "imports:active"
+# task_id -> admission or last heartbeat time, for every large import queued
+# or running; see app.queues
+LARGE_IMPORTS_KEY = "imports:large"
+CHECKPOINT_TTL = 7 * 24 * 60 * 60
+
+redis_client = redis.Redis.from_url(settings.CELERY_BROKER_URL)
+
+
+def import_key(task_id):
+    # How to restart the import, plus its latest checkpoint
+    return f"import:{task_id}"
+
+
+def lock_key(task_id):
+    return f"import:{task_id}:lock"
+
+
+def register_import(task_id, **info):
+    pipe = redis_client.pipeline()
+    pipe.hset(import_key(task_id), mapping={"info": json.dumps(info), "state": "running"})
+    pipe.expire(import_key(task_id), CHECKPOINT_TTL)
+    pipe.zadd(ACTIVE_IMPORTS_KEY, {task_id: time.time()})
+    pipe.execute()
+
+
+def remember_change_start(task_id, change_seq):
+    # Kept from the first attempt, so a resumed or restarted import still
+    # reports a change feed range that covers every row it wrote
+    pipe = redis_client.pipeline()
+    pipe.hsetnx(import_key(task_id), "change_since", change_seq)
+    pipe.hget(import_key(task_id), "change_since")
+    return int(pipe.execute()[-1])
+
+
+def change_start(task_id):
+    value = redis_client.hget(import_key(task_id), "change_since")
+    return int(value) if value else None
+
+
+def acquire_import(task_id, worker_id):
+    """Claim an import for this worker; False while another worker is still heartbeating it.
+
+    With acks_late the broker can hand a running import to a second worker, e.g.
+    once the Redis visibility timeout expires, so only the lock holder imports.
+    """
+    key = lock_key(task_id)
+    if redis_client.set(key, worker_id, nx=True, ex=settings.IMPORT_STALL_SECONDS):
+        return True
+    return redis_client.get(key) == worker_id.encode()
+
+
+def is_running(task_id):
+    return bool(redis_client.exists(lock_key(task_id)))
+
+
+def heartbeat(task_id):
+    pipe = redis_client.pipeline()
+    pipe.zadd(ACTIVE_IMPORTS_KEY, {task_id: time.time()}, xx=True)
+    pipe.zadd(LARGE_IMPORTS_KEY, {task_id: time.time()}, xx=True)
+    pipe.expire(lock_key(task_id), settings.IMPORT_STALL_SECONDS)
+    pipe.execute()
+
+
+async def heartbeating(task_id, awaitable):
+    """Await `awaitable` while heartbeating the import in the background.
+
+    For phases where one statement can outlast IMPORT_STALL_SECONDS without a
+    batch to heartbeat from: the final staging merge, the sharded merge and
+    CREATE INDEX CONCURRENTLY.
+    """
+    async def beat():
+        while True:
+            await asyncio.sleep(settings.IMPORT_STALL_SECONDS / 3)
+            heartbeat(task_id)
+
+    beating = asyncio.ensure_future(beat())
+    try:
+        return await awaitable
+    finally:
+        beating.cancel()
+        await asyncio.gather(beating, return_exceptions=True)
+
+
+def save_checkpoint(task_id, offset, line, rows, **counts):
+    # Everything before `offset` (line `line`, the first `rows` rows) is committed
+    checkpoint = {"offset": offset, "line": line, "rows": rows, **counts}
+    pipe = redis_client.pipeline()
+    pipe.hset(import_key(task_id), "checkpoint", json.dumps(checkpoint))
+    pipe.zadd(ACTIVE_IMPORTS_KEY, {task_id: time.time()}, xx=True)
+    pipe.zadd(LARGE_IMPORTS_KEY, {task_id: time.time()}, xx=True)
+    pipe.expire(lock_key(task_id), settings.IMPORT_STALL_SECONDS)
+    pipe.execute()
+
+
+def load_checkpoint(task_id):
+    value = redis_client.hget(import_key(task_id), "checkpoint")
+    return json.loads(value) if value else None
+
+
+def clear_checkpoint(task_id):
+    redis_client.hdel(import_key(task_id), "checkpoint")
+
+
+def mark_failed(task_id, error):
+    pipe = redis_client.pipeline()
+    pipe.hset(import_key(task_id), mapping={"state": "failed", "error": error})
+    pipe.delete(lock_key(task_id))
+    pipe.execute()
+
+
+def finish_tracking(task_id):
+    pipe = redis_client.pipeline()
+    pipe.delete(import_key(task_id), lock_key(task_id))
+    pipe.zrem(ACTIVE_IMPORTS_KEY, task_id)
+    pipe.execute()
+
+
+def _import_entry(task_id, data):
+    if not data:
+        return None
+    data = {key.decode(): value.decode() for key, value in data.items()}
+    return {
+        "task_id": task_id,
+        "state": data.get("state"),
+        "error": data.get("error"),
+        "info": json.loads(data.get("info", "{}")),
+        "checkpoint": json.loads(data["checkpoint"]) if "checkpoint" in data else None,
+    }
+
+
+def get_import(task_id):
+    return _import_entry(task_id, redis_client.hgetall(import_key(task_id)))
+
+
+def stalled_imports(stall_seconds=None):
+    # Failed imports, and running ones nobody has heartbeated for a while
+    stall_seconds = stall_seconds or settings.IMPORT_STALL_SECONDS
+    cutoff = time.time() - stall_seconds
+    active = [(task_id.decode(), last_seen) for task_id, last_seen in redis_client.zrange(ACTIVE_IMPORTS_KEY, 0, -1, withscores=True)]
+    # Every import's state and lock in one round trip
+    pipe = redis_client.pipeline(transaction=False)
+    for task_id, _ in active:
+        pipe.hgetall(import_key(task_id))
+        pipe.exists(lock_key(task_id))
+    results = pipe.execute()
+    stalled = []
+    finished = []
+    for i, (task_id, last_seen) in enumerate(active):
+        entry, running = _import_entry(task_id, results[2 * i]), results[2 * i + 1]
+        if entry is None:
+            finished.append(task_id)
+            continue
+        if entry["state"] == "failed" or (last_seen < cutoff and not running):
+            entry["last_heartbeat"] = last_seen
+            stalled.append(entry)
+    if finished:
+        redis_client.zrem(ACTIVE_IMPORTS_KEY, *finished)
+    return stalled
@@ -0,0 +1,319 @@
+import asyncio
+import csv
+import time
+
+from sqlalchemy import text
+
+from app.database import AsyncSessionLocal
+from app.importer import COUNT_MERGED_SQL, SKIP_UNCHANGED_SQL, is_row_error, row_error_message
+from app.metrics import StageTimings, import_batch_rows
+from app.readers import MAX_NAME_LENGTH, MAX_SKU_LENGTH, REQUIRED_COLUMNS, pyarrow_module
+
+# The importable columns, in record order; also the column layout of rejects
+COLUMNS = ["sku", "name", "description", "is_active"]
+REJECT_COLUMNS = {name: i for i, name in enumerate(COLUMNS)}
+
+# Bytes of CSV/NDJSON Arrow parses per block
+BLOCK_SIZE = 1024 * 1024
+
+# One statement per batch over unnest()ed column arrays, as for bulk upserts
+UNNEST_UPSERT_SQL = f"""
+WITH merged AS (
+    INSERT INTO products (sku, name, description, is_active)
+    SELECT * FROM unnest(
+        CAST(:skus AS varchar[]), CAST(:names AS varchar[]),
+        CAST(:descriptions AS text[]), CAST(:is_active AS boolean[])
+    )
+    ON CONFLICT (sku) DO UPDATE SET
+        name = EXCLUDED.name,
+        description = EXCLUDED.description,
+        is_active = EXCLUDED.is_active,
+        updated_at = now()
+    WHERE {SKIP_UNCHANGED_SQL}
+    RETURNING (xmax = 0) AS inserted
+)
+{COUNT_MERGED_SQL}"""
+
+
+class ArrowSource:
+    """Reads an upload as Arrow record batches of the importable columns.
+
+    CSV and NDJSON are parsed block by block from the (decompressed) stream,
+    Parquet row group by row group from the file. CSV columns are read as
+    binary so invalid UTF-8 only rejects its row. CSV rows Arrow can't parse
+    at all (wrong number of fields) are skipped; since parsing runs on a
+    thread they are collected and passed to on_reject(line, reason, row) by
+    flush_rejects() on the caller's thread.
+    """
+
+    def __init__(self, fmt, file_path, stream, raw, total_bytes, batch_rows, on_reject=None):
+        self.pa = pyarrow_module()
+        self.fmt = fmt
+        self.file_path = file_path
+        self.stream = stream
+        self.raw = raw
+        self.total_bytes = total_bytes
+        self.batch_rows = batch_rows
+        # Number of the first data row: CSV counts its header line
+        self.first_row = 2 if fmt == "csv" else 1
+        self.on_reject = on_reject
+        self.invalid_rows = []
+        self.columns = None
+        self._rows_read = 0
+        self._total_rows = None
+
+    @property
+    def fraction(self):
+        if self._total_rows is not None:
+            return self._rows_read / self._total_rows if self._total_rows else 1.0
+        return self.raw.tell() / self.total_bytes if self.total_bytes else 1.0
+
+    def __iter__(self):
+        if self.fmt == "parquet":
+            batches = self._parquet_batches()
+        elif self.fmt == "ndjson":
+            batches = self._ndjson_batches()
+        else:
+            batches = self._csv_batches()
+        for batch in batches:
+            self._rows_read += batch.num_rows
+            yield batch
+
+    def _select(self, names):
+        # Column names are matched like CSV headers: trimmed, case-insensitive
+        columns = {}
+        for name in names:
+            columns.setdefault(name.strip().lower(), name)
+        missing = [name for name in REQUIRED_COLUMNS if name not in columns]
+        if missing:
+            raise ValueError(f"Upload is missing required columns: {', '.join(missing)}")
+        self.columns = {name: columns[name] for name in COLUMNS if name in columns}
+        return list(self.columns.values())
+
+    def _csv_batches(self):
+        # Read here so the names can be normalised before Arrow sees them
+        header = next(csv.reader([self.stream.readline().decode("utf-8-sig")]), None)
+        if header is None:
+            raise ValueError("CSV file is empty")
+        names = [name.strip().lower() for name in header]
+        self._select(names)
+
+        def on_invalid_row(row):
+            # Arrow counts from the first row after the header read above.
+            # Unlike CsvRecordReader, which pads short rows and ignores extra
+            # fields, these are rejected: Arrow can't keep them in file order.
+            fields = next(csv.reader(row.text.splitlines(keepends=True)), [])
+            self.invalid_rows.append((row.number + 1, f"malformed CSV: expected {row.expected_columns} fields, saw {row.actual_columns}", fields))
+            return "skip"
+
+        reader = self.pa.csv.open_csv(
+            self.stream,
+            read_options=self.pa.csv.ReadOptions(column_names=names, block_size=BLOCK_SIZE),
+            parse_options=self.pa.csv.ParseOptions(newlines_in_values=True, invalid_row_handler=on_invalid_row),
+            convert_options=self.pa.csv.ConvertOptions(
+                include_columns=list(self.columns.values()),
+                column_types={name: self.pa.binary() for name in self.columns.values()},
+                strings_can_be_null=False,
+            ),
+        )
+        yield from reader
+
+    def _ndjson_batches(self):
+        read_options = self.pa.json.ReadOptions(block_size=BLOCK_SIZE)
+        if hasattr(self.pa.json, "open_json"):
+            reader = self.pa.json.open_json(self.stream, read_options=read_options)
+        else:
+            # pyarrow < 19 can only read the whole file at once
+            reader = self.pa.json.read_json(self.stream, read_options=read_options).to_batches()
+        for batch in reader:
+            if self.columns is None:
+                self._select(batch.schema.names)
+            yield batch
+
+    def _parquet_batches(self):
+        parquet = self.pa.parquet.ParquetFile(self.file_path)
+        self._total_rows = parquet.metadata.num_rows
+        columns = self._select(parquet.schema_arrow.names)
+        yield from parquet.iter_batches(batch_size=self.batch_rows, columns=columns)
+
+    def flush_rejects(self):
+        while self.invalid_rows:
+            line, reason, row = self.invalid_rows.pop(0)
+            if self.on_reject:
+                self.on_reject(line, reason, row)
+
+
+class ColumnarImport:
+    """Imports Arrow record batches with vectorized validation, normalisation and dedup.
+
+    SKUs are lowercased, is_active parsed and invalid rows filtered with Arrow
+    compute functions over whole columns. Within a batch the last row per SKU
+    wins; batches are written in file order by one writer, so the last one
+    wins across batches too. Each batch goes to the database as one
+    unnest() upsert built from the column arrays, never a dict per row.
+
+    Parsing runs on a thread (Arrow releases the GIL) one batch ahead of the
+    database write. A batch refused because of some row's values is split in
+    halves until the bad rows are isolated, as in ImportPipeline.
+    """
+
+    def __init__(self, source, on_batch=None, on_reject=None):
+        self.source = source
+        self.pa = source.pa
+        self.pc = source.pa.compute
+        # on_batch(committed_rows); on_reject(record, reason) with records laid
+        # out as (row, sku, name, description, is_active)
+        self.on_batch = on_batch
+        self.on_reject = on_reject
+        self.processed_rows = 0
+        self.committed_rows = 0
+        self.inserted_rows = 0
+        self.updated_rows = 0
+        self.rejected_rows = 0
+        self.timings = StageTimings()
+        self._rows_seen = 0
+
+    async def run(self):
+        batches = iter(self.source)
+        next_batch = asyncio.create_task(asyncio.to_thread(self._read, batches))
+        async with AsyncSessionLocal() as session:
+            try:
+                while True:
+                    batch = await next_batch
+                    if batch is None:
+                        break
+                    next_batch = asyncio.create_task(asyncio.to_thread(self._read, batches))
+                    self.source.flush_rejects()
+                    for start in range(0, batch.num_rows, self.source.batch_rows):
+                        await self._import(session, batch.slice(start, self.source.batch_rows))
+            except BaseException:
+                next_batch.cancel()
+                await asyncio.gather(next_batch, return_exceptions=True)
+                raise
+        self.source.flush_rejects()
+        return self.processed_rows
+
+    def _read(self, batches):
+        started = time.perf_counter()
+        batch = next(batches, None)
+        self.timings.add("parse", time.perf_counter() - started)
+        return batch
+
+    async def _import(self, session, batch):
+        first_row = self.source.first_row + self._rows_seen
+        self._rows_seen += batch.num_rows
+        with self.timings.stage("validate"):
+            table = self._normalize(batch, first_row)
+        # Superseded rows count as processed (and unchanged), as in
+        # ImportPipeline, and so do rejected ones: they are in rejected_rows
+        with self.timings.stage("dedupe"):
+            table = self._last_per_sku(table)
+        self.processed_rows += batch.num_rows
+        import_batch_rows.observe(table.num_rows)
+        await self._write(session, table)
+        self.committed_rows += batch.num_rows
+        if self.on_batch:
+            self.on_batch(self.committed_rows)
+
+    def _strings(self, array, invalid):
+        # Binary CSV columns become strings; rows with invalid UTF-8 are marked
+        # in `invalid` and blanked, the rest of the column converts in one cast
+        pa = self.pa
+        if pa.types.is_string(array.type) or pa.types.is_large_string(array.type):
+            return array
+        if not (pa.types.is_binary(array.type) or pa.types.is_large_binary(array.type)):
+            return self.pc.cast(array, pa.string())
+        try:
+            return array.cast(pa.string())
+        except pa.ArrowInvalid:
+            values = []
+            for i, value in enumerate(array.to_pylist()):
+                try:
+                    values.append(value.decode("utf-8") if value is not None else None)
+                except UnicodeDecodeError:
+                    invalid[i] = True
+                    values.append(None)
+            return pa.array(values, pa.string())
+
+    def _normalize(self, batch, first_row):
+        pa, pc = self.pa, self.pc
+        columns = self.source.columns
+        size = batch.num_rows
+        invalid_utf8 = [False] * size
+
+        def column(name):
+            return batch.column(batch.schema.get_field_index(columns[name]))
+
+        sku = pc.utf8_lower(self._strings(column("sku"), invalid_utf8))
+        name = self._strings(column("name"), invalid_utf8)
+        description = self._strings(column("description"), invalid_utf8)
+        if "is_active" not in columns:
+            is_active = pa.array([True] * size)
+        elif pa.types.is_boolean(column("is_active").type):
+            is_active = pc.fill_null(column("is_active"), True)
+        else:
+            # A missing value means active, as when the column is absent
+            is_active = pc.fill_null(pc.equal(pc.utf8_lower(self._strings(column("is_active"), invalid_utf8)), "true"), True)
+        rows = pa.array(range(first_row, first_row + size), pa.int64())
+        table = pa.table({"row": rows, "sku": sku, "name": name, "description": description, "is_active": is_active})
+
+        # Same checks, in the same order, as CsvRecordReader
+        def has_nul(values):
+            return pc.fill_null(pc.match_substring(values, "\x00"), False)
+
+        checks = [
+            (pa.array(invalid_utf8), "invalid UTF-8"),
+            (pc.or_(pc.or_(has_nul(sku), has_nul(name)), has_nul(description)), "contains a NUL character"),
+            (pc.fill_null(pc.equal(sku, ""), True), "missing sku"),
+            (pc.fill_null(pc.greater(pc.utf8_length(sku), MAX_SKU_LENGTH), False), f"sku is longer than {MAX_SKU_LENGTH} characters"),
+            (pc.fill_null(pc.greater(pc.utf8_length(name), MAX_NAME_LENGTH), False), f"name is longer than {MAX_NAME_LENGTH} characters"),
+        ]
+        rejected = pa.array([False] * size)
+        for mask, reason in checks:
+            new = pc.and_not(mask, rejected)
+            if not pc.any(new).as_py():
+                continue
+            self.rejected_rows += pc.sum(new).as_py()
+            if self.on_reject:
+                for record in table.filter(new).to_pylist():
+                    self.on_reject(tuple(record.values()), reason)
+            rejected = pc.or_(rejected, mask)
+        return table.filter(pc.invert(rejected))
+
+    def _last_per_sku(self, table):
+        # A SKU twice in one statement is a CardinalityViolation; keep the last
+        indexed = self.pa.table({"sku": table.column("sku"), "index": self.pa.array(range(table.num_rows), self.pa.int64())})
+        last = indexed.group_by("sku").aggregate([("index", "max")]).column("index_max")
+        if len(last) == table.num_rows:
+            return table
+        return table.take(self.pc.take(last, self.pc.sort_indices(last)))
+
+    async def _write(self, session, table):
+        if not table.num_rows:
+            return
+        try:
+            with self.timings.stage("build"):
+                params = {
+                    "skus": table.column("sku").to_pylist(),
+                    "names": table.column("name").to_pylist(),
+                    "descriptions": table.column("description").to_pylist(),
+                    "is_active": table.column("is_active").to_pylist(),
+                }
+            with self.timings.stage("execute"):
+                inserted, updated = (await session.execute(text(UNNEST_UPSERT_SQL), params)).one()
+            with self.timings.stage("commit"):
+                await session.commit()
+            self.inserted_rows += inserted
+            self.updated_rows += updated
+            return
+        except Exception as e:
+            if self.on_reject is None or not is_row_error(e):
+                raise
+            await session.rollback()
+            if table.num_rows == 1:
+                self.rejected_rows += 1
+                self.on_reject(tuple(table.to_pylist()[0].values()), row_error_message(e))
+                return
+        middle = table.num_rows // 2
+        await self._write(session, table.slice(0, middle))
+        await self._write(session, table.slice(middle))
@@ -1,11 +1,99 @@
+from typing import Optional
+
 from pydantic_settings import BaseSettings
 
 class Settings(BaseSettings):
     DATABASE_URL: str
+    # Optional replica (or second URL of the primary) for read-only endpoints and views
+    DATABASE_READ_URL: Optional[str] = None
     CELERY_BROKER_URL: str
     CELERY_RESULT_BACKEND: str
     UPLOAD_DIR: str = "uploads"
     ENVIRONMENT: str = "development"
+    # Seconds an imported upload's sha256 is remembered; re-uploading the same
+    # file while the catalogue is unchanged returns the original task
+    UPLOAD_DEDUP_TTL: int = 24 * 60 * 60
+    # "insert" (multi-row INSERT ... ON CONFLICT per chunk) or "copy" (binary COPY into a staging table + one merge)
+    IMPORT_LOAD_MODE: str = "insert"
+    IMPORT_CHUNK_SIZE: int = 1000
+    # Concurrent writer coroutines (one pooled connection each) and the number of
+    # batches each writer may have queued before parsing waits for it
+    IMPORT_WRITER_CONCURRENCY: int = 4
+    IMPORT_QUEUE_DEPTH: int = 2
+    # CSV parser: "python" (csv module, row by row, resumable from checkpoints) or
+    # "arrow" (pyarrow, vectorized). Parquet and NDJSON uploads always use arrow,
+    # written IMPORT_ARROW_BATCH_ROWS rows per statement.
+    IMPORT_CSV_READER: str = "python"
+    IMPORT_ARROW_BATCH_ROWS: int = 10000
+    # Uploads of at least IMPORT_SHARD_MIN_BYTES are split into IMPORT_SHARD_COUNT
+    # byte ranges and imported by a chord of shard tasks (1 disables sharding)
+    IMPORT_SHARD_COUNT: int = 8
+    IMPORT_SHARD_MIN_BYTES: int = 256 * 1024 * 1024
+    # Imports of an estimated IMPORT_DEFER_INDEXES_MIN_ROWS rows or more (and at
+    # least half the table) drop the secondary product indexes while loading and
+    # rebuild them concurrently afterwards (0 disables)
+    IMPORT_DEFER_INDEXES_MIN_ROWS: int = 1_000_000
+    # Imports estimated at IMPORT_LARGE_MIN_ROWS rows or more go to the
+    # imports_large queue, the rest to imports_small. At most
+    # IMPORT_LARGE_MAX_PENDING large imports may be queued or running; further
+    # large uploads are refused with a 429 (0 = no limit).
+    IMPORT_LARGE_MIN_ROWS: int = 100_000
+    IMPORT_LARGE_MAX_PENDING: int = 4
+    # A large import's slot is freed once it has gone this many seconds
+    # without being admitted or heartbeating, e.g. its message was lost
+    IMPORT_LARGE_ADMISSION_TTL: int = 3600
+    # Messages each worker process reserves ahead of the one it runs; 1 keeps a
+    # long import from holding back tasks another process could start
+    CELERY_PREFETCH_MULTIPLIER: int = 1
+    # An import that hasn't committed a batch or reported progress for this many
+    # seconds is considered stalled and can be restarted from its checkpoint
+    IMPORT_STALL_SECONDS: int = 300
+    # Webhook delivery: per-attempt timeout (seconds), retries with exponential
+    # backoff + jitter, keep-alive pool size and concurrent requests per host
+    WEBHOOK_TIMEOUT: float = 5.0
+    WEBHOOK_MAX_RETRIES: int = 3
+    WEBHOOK_BACKOFF_BASE: float = 0.5
+    WEBHOOK_BACKOFF_MAX: float = 30.0
+    WEBHOOK_MAX_CONNECTIONS: int = 100
+    WEBHOOK_PER_HOST_CONCURRENCY: int = 4
+    # Product events are coalesced for up to WEBHOOK_BATCH_WINDOW_MS or
+    # WEBHOOK_BATCH_MAX_EVENTS events, whichever comes first
+    WEBHOOK_BATCH_WINDOW_MS: int = 500
+    WEBHOOK_BATCH_MAX_EVENTS: int = 100
+    # Seconds a worker keeps active webhook subscriptions cached; changes made
+    # through the API/UI invalidate every process immediately via Redis pub/sub
+    WEBHOOK_CACHE_TTL: int = 300
+    # Single-product read cache: entries in each web process's LRU, how long they
+    # are trusted locally (seconds), and the TTL of the shared Redis copy
+    PRODUCT_CACHE_LOCAL_SIZE: int = 10000
+    PRODUCT_CACHE_LOCAL_TTL: int = 30
+    PRODUCT_CACHE_TTL: int = 300
+    # Most items accepted by one bulk upsert/patch/delete request
+    BULK_MAX_ITEMS: int = 5000
+    # Delete all: TRUNCATE if its lock is granted within PURGE_LOCK_TIMEOUT_MS,
+    # otherwise DELETE in PURGE_BATCH_SIZE batches
+    PURGE_LOCK_TIMEOUT_MS: int = 2000
+    PURGE_BATCH_SIZE: int = 10000
+    # Seconds a filtered product count (search in the UI) is cached
+    STATS_FILTERED_COUNT_TTL: int = 30
+    # Port of the Celery worker's Prometheus exporter (0 disables it)
+    METRICS_WORKER_PORT: int = 9808
+    # "web" or "worker": picks the connection pool settings below. The worker
+    # holds IMPORT_WRITER_CONCURRENCY connections per running import, the web
+    # app one per in-flight request. Pools are per process and per engine, so
+    # the read engine gets its own pool of the same size.
+    PROCESS_ROLE: str = "web"
+    DB_WEB_POOL_SIZE: int = 10
+    DB_WEB_MAX_OVERFLOW: int = 20
+    DB_WORKER_POOL_SIZE: int = 6
+    DB_WORKER_MAX_OVERFLOW: int = 4
+    # Test connections on checkout, so a failover or idle timeout costs a
+    # reconnect instead of a failed request or task
+    DB_WEB_POOL_PRE_PING: bool = True
+    DB_WORKER_POOL_PRE_PING: bool = True
+    # Prepared statements cached per connection (0 disables the caches)
+    DB_WEB_STATEMENT_CACHE_SIZE: int = 100
+    DB_WORKER_STATEMENT_CACHE_SIZE: int = 100
 
     class Config:
         env_file = ".env"
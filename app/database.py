@@ -1,33 +1,95 @@
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from app.config import settings
+from app.metrics import db_pool_wait_seconds
 
 import os
 import ssl
+import time
 
-DATABASE_URL = settings.DATABASE_URL
+def asyncpg_url(url):
+    if url:
+        if url.startswith("postgres://"):
+            url = url.replace("postgres://", "postgresql+asyncpg://", 1)
+        elif url.startswith("postgresql://"):
+            url = url.replace("postgresql://", "postgresql+asyncpg://", 1)
+    return url
 
-if DATABASE_URL:
-    if DATABASE_URL.startswith("postgres://"):
-        DATABASE_URL = DATABASE_URL.replace("postgres://", "postgresql+asyncpg://", 1)
-    elif DATABASE_URL.startswith("postgresql://"):
-        DATABASE_URL = DATABASE_URL.replace("postgresql://", "postgresql+asyncpg://", 1)
+DATABASE_URL = asyncpg_url(settings.DATABASE_URL)
+DATABASE_READ_URL = asyncpg_url(settings.DATABASE_READ_URL)
 
-connect_args = {}
+ROLE = "WORKER" if settings.PROCESS_ROLE == "worker" else "WEB"
+
+def pool_setting(name):
+    # DB_WEB_<name> or DB_WORKER_<name>, whichever this process runs as
+    return getattr(settings, f"DB_{ROLE}_{name}")
+
+statement_cache_size = pool_setting("STATEMENT_CACHE_SIZE")
+# SQLAlchemy's prepared statement cache, and asyncpg's own
+connect_args = {
+    "prepared_statement_cache_size": statement_cache_size,
+    "statement_cache_size": statement_cache_size,
+}
 if settings.ENVIRONMENT == "production":
     ssl_context = ssl.create_default_context()
     ssl_context.check_hostname = False
     ssl_context.verify_mode = ssl.CERT_NONE
     connect_args["ssl"] = ssl_context
 
-engine = create_async_engine(DATABASE_URL, echo=False, connect_args=connect_args)
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    # How long each checkout waits for a pooled connection. Observed once per
+    # checkout, as _do_get retries by calling itself, and without the time
+    # spent opening a new connection, which isn't waiting on the pool.
+    def connect(self):
+        started = time.perf_counter()
+        connection = super().connect()
+        record = connection._connection_record.__dict__
+        got_at = record.pop("_got_at", started)
+        db_pool_wait_seconds.observe(max(got_at - started - record.pop("_open_seconds", 0), 0))
+        return connection
+
+    def _do_get(self):
+        record = super()._do_get()
+        record._got_at = time.perf_counter()
+        return record
+
+    def _create_connection(self):
+        started = time.perf_counter()
+        record = super()._create_connection()
+        record._open_seconds = time.perf_counter() - started
+        return record
+
+def make_engine(url):
+    return create_async_engine(
+        url,
+        echo=False,
+        connect_args=connect_args,
+        poolclass=TimedQueuePool,
+        pool_size=pool_setting("POOL_SIZE"),
+        max_overflow=pool_setting("MAX_OVERFLOW"),
+        pool_pre_ping=pool_setting("POOL_PRE_PING"),
+    )
+
+engine = make_engine(DATABASE_URL)
+# Without DATABASE_READ_URL reads share the primary's engine and pool
+read_engine = make_engine(DATABASE_READ_URL) if DATABASE_READ_URL else engine
 
 AsyncSessionLocal = sessionmaker(
     engine, class_=AsyncSession, expire_on_commit=False
 )
+ReadSessionLocal = sessionmaker(
+    read_engine, class_=AsyncSession, expire_on_commit=False
+)
 
 Base = declarative_base()
 
 async def get_db():
     async with AsyncSessionLocal() as session:
         yield session
+
+async def get_read_db():
+    # For endpoints that never write. A replica may lag behind the primary,
+    # so anything that fills a cache or must see its own writes uses get_db.
+    async with ReadSessionLocal() as session:
+        yield session
@@ -0,0 +1,74 @@
+import csv
+import io
+import json
+import zlib
+
+from sqlalchemy import select
+
+from app.database import read_engine
+from app.models import Product
+from app.queries import filter_products
+
+EXPORT_FORMATS = {
+    "csv": ("text/csv", "csv"),
+    "ndjson": ("application/x-ndjson", "ndjson"),
+}
+EXPORT_COLUMNS = ["sku", "name", "description", "is_active", "created_at", "updated_at"]
+
+# Rows fetched from the server-side cursor per round trip, and per yielded chunk
+EXPORT_BATCH_SIZE = 2000
+
+
+def _csv_chunk(rows):
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(
+        (sku, name, description, "true" if is_active else "false",
+         created_at.isoformat() if created_at else "", updated_at.isoformat() if updated_at else "")
+        for sku, name, description, is_active, created_at, updated_at in rows
+    )
+    return buffer.getvalue().encode()
+
+
+def _ndjson_chunk(rows):
+    return "".join(
+        json.dumps({
+            "sku": sku,
+            "name": name,
+            "description": description,
+            "is_active": is_active,
+            "created_at": created_at.isoformat() if created_at else None,
+            "updated_at": updated_at.isoformat() if updated_at else None,
+        }) + "\n"
+        for sku, name, description, is_active, created_at, updated_at in rows
+    ).encode()
+
+
+async def export_products(fmt, search=None, is_active=None, gzip=False):
+    """Yield the filtered catalogue as CSV or NDJSON bytes, ordered by sku.
+
+    Rows come from a server-side cursor in EXPORT_BATCH_SIZE batches and are
+    encoded per batch, so memory stays flat however large the table is. The
+    export runs in one transaction and is a consistent snapshot.
+    """
+    encode = _csv_chunk if fmt == "csv" else _ndjson_chunk
+    compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16) if gzip else None
+
+    query = filter_products(select(*(getattr(Product, name) for name in EXPORT_COLUMNS)), search, is_active)
+    query = query.order_by(Product.sku).execution_options(yield_per=EXPORT_BATCH_SIZE)
+
+    if fmt == "csv":
+        header = (",".join(EXPORT_COLUMNS) + "\r\n").encode()
+        yield compressor.compress(header) if compressor else header
+
+    async with read_engine.connect() as conn:
+        result = await conn.stream(query)
+        async for rows in result.partitions():
+            chunk = encode(rows)
+            if compressor:
+                chunk = compressor.compress(chunk)
+                if not chunk:
+                    continue
+            yield chunk
+
+    if compressor:
+        yield compressor.flush()
@@ -0,0 +1,429 @@
+import asyncio
+import time
+import zlib
+from collections import deque
+
+from sqlalchemy import literal_column, text
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.sql import func
+
+from app.database import AsyncSessionLocal
+from app.metrics import StageTimings, import_batch_rows
+from app.models import Product, content_hash_sql, import_staging
+
+# Supported values for settings.IMPORT_LOAD_MODE / the load_mode task argument
+LOAD_MODES = ("insert", "copy")
+
+STAGING_TABLE = "products_staging"
+STAGING_COLUMNS = ["pos", "sku", "name", "description", "is_active"]
+
+# Rows are cleared on every commit, but the table itself lives for the whole
+# DB session, so a pooled connection only pays for the CREATE once.
+CREATE_STAGING_SQL = f"""
+CREATE TEMP TABLE IF NOT EXISTS {STAGING_TABLE} (
+    pos bigint NOT NULL,
+    sku text NOT NULL,
+    name text,
+    description text,
+    is_active boolean NOT NULL
+) ON COMMIT DELETE ROWS
+"""
+
+# Rows whose content hash is unchanged are left alone: no new row version, no
+# WAL, no index churn and updated_at keeps its value.
+SKIP_UNCHANGED_SQL = f"products.content_hash IS DISTINCT FROM {content_hash_sql('EXCLUDED.')}"
+
+# xmax is 0 only for freshly inserted row versions; skipped rows return nothing
+COUNT_MERGED_SQL = """
+SELECT count(*) FILTER (WHERE inserted), count(*) FILTER (WHERE NOT inserted) FROM merged
+"""
+
+# DISTINCT ON keeps the row with the highest position per SKU, which gives the
+# same last-one-wins behaviour as the in-memory dedup of the insert mode.
+MERGE_STAGING_SQL = f"""
+WITH merged AS (
+    INSERT INTO products (sku, name, description, is_active)
+    SELECT DISTINCT ON (sku) sku, name, description, is_active
+    FROM {STAGING_TABLE}
+    ORDER BY sku, pos DESC
+    ON CONFLICT (sku) DO UPDATE SET
+        name = EXCLUDED.name,
+        description = EXCLUDED.description,
+        is_active = EXCLUDED.is_active,
+        updated_at = now()
+    WHERE {SKIP_UNCHANGED_SQL}
+    RETURNING (xmax = 0) AS inserted
+)
+{COUNT_MERGED_SQL}"""
+
+SHARD_STAGING_COLUMNS = ["import_id", "partition"] + STAGING_COLUMNS
+
+# Same merge for one SKU partition of a sharded import. pos is the line number
+# in the original file, so last-one-wins holds across shards.
+MERGE_SHARD_PARTITION_SQL = f"""
+WITH merged AS (
+    INSERT INTO products (sku, name, description, is_active)
+    SELECT DISTINCT ON (sku) sku, name, description, is_active
+    FROM {import_staging.name}
+    WHERE import_id = :import_id AND partition = :partition
+    ORDER BY sku, pos DESC
+    ON CONFLICT (sku) DO UPDATE SET
+        name = EXCLUDED.name,
+        description = EXCLUDED.description,
+        is_active = EXCLUDED.is_active,
+        updated_at = now()
+    WHERE {SKIP_UNCHANGED_SQL}
+    RETURNING (xmax = 0) AS inserted
+)
+{COUNT_MERGED_SQL}"""
+
+
+# SQLSTATE classes caused by the values of a row: data exceptions (22),
+# integrity violations (23) and program limits such as oversized index rows (54)
+ROW_ERROR_CLASSES = ("22", "23", "54")
+
+
+def is_row_error(exc):
+    if isinstance(exc, DBAPIError):
+        exc = exc.orig
+    if isinstance(exc, ValueError):
+        # asyncpg rejects some values client side, before they reach the server
+        return True
+    sqlstate = getattr(exc, "sqlstate", None) or getattr(exc.__cause__, "sqlstate", None)
+    return bool(sqlstate) and sqlstate[:2] in ROW_ERROR_CLASSES
+
+
+def row_error_message(exc):
+    if isinstance(exc, DBAPIError):
+        exc = exc.orig
+    message = str(exc).strip()
+    return message.splitlines()[0] if message else exc.__class__.__name__
+
+
+def partition_for(sku, partitions):
+    # Stable across processes (unlike hash()), so a SKU always lands on the same writer
+    return zlib.crc32((sku or "").encode()) % partitions
+
+
+class UpsertWriter:
+    """Writes every chunk as one multi-row INSERT ... ON CONFLICT and commits it."""
+
+    commits_batches = True
+
+    def __init__(self, session):
+        self.session = session
+        self.inserted = 0
+        self.updated = 0
+        self.timings = StageTimings()
+
+    async def start(self):
+        pass
+
+    async def write(self, records):
+        with self.timings.stage("dedupe"):
+            # Deduplicate chunk to avoid CardinalityViolationError
+            # If multiple rows in the same chunk have the same SKU, the last one wins
+            deduplicated = {record[1]: record for record in records}
+
+        with self.timings.stage("build"):
+            values = [
+                {
+                    "sku": sku,
+                    "name": name,
+                    "description": description,
+                    "is_active": is_active,
+                }
+                for _, sku, name, description, is_active in deduplicated.values()
+            ]
+
+            stmt = insert(Product).values(values)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=['sku'],
+                set_={
+                    "name": stmt.excluded.name,
+                    "description": stmt.excluded.description,
+                    "is_active": stmt.excluded.is_active,
+                    "updated_at": func.now()
+                },
+                where=text(SKIP_UNCHANGED_SQL),
+            )
+            stmt = stmt.returning(literal_column("xmax = 0"))
+        # Includes compiling the statement, which SQLAlchemy does on execute
+        with self.timings.stage("execute"):
+            inserted = (await self.session.execute(stmt)).scalars().all()
+        with self.timings.stage("commit"):
+            await self.session.commit()
+        self.inserted += sum(inserted)
+        self.updated += len(inserted) - sum(inserted)
+
+    async def rollback(self):
+        await self.session.rollback()
+
+    async def finish(self):
+        pass
+
+
+class CopyWriter:
+    """Streams chunks into a temp staging table with binary COPY and merges once at the end."""
+
+    # Nothing is durable until the merge in finish()
+    commits_batches = False
+
+    def __init__(self, session):
+        self.session = session
+        self.driver_connection = None
+        self.inserted = 0
+        self.updated = 0
+        self.timings = StageTimings()
+
+    async def start(self):
+        await self.session.execute(text(CREATE_STAGING_SQL))
+        connection = await self.session.connection()
+        raw_connection = await connection.get_raw_connection()
+        self.driver_connection = raw_connection.driver_connection
+
+    async def write(self, records):
+        # Staged rows live in the import's one transaction, so a failed COPY
+        # must only roll back to its own savepoint
+        with self.timings.stage("execute"):
+            async with self.session.begin_nested():
+                await self.driver_connection.copy_records_to_table(
+                    STAGING_TABLE, records=records, columns=STAGING_COLUMNS
+                )
+
+    async def rollback(self):
+        pass
+
+    async def finish(self):
+        with self.timings.stage("merge"):
+            result = await self.session.execute(text(MERGE_STAGING_SQL))
+            self.inserted, self.updated = result.one()
+        with self.timings.stage("commit"):
+            await self.session.commit()
+
+
+class ShardStagingWriter:
+    """COPYs a shard's rows into the shared import_staging table, tagged with their SKU partition."""
+
+    commits_batches = True
+
+    def __init__(self, session, import_id, partitions):
+        self.session = session
+        self.import_id = import_id
+        self.partitions = partitions
+        # Counted by the finalizer's merge
+        self.inserted = 0
+        self.updated = 0
+        self.timings = StageTimings()
+
+    async def start(self):
+        pass
+
+    async def write(self, records):
+        with self.timings.stage("build"):
+            rows = [
+                (self.import_id, partition_for(record[1], self.partitions)) + record
+                for record in records
+            ]
+        with self.timings.stage("execute"):
+            # Every batch commits, which hands the connection back to the session;
+            # fetch it per batch so the COPY runs in the batch's transaction
+            connection = await self.session.connection()
+            raw_connection = await connection.get_raw_connection()
+            await raw_connection.driver_connection.copy_records_to_table(
+                import_staging.name, records=rows, columns=SHARD_STAGING_COLUMNS
+            )
+        with self.timings.stage("commit"):
+            await self.session.commit()
+
+    async def rollback(self):
+        await self.session.rollback()
+
+    async def finish(self):
+        pass
+
+
+async def merge_shard_partition(import_id, partition):
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(text(MERGE_SHARD_PARTITION_SQL), {"import_id": import_id, "partition": partition})
+        inserted, updated = result.one()
+        await session.execute(
+            import_staging.delete().where(
+                import_staging.c.import_id == import_id,
+                import_staging.c.partition == partition,
+            )
+        )
+        await session.commit()
+    return inserted, updated
+
+
+async def merge_sharded_import(import_id, partitions, timings=None):
+    # Partitions hold disjoint SKUs, so they can be merged on separate connections at once
+    started = time.perf_counter()
+    counts = await asyncio.gather(*(merge_shard_partition(import_id, p) for p in range(partitions)))
+    if timings is not None:
+        timings.add("merge", time.perf_counter() - started)
+    return sum(c[0] for c in counts), sum(c[1] for c in counts)
+
+
+async def discard_sharded_import(import_id):
+    async with AsyncSessionLocal() as session:
+        await session.execute(import_staging.delete().where(import_staging.c.import_id == import_id))
+        await session.commit()
+
+
+def make_writer(load_mode, session):
+    if load_mode == "copy":
+        return CopyWriter(session)
+    if load_mode == "insert":
+        return UpsertWriter(session)
+    raise ValueError(f"Unknown load mode: {load_mode}")
+
+
+class ImportPipeline:
+    """Parses records on the event loop and fans batches out to concurrent writers.
+
+    Records are partitioned by SKU, so every writer owns a disjoint set of SKUs:
+    batches for one SKU are still applied in file order (last one wins) and
+    writers never wait on each other's row locks. Each writer keeps one pooled
+    connection for the whole import, and its queue is bounded so parsing can
+    only run queue_depth batches ahead of the database.
+
+    With on_checkpoint, every committed batch reports the position of the
+    earliest row that isn't committed yet across all writers, so a restarted
+    import can continue from there. The records must then come from a
+    CsvRecordReader, whose positions are used.
+
+    `timings` sums the seconds spent per stage: parsing here, and
+    whatever each writer records in its own `timings`.
+    """
+
+    def __init__(self, writer_factory, concurrency, queue_depth, chunk_size, on_batch=None, on_reject=None, on_checkpoint=None):
+        # writer_factory(session) returns the writer used by each writer coroutine
+        self.writer_factory = writer_factory
+        self.concurrency = max(1, concurrency)
+        self.queue_depth = max(1, queue_depth)
+        self.chunk_size = chunk_size
+        self.on_batch = on_batch
+        # on_reject(record, reason) for rows the database refused. Without it a
+        # failing batch fails the import.
+        self.on_reject = on_reject
+        # on_checkpoint(offset, line, rows, inserted, updated)
+        self.on_checkpoint = on_checkpoint
+        self.processed_rows = 0
+        self.committed_rows = 0
+        self.inserted_rows = 0
+        self.updated_rows = 0
+        self.rejected_rows = 0
+        self.timings = StageTimings()
+        self._writers = []
+        self._records = None
+        # Per partition: (offset, line, rows before it) of the first row of
+        # every queued or in-flight batch, and of the batch being filled
+        self._pending = [deque() for _ in range(self.concurrency)]
+        self._starts = [None] * self.concurrency
+
+    async def run(self, records):
+        self._records = records
+        queues = [asyncio.Queue(maxsize=self.queue_depth) for _ in range(self.concurrency)]
+        tasks = [asyncio.create_task(self._write(partition, queue)) for partition, queue in enumerate(queues)]
+        tasks.append(asyncio.create_task(self._produce(records, queues)))
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+        return self.processed_rows
+
+    async def _produce(self, records, queues):
+        buffers = [[] for _ in queues]
+        # Parse time is the loop's time minus the awaits, measured per batch
+        # rather than per row. Validation happens while parsing and is included.
+        parse_started = time.perf_counter()
+        for record in records:
+            self.processed_rows += 1
+            partition = partition_for(record[1], self.concurrency)
+            buffer = buffers[partition]
+            if not buffer and self.on_checkpoint:
+                self._starts[partition] = (records.row_offset, record[0], self.processed_rows - 1)
+            buffer.append(record)
+            if len(buffer) >= self.chunk_size:
+                self._batch_queued(partition)
+                self.timings.add("parse", time.perf_counter() - parse_started)
+                await queues[partition].put(buffer)
+                buffers[partition] = []
+                # Parsing is synchronous, give the writers a turn to send
+                # their statements before parsing the next batch.
+                await asyncio.sleep(0)
+                parse_started = time.perf_counter()
+
+        self.timings.add("parse", time.perf_counter() - parse_started)
+        for partition, (queue, buffer) in enumerate(zip(queues, buffers)):
+            if buffer:
+                self._batch_queued(partition)
+                await queue.put(buffer)
+            await queue.put(None)
+
+    def _batch_queued(self, partition):
+        # Only tracked for checkpoints: the writers only pop it with on_checkpoint
+        if self.on_checkpoint:
+            self._pending[partition].append(self._starts[partition])
+            self._starts[partition] = None
+
+    async def _write(self, partition, queue):
+        async with AsyncSessionLocal() as session:
+            writer = self.writer_factory(session)
+            self._writers.append(writer)
+            await writer.start()
+            while True:
+                batch = await queue.get()
+                if batch is None:
+                    break
+                import_batch_rows.observe(len(batch))
+                await self._write_batch(writer, batch)
+                self.committed_rows += len(batch)
+                if self.on_checkpoint:
+                    self._pending[partition].popleft()
+                    if writer.commits_batches:
+                        self._checkpoint()
+                if self.on_batch:
+                    self.on_batch(self.committed_rows)
+            await writer.finish()
+            self.inserted_rows += writer.inserted
+            self.updated_rows += writer.updated
+            self.timings.merge(writer.timings)
+
+    def _checkpoint(self):
+        starts = [pending[0] for pending in self._pending if pending]
+        starts += [start for start in self._starts if start is not None]
+        if starts:
+            offset, line, rows = min(starts)
+        else:
+            # Everything parsed so far is committed
+            offset, line, rows = self._records.offset, self._records.lines + 1, self.processed_rows
+        self.on_checkpoint(
+            offset, line, rows,
+            sum(writer.inserted for writer in self._writers),
+            sum(writer.updated for writer in self._writers),
+        )
+
+    async def _write_batch(self, writer, batch):
+        # A batch refused because of some row's values is split in halves until
+        # the bad rows are isolated, so the good rows around them still land
+        try:
+            await writer.write(batch)
+            return
+        except Exception as e:
+            if self.on_reject is None or not is_row_error(e):
+                raise
+            await writer.rollback()
+            if len(batch) == 1:
+                self.rejected_rows += 1
+                self.on_reject(batch[0], row_error_message(e))
+                return
+        middle = len(batch) // 2
+        await self._write_batch(writer, batch[:middle])
+        await self._write_batch(writer, batch[middle:])
@@ -0,0 +1,83 @@
+import redis
+from sqlalchemy import text
+
+from app.checkpoints import is_running
+from app.config import settings
+from app.database import engine
+
+# Secondary indexes on products, i.e. everything but the primary key, which
+# the upserts' ON CONFLICT needs. Large imports drop these and rebuild them
+# once they are done; the startup migrations recreate any that are missing.
+SECONDARY_INDEXES = {
+    "ix_products_name": "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_products_name ON products (name)",
+    "ix_products_sku_trgm": "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_products_sku_trgm ON products USING gin (sku gin_trgm_ops)",
+    "ix_products_name_trgm": "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_products_name_trgm ON products USING gin (name gin_trgm_ops)",
+    "ix_products_description_trgm": "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_products_description_trgm ON products USING gin (description gin_trgm_ops)",
+    # Serves the change feed
+    "ix_products_change_seq": "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_products_change_seq ON products (change_seq)",
+}
+
+# Rebuilding covers the whole table, not just the imported rows, so an import
+# must also be at least this share of the table for deferring to pay off
+MIN_TABLE_SHARE = 0.5
+
+# Imports currently loading with the indexes dropped; the last one to finish rebuilds them
+DEFERRED_KEY = "indexes:products:deferred"
+
+INVALID_INDEXES_SQL = """
+SELECT c.relname FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+WHERE NOT i.indisvalid AND c.relname = ANY(:names)
+"""
+
+redis_client = redis.Redis.from_url(settings.CELERY_BROKER_URL)
+
+
+def should_defer(estimated_rows, table_rows):
+    threshold = settings.IMPORT_DEFER_INDEXES_MIN_ROWS
+    return bool(threshold) and estimated_rows >= max(threshold, table_rows * MIN_TABLE_SHARE)
+
+
+async def drop_secondary_indexes():
+    # CONCURRENTLY cannot run inside a transaction block, and waits for
+    # queries using the index instead of blocking the table
+    async with engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        for name in SECONDARY_INDEXES:
+            await conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+
+
+async def create_secondary_indexes():
+    async with engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        # An interrupted CONCURRENTLY build leaves an invalid index behind,
+        # which IF NOT EXISTS would otherwise keep
+        invalid = await conn.execute(text(INVALID_INDEXES_SQL), {"names": list(SECONDARY_INDEXES)})
+        for (name,) in invalid.all():
+            await conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+        for statement in SECONDARY_INDEXES.values():
+            await conn.execute(text(statement))
+
+
+def defer_indexes(task_id):
+    # Dropping is idempotent, so a redelivered import simply drops again
+    redis_client.sadd(DEFERRED_KEY, task_id)
+
+
+def indexes_deferred():
+    return any(is_running(task_id.decode()) for task_id in redis_client.smembers(DEFERRED_KEY))
+
+
+def release_indexes(task_id):
+    """Stop deferring for this import; True if the indexes should be rebuilt now.
+
+    They are only rebuilt once no other import still loading without them is
+    alive. Imports whose lock expired (their worker died) don't count.
+    """
+    if not redis_client.srem(DEFERRED_KEY, task_id):
+        return False
+    for other in redis_client.smembers(DEFERRED_KEY):
+        if is_running(other.decode()):
+            return False
+        redis_client.srem(DEFERRED_KEY, other)
+    return True
+
@@ -1,12 +1,18 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Response
 from fastapi.templating import Jinja2Templates
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 from app.database import engine, Base
+from app.metrics import collector_registry, register_scrape_collector
+from app.migrations import apply_migrations
+from app.queues import QueueCollector
+from app.webhook_delivery import close_client
 import os
 
-from app.api import upload, products, webhooks
+from app.api import upload, products, webhooks, admin
 from app import views
 
 app = FastAPI(title="Product Importer")
+register_scrape_collector(QueueCollector())
 
 # Templates
 templates = Jinja2Templates(directory="app/templates")
@@ -14,6 +20,7 @@ templates = Jinja2Templates(directory="app/templates")
 app.include_router(upload.router, prefix="/api")
 app.include_router(products.router, prefix="/api")
 app.include_router(webhooks.router, prefix="/api")
+app.include_router(admin.router, prefix="/api")
 app.include_router(views.router)
 
 @app.on_event("startup")
@@ -21,7 +28,17 @@ async def startup():
     # Create tables (for simplicity in this demo, usually use Alembic)
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+    await apply_migrations()
+
+@app.on_event("shutdown")
+async def shutdown():
+    await close_client()
 
 @app.get("/")
 async def root():
     return {"message": "Welcome to Product Importer"}
+
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    # Prometheus scrape endpoint; the worker serves its own on METRICS_WORKER_PORT
+    return Response(generate_latest(collector_registry()), media_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,99 @@
+import os
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+from prometheus_client import REGISTRY, CollectorRegistry, Counter, Histogram, multiprocess
+
+# Import stages: parse, validate (Arrow reader only), dedupe, build, execute,
+# commit and merge. Timers wrap a whole batch, never a single row.
+STAGE_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+BATCH_BUCKETS = (1, 10, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+import_stage_seconds = Histogram(
+    "import_stage_seconds", "Time spent per import batch in each stage", ["stage"], buckets=STAGE_BUCKETS,
+)
+import_batch_rows = Histogram("import_batch_rows", "Rows per batch handed to an import writer", buckets=BATCH_BUCKETS)
+import_rows = Counter("import_rows", "Imported rows by outcome", ["outcome"])
+import_duration_seconds = Histogram(
+    "import_duration_seconds", "Wall time of whole imports", buckets=(1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600),
+)
+
+webhook_stage_seconds = Histogram(
+    "webhook_dispatch_stage_seconds", "Time spent per webhook dispatch in each stage", ["stage"], buckets=STAGE_BUCKETS,
+)
+webhook_batch_events = Histogram("webhook_dispatch_events", "Events per webhook dispatch", buckets=BATCH_BUCKETS)
+webhook_deliveries = Counter("webhook_deliveries", "Webhook deliveries by outcome", ["outcome"])
+webhook_delivery_seconds = Histogram(
+    "webhook_delivery_seconds", "Latency of the final delivery attempt", buckets=STAGE_BUCKETS,
+)
+
+queue_wait_seconds = Histogram(
+    "celery_queue_wait_seconds", "Time tasks waited in their queue before a worker started them", ["queue"],
+    buckets=(0.01, 0.1, 0.5, 1, 5, 15, 30, 60, 300, 900, 1800, 3600),
+)
+
+db_pool_wait_seconds = Histogram(
+    "db_pool_wait_seconds", "Time spent waiting for a pooled database connection",
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 30),
+)
+
+
+class StageTimings:
+    """Seconds per stage for one import (or one writer), also fed to a Prometheus histogram."""
+
+    def __init__(self, histogram=import_stage_seconds):
+        self.histogram = histogram
+        self.seconds = defaultdict(float)
+
+    def add(self, stage, seconds):
+        self.seconds[stage] += seconds
+        self.histogram.labels(stage).observe(seconds)
+
+    @contextmanager
+    def stage(self, stage):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - started)
+
+    def merge(self, other):
+        # Totals only; other already observed its own histogram samples
+        for stage, seconds in dict(other).items():
+            self.seconds[stage] += seconds
+
+    def __iter__(self):
+        return iter(self.seconds.items())
+
+    def summary(self):
+        return {stage: round(seconds, 3) for stage, seconds in self.seconds.items()}
+
+
+def record_import(duration, counts):
+    import_duration_seconds.observe(duration)
+    for outcome in ("inserted", "updated", "unchanged", "rejected"):
+        if counts.get(outcome):
+            import_rows.labels(outcome).inc(counts[outcome])
+
+
+# Collectors that read shared state (e.g. queue depths in Redis) when scraped
+scrape_collectors = []
+
+
+def register_scrape_collector(collector):
+    scrape_collectors.append(collector)
+    if not os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        REGISTRY.register(collector)
+
+
+def collector_registry():
+    # Web servers and Celery run several processes; with PROMETHEUS_MULTIPROC_DIR
+    # set, every process writes its samples there and a scrape sums them all
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        for collector in scrape_collectors:
+            registry.register(collector)
+        return registry
+    return REGISTRY
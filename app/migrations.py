@@ -0,0 +1,90 @@
+from sqlalchemy import text
+
+from app.database import engine
+from app.indexes import SECONDARY_INDEXES, indexes_deferred
+from app.models import content_hash_sql
+
+# Idempotent DDL applied on startup after Base.metadata.create_all. create_all
+# only creates missing tables, so anything added to an existing table (indexes,
+# columns, extensions) goes here.
+# Change feed triggers. Updated rows get a new change_seq (unchanged ones
+# are never updated, see SKIP_UNCHANGED_SQL); deletes leave a tombstone,
+# written once per statement from its transition table; TRUNCATE clears the
+# tombstones and records a feed reset instead.
+CHANGE_FEED_FUNCTIONS = [
+    """CREATE OR REPLACE FUNCTION products_bump_change_seq() RETURNS trigger AS $$
+BEGIN
+    NEW.change_seq := nextval('product_change_seq');
+    RETURN NEW;
+END $$ LANGUAGE plpgsql""",
+    """CREATE OR REPLACE FUNCTION products_record_deletes() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO product_tombstones (sku, change_seq)
+    SELECT sku, nextval('product_change_seq') FROM deleted_products
+    ON CONFLICT (sku) DO UPDATE SET change_seq = EXCLUDED.change_seq, deleted_at = now();
+    RETURN NULL;
+END $$ LANGUAGE plpgsql""",
+    """CREATE OR REPLACE FUNCTION products_record_truncate() RETURNS trigger AS $$
+BEGIN
+    DELETE FROM product_tombstones;
+    INSERT INTO product_feed_resets (change_seq) VALUES (nextval('product_change_seq'));
+    RETURN NULL;
+END $$ LANGUAGE plpgsql""",
+]
+
+CHANGE_FEED_TRIGGERS = {
+    "products_change_seq": "BEFORE UPDATE ON products FOR EACH ROW EXECUTE FUNCTION products_bump_change_seq()",
+    "products_tombstones": (
+        "AFTER DELETE ON products REFERENCING OLD TABLE AS deleted_products "
+        "FOR EACH STATEMENT EXECUTE FUNCTION products_record_deletes()"
+    ),
+    "products_feed_reset": "AFTER TRUNCATE ON products FOR EACH STATEMENT EXECUTE FUNCTION products_record_truncate()",
+}
+
+
+def create_trigger_sql(name, definition):
+    # Never dropped and recreated, which would let writes slip past it meanwhile
+    return f"""
+DO $$ BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = '{name}' AND tgrelid = 'products'::regclass) THEN
+        CREATE TRIGGER {name} {definition};
+    END IF;
+END $$"""
+
+
+MIGRATIONS = [
+    # Trigram indexes let the ILIKE '%term%' product search use an index
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    # Numbers the existing rows, rewriting the table once on existing databases
+    "CREATE SEQUENCE IF NOT EXISTS product_change_seq",
+    "ALTER TABLE products ADD COLUMN IF NOT EXISTS change_seq bigint NOT NULL DEFAULT nextval('product_change_seq')",
+    *CHANGE_FEED_FUNCTIONS,
+    *(create_trigger_sql(name, definition) for name, definition in CHANGE_FEED_TRIGGERS.items()),
+    # Also restores any a large import dropped and didn't get to rebuild
+    *SECONDARY_INDEXES.values(),
+    # The primary key already indexes sku; this duplicate only slowed writes
+    "DROP INDEX CONCURRENTLY IF EXISTS ix_products_sku",
+    "ALTER TABLE webhooks ADD COLUMN IF NOT EXISTS delivery_mode varchar NOT NULL DEFAULT 'event'",
+    # Rewrites the table once on existing databases
+    f"ALTER TABLE products ADD COLUMN IF NOT EXISTS content_hash varchar GENERATED ALWAYS AS ({content_hash_sql()}) STORED",
+]
+
+# Serialises startups of several web processes; CREATE INDEX CONCURRENTLY
+# would otherwise race on the same index.
+MIGRATION_LOCK_ID = 7_202_401
+
+
+async def apply_migrations():
+    # CONCURRENTLY cannot run inside a transaction block
+    async with engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        await conn.execute(text("SELECT pg_advisory_lock(:id)"), {"id": MIGRATION_LOCK_ID})
+        try:
+            # A running large import rebuilds what it dropped when it finishes
+            skip = set(SECONDARY_INDEXES.values()) if indexes_deferred() else set()
+            for statement in MIGRATIONS:
+                if statement in skip:
+                    continue
+                await conn.execute(text(statement))
+        finally:
+            await conn.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": MIGRATION_LOCK_ID})
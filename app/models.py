@@ -1,16 +1,48 @@
-from sqlalchemy import Column, Integer, String, Boolean, Text, DateTime, Float
+from sqlalchemy import Column, Integer, String, Boolean, Text, DateTime, Float, BigInteger, SmallInteger, Table, Index, ForeignKey, Computed, Sequence, FetchedValue
 from sqlalchemy.sql import func
 from app.database import Base
 
+def content_hash_sql(prefix=""):
+    # md5 over everything an import can change. NULL and '' hash differently,
+    # and every function used is immutable so it can back a generated column.
+    return (
+        f"md5(coalesce('+' || {prefix}name, '-') || chr(31) || "
+        f"coalesce('+' || {prefix}description, '-') || chr(31) || "
+        f"CASE WHEN {prefix}is_active THEN 't' WHEN NOT {prefix}is_active THEN 'f' ELSE '-' END)"
+    )
+
+# Orders every product write for the change feed: new rows take the next value,
+# and triggers (see app.migrations) renumber updated rows and number deletes
+product_change_seq = Sequence("product_change_seq", metadata=Base.metadata)
+
 class Product(Base):
     __tablename__ = "products"
 
-    sku = Column(String, primary_key=True, index=True)
+    sku = Column(String, primary_key=True)
     name = Column(String, index=True)
     description = Column(Text)
     is_active = Column(Boolean, default=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+    # Maintained by Postgres, lets imports skip rows that didn't change
+    content_hash = Column(String, Computed(content_hash_sql(), persisted=True))
+    change_seq = Column(BigInteger, nullable=False, server_default=product_change_seq.next_value(), server_onupdate=FetchedValue())
+
+# One row per deleted SKU, so the change feed can report deletes
+class ProductTombstone(Base):
+    __tablename__ = "product_tombstones"
+
+    sku = Column(String, primary_key=True)
+    change_seq = Column(BigInteger, nullable=False, index=True)
+    deleted_at = Column(DateTime(timezone=True), server_default=func.now())
+
+# Delete-all TRUNCATEs without per-row tombstones; feed positions from before
+# the latest reset can't be continued
+class ProductFeedReset(Base):
+    __tablename__ = "product_feed_resets"
+
+    change_seq = Column(BigInteger, primary_key=True)
+    reset_at = Column(DateTime(timezone=True), server_default=func.now())
 
 class Webhook(Base):
     __tablename__ = "webhooks"
@@ -19,4 +51,36 @@ class Webhook(Base):
     url = Column(String, nullable=False)
     event_type = Column(String, nullable=False) # e.g., "product.created", "product.updated"
     is_active = Column(Boolean, default=True)
+    # "event": one request per event, "batch": one {"events": [...]} request per outbox flush
+    delivery_mode = Column(String, nullable=False, default="event", server_default="event")
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+class WebhookDelivery(Base):
+    __tablename__ = "webhook_deliveries"
+
+    id = Column(BigInteger, primary_key=True)
+    webhook_id = Column(Integer, ForeignKey("webhooks.id", ondelete="SET NULL"), index=True)
+    url = Column(String, nullable=False)
+    event_type = Column(String, nullable=False)
+    status_code = Column(Integer) # None when no response was received
+    success = Column(Boolean, nullable=False)
+    attempts = Column(Integer, nullable=False)
+    latency_ms = Column(Integer, nullable=False) # Duration of the last attempt
+    error = Column(Text)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+# Rows parsed by sharded imports wait here until the finalizer merges them into
+# products. UNLOGGED because the data can always be re-read from the upload.
+import_staging = Table(
+    "import_staging",
+    Base.metadata,
+    Column("import_id", String, nullable=False),
+    Column("partition", SmallInteger, nullable=False),
+    Column("pos", BigInteger, nullable=False),
+    Column("sku", String, nullable=False),
+    Column("name", String),
+    Column("description", Text),
+    Column("is_active", Boolean, nullable=False),
+    Index("ix_import_staging_import_partition", "import_id", "partition"),
+    prefixes=["UNLOGGED"],
+)
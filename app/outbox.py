@@ -0,0 +1,50 @@
+import asyncio
+import json
+import time
+
+import redis
+import redis.asyncio
+
+from app.config import settings
+
+OUTBOX_KEY = "webhooks:outbox"
+FLUSH_SCHEDULED_KEY = "webhooks:outbox:flush_scheduled"
+
+redis_client = redis.Redis.from_url(settings.CELERY_BROKER_URL)
+# emit_event runs on the web app's request path
+async_redis_client = redis.asyncio.Redis.from_url(settings.CELERY_BROKER_URL)
+
+
+def make_event(event_type, payload):
+    return {"event_type": event_type, "payload": payload, "occurred_at": time.time()}
+
+
+async def emit_event(event_type, payload):
+    """Buffer a product event for webhook delivery instead of enqueuing a task per event.
+
+    Events collect in a Redis list. The first event of a window schedules one
+    flush task WEBHOOK_BATCH_WINDOW_MS later, and every WEBHOOK_BATCH_MAX_EVENTS
+    buffered events trigger an immediate flush, so a burst of API calls costs a
+    handful of tasks and one webhook query per flush.
+    """
+    from app.tasks import flush_webhook_outbox
+
+    window_ms = settings.WEBHOOK_BATCH_WINDOW_MS
+    pipe = async_redis_client.pipeline()
+    pipe.rpush(OUTBOX_KEY, json.dumps(make_event(event_type, payload)))
+    pipe.set(FLUSH_SCHEDULED_KEY, 1, nx=True, px=window_ms)
+    buffered, first_in_window = await pipe.execute()
+
+    # Celery only publishes synchronously
+    if buffered % settings.WEBHOOK_BATCH_MAX_EVENTS == 0:
+        await asyncio.to_thread(flush_webhook_outbox.delay)
+    elif first_in_window:
+        await asyncio.to_thread(flush_webhook_outbox.apply_async, countdown=window_ms / 1000)
+
+
+def pop_events(limit):
+    pipe = redis_client.pipeline()
+    pipe.lrange(OUTBOX_KEY, 0, limit - 1)
+    pipe.ltrim(OUTBOX_KEY, limit, -1)
+    events, _ = pipe.execute()
+    return [json.loads(event) for event in events]
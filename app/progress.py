@@ -0,0 +1,158 @@
+import asyncio
+import json
+import time
+
+import redis
+import redis.asyncio
+
+from app.config import settings
+
+PROGRESS_TTL = 24 * 60 * 60
+TERMINAL_STATES = ("completed", "failed")
+KEEPALIVE_SECONDS = 15
+
+redis_client = redis.Redis.from_url(settings.CELERY_BROKER_URL)
+async_redis_client = redis.asyncio.Redis.from_url(settings.CELERY_BROKER_URL)
+
+
+def progress_key(task_id):
+    # Latest event, so late subscribers start from the current state
+    return f"progress:{task_id}"
+
+
+def progress_channel(task_id):
+    return f"progress:{task_id}:events"
+
+
+def publish_progress(task_id, event):
+    payload = json.dumps(event)
+    pipe = redis_client.pipeline()
+    pipe.set(progress_key(task_id), payload, ex=PROGRESS_TTL)
+    pipe.publish(progress_channel(task_id), payload)
+    pipe.execute()
+
+
+def publish_failed(task_id, error):
+    publish_progress(task_id, {"state": "failed", "error": error})
+
+
+class ProgressPublisher:
+    """Worker side: turns row/percent counts into progress events for one import.
+
+    Running updates are throttled to one per min_interval seconds; terminal
+    events are always published. started_at is wall-clock time so several
+    shard tasks of one import can share it.
+    """
+
+    def __init__(self, task_id, started_at=None, min_interval=0.5):
+        self.task_id = task_id
+        self.started_at = started_at or time.time()
+        self.min_interval = min_interval
+        self._last_published = 0.0
+
+    def _rates(self, rows, percent):
+        elapsed = max(time.time() - self.started_at, 1e-6)
+        eta = round(elapsed * (100 - percent) / percent) if percent else None
+        return {"rows_per_sec": round(rows / elapsed), "eta_seconds": eta, "elapsed_seconds": round(elapsed)}
+
+    def update(self, percent, rows, errors=0, **extra):
+        now = time.monotonic()
+        if now - self._last_published < self.min_interval:
+            return
+        self._last_published = now
+        publish_progress(self.task_id, {
+            "state": "running",
+            "percent": percent,
+            "rows": rows,
+            "errors": errors,
+            **self._rates(rows, percent),
+            **extra,
+        })
+
+    def complete(self, rows, errors=0, **extra):
+        publish_progress(self.task_id, {
+            "state": "completed",
+            "percent": 100,
+            "rows": rows,
+            "errors": errors,
+            **self._rates(rows, 100),
+            **extra,
+        })
+
+
+# Internal marker queued to streams when their Redis subscription dropped
+_LISTENER_STOPPED = {"state": "resubscribe"}
+
+
+class ProgressHub:
+    """Web side: one Redis subscription per task, fanned out to every SSE client watching it."""
+
+    def __init__(self):
+        self._queues = {}
+        self._listeners = {}
+
+    async def stream(self, task_id):
+        # Yields progress events, or None when a keepalive is due. Ends after a
+        # terminal event.
+        queue = asyncio.Queue(maxsize=100)
+        self._queues.setdefault(task_id, set()).add(queue)
+        try:
+            event = await self._resubscribe(task_id)
+            while True:
+                yield event
+                if event is not None and event.get("state") in TERMINAL_STATES:
+                    return
+                try:
+                    event = await asyncio.wait_for(queue.get(), KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    event = None
+                    continue
+                if event is _LISTENER_STOPPED:
+                    await asyncio.sleep(1)
+                    event = await self._resubscribe(task_id)
+        finally:
+            queues = self._queues.get(task_id)
+            if queues is not None:
+                queues.discard(queue)
+                if not queues:
+                    del self._queues[task_id]
+                    listener = self._listeners.pop(task_id, None)
+                    if listener:
+                        listener[0].cancel()
+
+    async def _resubscribe(self, task_id):
+        # Subscribe first, then read the snapshot, so no event falls in between
+        if task_id not in self._listeners:
+            ready = asyncio.Event()
+            self._listeners[task_id] = (asyncio.create_task(self._listen(task_id, ready)), ready)
+        await self._listeners[task_id][1].wait()
+
+        snapshot = await async_redis_client.get(progress_key(task_id))
+        return json.loads(snapshot) if snapshot else {"state": "pending", "percent": 0}
+
+    async def _listen(self, task_id, ready):
+        pubsub = async_redis_client.pubsub(ignore_subscribe_messages=True)
+        try:
+            await pubsub.subscribe(progress_channel(task_id))
+            ready.set()
+            async for message in pubsub.listen():
+                if message["type"] == "message":
+                    self._fan_out(task_id, json.loads(message["data"]))
+        except redis.RedisError:
+            # Let the streams know so they resubscribe instead of waiting forever
+            self._fan_out(task_id, _LISTENER_STOPPED)
+        finally:
+            ready.set()
+            if self._listeners.get(task_id, (None,))[0] is asyncio.current_task():
+                del self._listeners[task_id]
+            await pubsub.aclose()
+
+    def _fan_out(self, task_id, event):
+        for queue in list(self._queues.get(task_id, ())):
+            if queue.full():
+                # A slow client only misses intermediate updates
+                queue.get_nowait()
+            queue.put_nowait(event)
+
+
+progress_hub = ProgressHub()
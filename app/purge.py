@@ -0,0 +1,55 @@
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+
+from app.database import AsyncSessionLocal
+
+# TRUNCATE needs an ACCESS EXCLUSIVE lock; it fails with lock_not_available
+# after lock_timeout instead of queueing every reader behind it.
+LOCK_NOT_AVAILABLE = "55P03"
+
+# max() is taken in SQL so the next batch starts in the database's collation order
+DELETE_BATCH_SQL = """
+WITH deleted AS (
+    DELETE FROM products
+    WHERE sku IN (
+        SELECT sku FROM products
+        {where}
+        ORDER BY sku
+        LIMIT :limit
+    )
+    RETURNING sku
+)
+SELECT count(*), max(sku) FROM deleted
+"""
+
+
+async def try_truncate_products(lock_timeout_ms):
+    # Instant and leaves no dead tuples behind, but only if nobody holds a lock
+    async with AsyncSessionLocal() as session:
+        await session.execute(text(f"SET LOCAL lock_timeout = {int(lock_timeout_ms)}"))
+        try:
+            await session.execute(text("TRUNCATE products"))
+        except DBAPIError as e:
+            await session.rollback()
+            if getattr(e.orig, "sqlstate", None) == LOCK_NOT_AVAILABLE:
+                return False
+            raise
+        await session.commit()
+    return True
+
+
+async def estimate_product_count():
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(text("SELECT reltuples::bigint FROM pg_class WHERE oid = 'products'::regclass"))
+        return max(result.scalar() or 0, 0)
+
+
+async def delete_products_batch(after, limit):
+    # Keyset-bounded: every batch is an index range scan from the last SKU
+    # deleted, and each commits on its own so locks are held only briefly
+    where, params = ("WHERE sku > :after", {"after": after}) if after is not None else ("", {})
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(text(DELETE_BATCH_SQL.format(where=where)), {"limit": limit, **params})
+        deleted, last_sku = result.one()
+        await session.commit()
+    return deleted, last_sku
@@ -0,0 +1,68 @@
+import base64
+import json
+from typing import List, NamedTuple, Optional
+
+from app.models import Product
+
+
+class Page(NamedTuple):
+    items: List[Product]
+    next_cursor: Optional[str]
+    prev_cursor: Optional[str]
+
+
+def encode_cursor(sku):
+    if sku is None:
+        return None
+    return base64.urlsafe_b64encode(json.dumps({"sku": sku}).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    # Raises ValueError for anything that was not produced by encode_cursor
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        return json.loads(base64.urlsafe_b64decode(padded))["sku"]
+    except Exception as e:
+        raise ValueError("Invalid cursor") from e
+
+
+def filter_products(query, search=None, is_active=None, search_description=False):
+    if search:
+        # Case-insensitive substring search, served by the pg_trgm GIN indexes
+        search_filter = f"%{search}%"
+        condition = Product.sku.ilike(search_filter) | Product.name.ilike(search_filter)
+        if search_description:
+            condition = condition | Product.description.ilike(search_filter)
+        query = query.filter(condition)
+
+    if is_active is not None:
+        query = query.filter(Product.is_active == is_active)
+
+    return query
+
+
+async def fetch_page(db, query, limit, after=None, before=None):
+    """Keyset pagination on the sku primary key.
+
+    Each page is an index range scan starting at the cursor, so page 10,000
+    costs the same as page 1. One extra row is fetched to tell whether another
+    page exists in the direction we are moving.
+    """
+    if before is not None:
+        query = query.filter(Product.sku < before).order_by(Product.sku.desc())
+        result = await db.execute(query.limit(limit + 1))
+        rows = result.scalars().all()
+        has_previous = len(rows) > limit
+        items = list(reversed(rows[:limit]))
+        next_sku = items[-1].sku if items else None
+        prev_sku = items[0].sku if has_previous else None
+    else:
+        if after is not None:
+            query = query.filter(Product.sku > after)
+        result = await db.execute(query.order_by(Product.sku).limit(limit + 1))
+        rows = result.scalars().all()
+        items = rows[:limit]
+        next_sku = items[-1].sku if len(rows) > limit else None
+        prev_sku = items[0].sku if after is not None and items else None
+
+    return Page(items, encode_cursor(next_sku), encode_cursor(prev_sku))
@@ -0,0 +1,150 @@
+import json
+import time
+
+import redis
+from prometheus_client.core import GaugeMetricFamily
+
+from app.checkpoints import LARGE_IMPORTS_KEY, lock_key
+from app.config import settings
+
+# Celery queues. Each gets its own workers (see docker-compose.yml), so a
+# multi-million row import never sits in front of small supplier updates or
+# webhook deliveries. Everything else stays on Celery's default queue.
+SMALL_IMPORTS_QUEUE = "imports_small"
+LARGE_IMPORTS_QUEUE = "imports_large"
+WEBHOOKS_QUEUE = "webhooks"
+DEFAULT_QUEUE = "celery"
+QUEUES = (SMALL_IMPORTS_QUEUE, LARGE_IMPORTS_QUEUE, WEBHOOKS_QUEUE, DEFAULT_QUEUE)
+
+# Sent with a 429: large imports rarely finish sooner
+RETRY_AFTER_SECONDS = 60
+
+# Atomic check-and-add, so two uploads can't both take the last slot. Entries
+# not refreshed for IMPORT_LARGE_ADMISSION_TTL belong to imports that will never
+# release them (lost messages, killed workers); running imports refresh theirs
+# with every heartbeat.
+# Returns {admitted, 1-based position among the admitted large imports}.
+ADMIT_LARGE_SCRIPT = """
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[2])
+local rank = redis.call('ZRANK', KEYS[1], ARGV[4])
+if rank then
+    return {1, rank + 1}
+end
+local admitted = redis.call('ZCARD', KEYS[1])
+local limit = tonumber(ARGV[3])
+if limit > 0 and admitted >= limit then
+    return {0, admitted + 1}
+end
+redis.call('ZADD', KEYS[1], ARGV[1], ARGV[4])
+return {1, admitted + 1}
+"""
+
+redis_client = redis.Redis.from_url(settings.CELERY_BROKER_URL)
+admit_large_script = redis_client.register_script(ADMIT_LARGE_SCRIPT)
+
+
+class ImportQueueFull(Exception):
+    def __init__(self, position):
+        super().__init__(f"{settings.IMPORT_LARGE_MAX_PENDING} large imports are already queued or running")
+        self.position = position
+
+
+def import_queue(estimated_rows):
+    return LARGE_IMPORTS_QUEUE if estimated_rows >= settings.IMPORT_LARGE_MIN_ROWS else SMALL_IMPORTS_QUEUE
+
+
+def admit_import(task_id, queue, force=False):
+    """Reserve a slot for an import on `queue`; returns its position in that queue.
+
+    Large imports are capped at IMPORT_LARGE_MAX_PENDING queued or running,
+    beyond which ImportQueueFull is raised, unless `force` (admin restarts).
+    A small import's position is the number of messages ahead of it, plus one.
+    """
+    if queue != LARGE_IMPORTS_QUEUE:
+        return redis_client.llen(queue) + 1
+    now = time.time()
+    limit = 0 if force else settings.IMPORT_LARGE_MAX_PENDING
+    expired = now - settings.IMPORT_LARGE_ADMISSION_TTL
+    admitted, position = admit_large_script(keys=[LARGE_IMPORTS_KEY], args=[now, expired, limit, task_id])
+    if not admitted:
+        raise ImportQueueFull(position)
+    return position
+
+
+def release_import(task_id):
+    # Frees a large import's slot once it completed, failed or was revoked; a no-op otherwise
+    redis_client.zrem(LARGE_IMPORTS_KEY, task_id)
+
+
+def enqueued_at(message):
+    # Stamped on every task message by app.tasks when it is published
+    try:
+        return json.loads(message)["headers"].get("enqueued_at")
+    except (ValueError, KeyError, TypeError):
+        return None
+
+
+def queue_stats():
+    """Depth of every queue and how long its oldest message has waited.
+
+    Read straight from the Redis broker: Celery LPUSHes and workers pop from
+    the other end, so the oldest message is the list's last element.
+    """
+    pipe = redis_client.pipeline()
+    for queue in QUEUES:
+        pipe.llen(queue)
+        pipe.lindex(queue, -1)
+    results = pipe.execute()
+    now = time.time()
+    stats = {}
+    for i, queue in enumerate(QUEUES):
+        depth, oldest = results[2 * i], results[2 * i + 1]
+        sent = enqueued_at(oldest) if oldest else None
+        stats[queue] = {"depth": depth, "oldest_wait_seconds": round(now - sent, 3) if sent else None}
+    return stats
+
+
+def large_imports():
+    now = time.time()
+    admitted = redis_client.zrange(LARGE_IMPORTS_KEY, 0, -1, withscores=True)
+    # Whether each one is running yet, in one round trip
+    pipe = redis_client.pipeline(transaction=False)
+    for task_id, _ in admitted:
+        pipe.exists(lock_key(task_id.decode()))
+    running = pipe.execute()
+    return [
+        {
+            "task_id": task_id.decode(),
+            "position": position,
+            "running": bool(is_locked),
+            # Since admission, or since the last heartbeat once it runs
+            "seen_seconds_ago": round(now - seen_at, 3),
+        }
+        for position, ((task_id, seen_at), is_locked) in enumerate(zip(admitted, running), start=1)
+    ]
+
+
+class QueueCollector:
+    """Queue depths and large import slots, read from Redis at scrape time.
+
+    The broker is shared, so only the web app's /metrics registers it;
+    every process would report the same values.
+    """
+
+    def collect(self):
+        depth = GaugeMetricFamily("celery_queue_depth", "Messages waiting in each Celery queue", labels=["queue"])
+        oldest = GaugeMetricFamily(
+            "celery_queue_oldest_wait_seconds", "Age of the oldest message waiting in each Celery queue", labels=["queue"],
+        )
+        try:
+            stats = queue_stats()
+            admitted = redis_client.zcard(LARGE_IMPORTS_KEY)
+        except redis.RedisError:
+            return
+        for queue, values in stats.items():
+            depth.add_metric([queue], values["depth"])
+            oldest.add_metric([queue], values["oldest_wait_seconds"] or 0)
+        yield depth
+        yield oldest
+        yield GaugeMetricFamily("import_large_admitted", "Large imports queued or running", value=admitted)
+        yield GaugeMetricFamily("import_large_limit", "Most large imports queued or running at once", value=settings.IMPORT_LARGE_MAX_PENDING)
@@ -0,0 +1,283 @@
+import csv
+import gzip
+import io
+import os
+from contextlib import contextmanager
+
+REQUIRED_COLUMNS = ("sku", "name", "description")
+
+# sku and name are btree indexed, and a btree entry can't exceed ~2.7kB
+MAX_SKU_LENGTH = 255
+MAX_NAME_LENGTH = 500
+
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+
+def detect_compression(prefix):
+    # Sniffed from the first bytes rather than trusted from the file name
+    if prefix.startswith(GZIP_MAGIC):
+        return "gzip"
+    if prefix.startswith(ZSTD_MAGIC):
+        return "zstd"
+    return None
+
+
+def zstd_module():
+    try:
+        import zstandard
+    except ImportError:
+        raise ValueError("zstd-compressed uploads need the zstandard package")
+    return zstandard
+
+
+def pyarrow_module():
+    try:
+        import pyarrow
+        import pyarrow.compute
+        import pyarrow.csv
+        import pyarrow.json
+        import pyarrow.parquet
+    except ImportError:
+        raise ValueError("Parquet and NDJSON uploads and the arrow CSV reader need the pyarrow package")
+    return pyarrow
+
+
+# File name suffix -> upload format; compressed uploads add .gz/.zst
+FORMAT_SUFFIXES = {".csv": "csv", ".ndjson": "ndjson", ".jsonl": "ndjson", ".parquet": "parquet"}
+
+
+def upload_format(file_name):
+    name = file_name.lower().removesuffix(".gz").removesuffix(".zst")
+    for suffix, fmt in FORMAT_SUFFIXES.items():
+        if name.endswith(suffix):
+            return fmt
+    return "csv"
+
+
+@contextmanager
+def open_upload(file_path):
+    """Open an upload for reading, decompressing gzip/zstd as a stream.
+
+    Yields (stream, raw): the (decompressed) binary stream to parse, and the
+    underlying file, whose tell() is the number of stored bytes consumed.
+    """
+    with open(file_path, 'rb') as raw:
+        compression = detect_compression(raw.read(4))
+        raw.seek(0)
+        if compression == "gzip":
+            with gzip.GzipFile(fileobj=raw) as stream:
+                yield stream, raw
+        elif compression == "zstd":
+            reader = zstd_module().ZstdDecompressor().stream_reader(raw)
+            with io.BufferedReader(reader) as stream:
+                yield stream, raw
+        else:
+            yield raw, raw
+
+
+def seek_forward(stream, offset):
+    # Decompressing streams may not seek; reading up to the offset is the same
+    if stream.seekable():
+        stream.seek(offset)
+        return
+    remaining = offset - stream.tell()
+    while remaining > 0:
+        block = stream.read(min(remaining, 1024 * 1024))
+        if not block:
+            break
+        remaining -= len(block)
+
+
+def is_compressed(file_path):
+    with open(file_path, 'rb') as f:
+        return detect_compression(f.read(4)) is not None
+
+
+def estimate_rows(file_path, fmt="csv", sample_bytes=1024 * 1024):
+    # Parquet knows its row count; text formats extrapolate the lines in the
+    # first (decompressed) sample over the stored size. Quoted newlines make
+    # this an overestimate, which is fine for sizing decisions.
+    if fmt == "parquet":
+        return pyarrow_module().parquet.ParquetFile(file_path).metadata.num_rows
+    with open_upload(file_path) as (stream, raw):
+        sample = stream.read(sample_bytes)
+        consumed = raw.tell()
+    lines = sample.count(b"\n")
+    header = 1 if fmt == "csv" else 0
+    if len(sample) < sample_bytes or not consumed:
+        return max(lines - header, 0)
+    return int(lines * os.path.getsize(file_path) / consumed)
+
+
+def header_columns(header):
+    if header and header[0].startswith("\ufeff"):
+        header[0] = header[0][1:]
+    columns = {name.strip().lower(): i for i, name in enumerate(header)}
+
+    missing = [name for name in REQUIRED_COLUMNS if name not in columns]
+    if missing:
+        raise ValueError(f"CSV header is missing required columns: {', '.join(missing)}")
+    return columns
+
+
+def split_byte_ranges(file_path, start, shards, start_line=1, block_size=1024 * 1024):
+    """Split file_path from `start` (a row start) to EOF into up to `shards` byte ranges.
+
+    Returns (start, end, first_line) tuples, first_line being the line number
+    the range starts at when `start` is line `start_line`.
+
+    Boundaries are moved forward to the next newline that is outside a quoted
+    field. Quote parity is tracked by counting `"` bytes block by block, which
+    stays correct for escaped quotes ("") and costs far less than parsing.
+    """
+    size = os.path.getsize(file_path)
+    step = max((size - start) // max(shards, 1), 1)
+    boundaries = [(start, start_line)]
+    with open(file_path, 'rb') as f:
+        f.seek(start)
+        pos = start
+        line_number = start_line
+        quotes = 0
+        for i in range(1, shards):
+            target = start + i * step
+            while pos < target:
+                block = f.read(min(block_size, target - pos))
+                if not block:
+                    break
+                quotes += block.count(b'"')
+                line_number += block.count(b"\n")
+                pos += len(block)
+            while True:
+                line = f.readline()
+                if not line:
+                    break
+                quotes += line.count(b'"')
+                line_number += line.count(b"\n")
+                pos += len(line)
+                if quotes % 2 == 0:
+                    break
+            if pos >= size:
+                break
+            boundaries.append((pos, line_number))
+    return [
+        (range_start, range_end, first_line)
+        for (range_start, first_line), (range_end, _) in zip(boundaries, boundaries[1:] + [(size, None)])
+    ]
+
+
+class CsvRecordReader:
+    """Single-pass CSV reader over a binary file that tracks how many bytes it consumed.
+
+    Yields records as (line, sku, name, description, is_active) tuples, where
+    line is the line number the row starts at. Columns are looked up through a
+    header-index map instead of building a dict per row.
+
+    Rows that can't be imported (no sku, overlong fields, broken quoting or
+    encoding) are passed to on_reject(line, reason, row) instead of being
+    yielded, so one bad row never stops the rows after it.
+
+    By default the header is read from the current position. To read a slice of
+    a file, seek to a line start and pass the already parsed `columns`, the
+    `end` offset and the `first_line` number of the slice; rows starting at or
+    after `end` belong to the next slice.
+    """
+
+    def __init__(self, f, columns=None, end=None, first_line=1, on_reject=None):
+        self.f = f
+        # Offsets are positions in the (decompressed) stream
+        self.offset = f.tell()
+        # Where the last yielded row starts, for checkpoints
+        self.row_offset = self.offset
+        self.end = end
+        self.lines = first_line - 1
+        self.on_reject = on_reject
+        self.rejected = 0
+        # Line number -> reason, for problems found before the csv module parses the line
+        self._bad_lines = {}
+        self._reader = csv.reader(self._lines())
+
+        if columns is None:
+            header = next(self._reader, None)
+            if header is None:
+                raise ValueError("CSV file is empty")
+            columns = header_columns(header)
+        self.columns = columns
+        self.data_start = self.offset
+        self.data_start_line = self.lines + 1
+
+    def _lines(self):
+        # Feeding csv.reader line by line keeps quoted multi-line fields
+        # working while letting us count the exact bytes and lines consumed.
+        for line in self.f:
+            self.offset += len(line)
+            self.lines += 1
+            try:
+                text = line.decode("utf-8")
+            except UnicodeDecodeError:
+                self._bad_lines[self.lines] = "invalid UTF-8"
+                text = line.decode("utf-8", errors="replace")
+            if "\x00" in text:
+                # Postgres text can't store NUL characters
+                self._bad_lines[self.lines] = "contains a NUL character"
+            yield text
+
+    def _reject(self, line, reason, row):
+        self.rejected += 1
+        if self.on_reject:
+            self.on_reject(line, reason, row)
+
+    def __iter__(self):
+        sku_index = self.columns["sku"]
+        name_index = self.columns["name"]
+        description_index = self.columns["description"]
+        is_active_index = self.columns.get("is_active")
+
+        while True:
+            if self.end is not None and self.offset >= self.end:
+                return
+            line = self.lines + 1
+            row_offset = self.offset
+            try:
+                row = next(self._reader, None)
+            except csv.Error as e:
+                self._bad_lines.clear()
+                self._reject(line, f"malformed CSV: {e}", [])
+                continue
+            if row is None:
+                return
+            if not row:
+                # Blank line, csv.DictReader used to skip these as well
+                continue
+            if self._bad_lines:
+                reason = next((self._bad_lines.pop(n) for n in range(line, self.lines + 1) if n in self._bad_lines), None)
+                if reason:
+                    self._reject(line, reason, row)
+                    continue
+
+            width = len(row)
+            sku = row[sku_index].lower() if sku_index < width else ""
+            name = row[name_index] if name_index < width else None
+            if not sku:
+                self._reject(line, "missing sku", row)
+                continue
+            if len(sku) > MAX_SKU_LENGTH:
+                self._reject(line, f"sku is longer than {MAX_SKU_LENGTH} characters", row)
+                continue
+            if name is not None and len(name) > MAX_NAME_LENGTH:
+                self._reject(line, f"name is longer than {MAX_NAME_LENGTH} characters", row)
+                continue
+
+            if is_active_index is None:
+                is_active = True
+            else:
+                is_active = is_active_index < width and row[is_active_index].lower() == "true"
+
+            self.row_offset = row_offset
+            yield (
+                line,
+                sku,
+                name,
+                row[description_index] if description_index < width else None,
+                is_active,
+            )
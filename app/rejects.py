@@ -0,0 +1,118 @@
+import csv
+import glob
+import os
+import shutil
+
+from app.config import settings
+
+REJECTS_DIR = os.path.join(settings.UPLOAD_DIR, "rejects")
+
+
+def rejects_path(task_id, shard=None):
+    name = task_id if shard is None else f"{task_id}.{shard}"
+    return os.path.join(REJECTS_DIR, f"{name}.csv")
+
+
+def header_names(columns):
+    return [name for name, _ in sorted(columns.items(), key=lambda item: item[1])]
+
+
+def record_row(record, columns):
+    # Puts a parsed record back into the upload's column layout
+    row = [""] * len(columns)
+    _, sku, name, description, is_active = record
+    row[columns["sku"]] = sku
+    row[columns["name"]] = name or ""
+    row[columns["description"]] = description or ""
+    if "is_active" in columns:
+        row[columns["is_active"]] = "true" if is_active else "false"
+    return row
+
+
+class RejectWriter:
+    """Collects rows an import skipped as line, reason + the row in the upload's columns.
+
+    The file is only created on the first reject, and can be fixed and uploaded
+    again as is since the original columns follow the first two.
+    """
+
+    def __init__(self, path, columns):
+        self.path = path
+        self.columns = columns
+        self.count = 0
+        self._file = None
+        self._writer = None
+
+    def write(self, line, reason, row):
+        if self._file is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._file = open(self.path, "w", newline="", encoding="utf-8")
+            self._writer = csv.writer(self._file)
+            self._writer.writerow(["line", "reason"] + header_names(self.columns))
+        self._writer.writerow([line, reason] + row)
+        self.count += 1
+
+    def resume(self, before_line):
+        # A resumed import parses everything from before_line again, so drop
+        # the rejects it is about to report a second time
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, newline="", encoding="utf-8") as f:
+            rows = list(csv.reader(f)) or [["line", "reason"] + header_names(self.columns)]
+        # Created but never flushed before the crash, hence possibly empty
+        kept = [row for row in rows[1:] if row and row[0].isdigit() and int(row[0]) < before_line]
+        self._file = open(self.path, "w", newline="", encoding="utf-8")
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(rows[0])
+        self._writer.writerows(kept)
+        self.count = len(kept)
+
+    def flush(self):
+        if self._file is not None:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def write_record(self, record, reason):
+        self.write(record[0], reason, record_row(record, self.columns))
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def discard_rejects(task_id, shard=None):
+    # For an import or shard starting from scratch: an earlier attempt's
+    # rejects would otherwise linger if this one rejects nothing
+    try:
+        os.remove(rejects_path(task_id, shard))
+    except FileNotFoundError:
+        pass
+
+
+def discard_shard_rejects(task_id):
+    # Every shard's file, including shards a previous attempt had and this one doesn't
+    for path in glob.glob(os.path.join(REJECTS_DIR, f"{glob.escape(task_id)}.*.csv")):
+        os.remove(path)
+    discard_rejects(task_id)
+
+
+def combine_shard_rejects(task_id, shards):
+    # Shards cover consecutive ranges of the file, so concatenating their files
+    # in shard order keeps the rejects sorted by line
+    parts = [rejects_path(task_id, shard) for shard in range(shards)]
+    parts = [path for path in parts if os.path.exists(path)]
+    if not parts:
+        return
+    with open(rejects_path(task_id), "wb") as out:
+        for i, path in enumerate(parts):
+            with open(path, "rb") as part:
+                if i:
+                    part.readline()
+                shutil.copyfileobj(part, out)
+            os.remove(path)
@@ -1,7 +1,9 @@
-from pydantic import BaseModel
-from typing import Optional
+from pydantic import BaseModel, Field
+from typing import Dict, List, Literal, Optional
 from datetime import datetime
 
+from app.config import settings
+
 class ProductBase(BaseModel):
     name: str
     description: Optional[str] = None
@@ -15,6 +17,28 @@ class ProductUpdate(BaseModel):
     description: Optional[str] = None
     is_active: Optional[bool] = None
 
+class ProductPatch(ProductUpdate):
+    sku: str
+
+class BulkUpsertRequest(BaseModel):
+    items: List[ProductCreate] = Field(min_length=1, max_length=settings.BULK_MAX_ITEMS)
+
+class BulkPatchRequest(BaseModel):
+    items: List[ProductPatch] = Field(min_length=1, max_length=settings.BULK_MAX_ITEMS)
+
+class BulkDeleteRequest(BaseModel):
+    skus: List[str] = Field(min_length=1, max_length=settings.BULK_MAX_ITEMS)
+
+class BulkItemResult(BaseModel):
+    sku: str
+    # created / updated / unchanged / deleted / not_found / invalid
+    status: str
+    error: Optional[str] = None
+
+class BulkResponse(BaseModel):
+    results: List[BulkItemResult]
+    counts: Dict[str, int]
+
 class ProductResponse(ProductBase):
     sku: str
     created_at: datetime
@@ -23,10 +47,30 @@ class ProductResponse(ProductBase):
     class Config:
         from_attributes = True
 
+class ProductChange(BaseModel):
+    change_seq: int
+    sku: str
+    # Deletes carry only the SKU
+    deleted: bool
+    name: Optional[str] = None
+    description: Optional[str] = None
+    is_active: Optional[bool] = None
+    changed_at: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
+
+class ProductChangesResponse(BaseModel):
+    changes: List[ProductChange]
+    # Pass back as ?since= for the next page
+    next_since: int
+    has_more: bool
+
 class WebhookBase(BaseModel):
     url: str
     event_type: str
     is_active: bool = True
+    delivery_mode: Literal["event", "batch"] = "event"
 
 class WebhookCreate(WebhookBase):
     pass
@@ -0,0 +1,122 @@
+import hashlib
+import json
+
+import redis
+import redis.asyncio
+from sqlalchemy import func, select, text
+
+from app.config import settings
+from app.database import AsyncSessionLocal
+from app.models import Product
+from app.queries import filter_products
+
+# Exact active/inactive counts. CRUD paths adjust them as they go; imports,
+# bulk deletes and purges, which touch too many rows to track one by one,
+# recount once they finish.
+COUNTS_KEY = "stats:products:counts"
+# Set while a recount is queued, so a cold cache under load queues one full
+# count rather than one per request. Expires in case the task is lost.
+RECOUNT_QUEUED_KEY = "stats:products:recount_queued"
+RECOUNT_QUEUED_SECONDS = 60
+# Filtered counts stop at this many rows, so a broad search never scans the table
+COUNT_LIMIT = 10000
+
+redis_client = redis.Redis.from_url(settings.CELERY_BROKER_URL)
+async_redis_client = redis.asyncio.Redis.from_url(settings.CELERY_BROKER_URL)
+
+
+def filtered_count_key(search, is_active):
+    digest = hashlib.sha1(json.dumps([search, is_active]).encode()).hexdigest()
+    return f"stats:products:filtered:{digest}"
+
+
+async def count_changes(changes):
+    """Apply (old_is_active, new_is_active) pairs to the exact counts.
+
+    None stands for "no row": (None, True) is an active product being created,
+    (False, None) an inactive one being deleted.
+    """
+    active = inactive = 0
+    for old, new in changes:
+        if old is not None:
+            active, inactive = (active - 1, inactive) if old else (active, inactive - 1)
+        if new is not None:
+            active, inactive = (active + 1, inactive) if new else (active, inactive + 1)
+    if not (active or inactive):
+        return
+    # Only adjust counts that exist; missing counts are rebuilt by a recount.
+    # Filtered counts are short-lived and simply allowed to lag.
+    if await async_redis_client.exists(COUNTS_KEY):
+        pipe = async_redis_client.pipeline()
+        pipe.hincrby(COUNTS_KEY, "active", active)
+        pipe.hincrby(COUNTS_KEY, "inactive", inactive)
+        await pipe.execute()
+
+
+async def count_change(old, new):
+    await count_changes([(old, new)])
+
+
+async def recount_products():
+    # One full scan; only run from the worker after bulk changes
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(
+            select(
+                func.count().filter(Product.is_active.is_(True)),
+                func.count().filter(Product.is_active.isnot(True)),
+            )
+        )
+        active, inactive = result.one()
+    redis_client.hset(COUNTS_KEY, mapping={"active": active, "inactive": inactive})
+    return active, inactive
+
+
+def recount_done():
+    redis_client.delete(RECOUNT_QUEUED_KEY)
+
+
+def reset_counts():
+    redis_client.hset(COUNTS_KEY, mapping={"active": 0, "inactive": 0})
+
+
+async def estimated_total(db):
+    # Planner statistics, kept current by autovacuum/ANALYZE; -1 if never analyzed
+    result = await db.execute(text("SELECT reltuples::bigint FROM pg_class WHERE oid = 'products'::regclass"))
+    return max(result.scalar() or 0, 0)
+
+
+async def product_counts(db):
+    """Totals for the dashboard header without counting the table.
+
+    Exact when the Redis counts exist, otherwise the planner's estimate (and a
+    recount is queued so the next request is exact).
+    """
+    counts = await async_redis_client.hgetall(COUNTS_KEY)
+    if counts:
+        active, inactive = int(counts.get(b"active", 0)), int(counts.get(b"inactive", 0))
+        return {"total": active + inactive, "active": active, "inactive": inactive, "estimate": False}
+
+    if await async_redis_client.set(RECOUNT_QUEUED_KEY, 1, nx=True, ex=RECOUNT_QUEUED_SECONDS):
+        from app.tasks import refresh_product_counts
+        refresh_product_counts.delay()
+    return {"total": await estimated_total(db), "active": None, "inactive": None, "estimate": True}
+
+
+async def count_products(db, search=None, is_active=None, search_description=False, counts=None):
+    """Total for one listing. Returns (count, capped); capped means "at least count"."""
+    if not search:
+        counts = counts or await product_counts(db)
+        if is_active is None:
+            return counts["total"], False
+        # None while only the estimate is available
+        return counts["active"] if is_active else counts["inactive"], False
+
+    key = filtered_count_key([search, search_description], is_active)
+    cached = await async_redis_client.get(key)
+    if cached is not None:
+        count = int(cached)
+    else:
+        query = filter_products(select(Product.sku), search, is_active, search_description).limit(COUNT_LIMIT + 1)
+        count = (await db.execute(select(func.count()).select_from(query.subquery()))).scalar()
+        await async_redis_client.set(key, count, ex=settings.STATS_FILTERED_COUNT_TTL)
+    return min(count, COUNT_LIMIT), count > COUNT_LIMIT
@@ -1,14 +1,67 @@
-from celery import Celery
+from celery import Celery, chord, group
+from celery.signals import (
+    before_task_publish,
+    task_prerun,
+    task_revoked,
+    worker_init,
+    worker_process_init,
+    worker_process_shutdown,
+)
 import os
-import csv
+import time
 import asyncio
-from app.database import AsyncSessionLocal
-from app.models import Product
-from sqlalchemy.future import select
-from sqlalchemy.dialects.postgresql import insert
+from datetime import datetime
+from functools import partial
+from app.database import engine, read_engine
+from app.metrics import StageTimings, collector_registry, queue_wait_seconds, record_import
+from app.importer import (
+    ImportPipeline,
+    ShardStagingWriter,
+    discard_sharded_import,
+    make_writer,
+    merge_sharded_import,
+)
+from app.columnar import REJECT_COLUMNS, ArrowSource, ColumnarImport
+from app.readers import (
+    CsvRecordReader,
+    estimate_rows,
+    is_compressed,
+    open_upload,
+    seek_forward,
+    split_byte_ranges,
+    upload_format,
+)
+from app.cache import invalidate_all_products
+from app.indexes import (
+    create_secondary_indexes,
+    defer_indexes,
+    drop_secondary_indexes,
+    release_indexes,
+    should_defer,
+)
+from app.changes import current_change_seq
+from app.checkpoints import (
+    acquire_import,
+    change_start,
+    finish_tracking,
+    heartbeat,
+    heartbeating,
+    load_checkpoint,
+    mark_failed,
+    register_import,
+    remember_change_start,
+    save_checkpoint,
+)
+from app.outbox import pop_events
+from app.progress import PROGRESS_TTL, ProgressPublisher, publish_failed
+from app.queues import DEFAULT_QUEUE, LARGE_IMPORTS_QUEUE, SMALL_IMPORTS_QUEUE, WEBHOOKS_QUEUE, release_import
+from app.purge import delete_products_batch, estimate_product_count, try_truncate_products
+from app.rejects import RejectWriter, combine_shard_rejects, discard_rejects, discard_shard_rejects, rejects_path
+from app.stats import recount_done, recount_products, reset_counts
+from app.uploads import remember_imported_upload
+from app.webhook_delivery import dispatch_event, dispatch_events
 import redis
-import json
-from sqlalchemy.sql import func
+from prometheus_client import multiprocess, start_http_server
 
 from app.config import settings
 
@@ -27,111 +80,466 @@ celery_app.conf.update(
     result_serializer="json",
     timezone="UTC",
     enable_utc=True,
+    # process_csv_upload is sent to a queue picked by upload size, see
+    # app.queues; this is where it goes when none is given
+    task_routes={
+        "app.tasks.process_csv_upload": {"queue": SMALL_IMPORTS_QUEUE},
+        "app.tasks.import_csv_shard": {"queue": LARGE_IMPORTS_QUEUE},
+        "app.tasks.finalize_sharded_import": {"queue": LARGE_IMPORTS_QUEUE},
+        "app.tasks.trigger_webhooks": {"queue": WEBHOOKS_QUEUE},
+        "app.tasks.flush_webhook_outbox": {"queue": WEBHOOKS_QUEUE},
+    },
+    worker_prefetch_multiplier=settings.CELERY_PREFETCH_MULTIPLIER,
 )
 
 redis_client = redis.Redis.from_url(CELERY_BROKER_URL)
 
-async def upsert_chunk(chunk):
-    async with AsyncSessionLocal() as session:
-        values = [
-            {
-                "sku": row["sku"],
-                "name": row["name"],
-                "description": row["description"],
-                "is_active": str(row.get("is_active", "true")).lower() == "true"
-            }
-            for row in chunk
-        ]
-        
-        stmt = insert(Product).values(values)
-        stmt = stmt.on_conflict_do_update(
-            index_elements=['sku'],
-            set_={
-                "name": stmt.excluded.name,
-                "description": stmt.excluded.description,
-                "is_active": stmt.excluded.is_active,
-                "updated_at": func.now()
-            }
-        )
-        await session.execute(stmt)
-        await session.commit()
-
-@celery_app.task(bind=True)
-def process_csv_upload(self, file_path: str, task_id: str):
-    loop = asyncio.get_event_loop()
-    if loop.is_closed():
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-
-    total_rows = 0
-    with open(file_path, 'r') as f:
-        reader = csv.DictReader(f)
-        total_rows = sum(1 for _ in reader)
-
-    chunk_size = 1000
-    processed_rows = 0
-    
-    with open(file_path, 'r') as f:
-        reader = csv.DictReader(f)
-        chunk = []
-        for row in reader:
-            row['sku'] = row['sku'].lower()
-            chunk.append(row)
-            
-            if len(chunk) >= chunk_size:
-                # Deduplicate chunk to avoid CardinalityViolationError
-                # If multiple rows in the same chunk have the same SKU, the last one wins
-                deduplicated_chunk = list({r['sku']: r for r in chunk}.values())
-                
-                loop.run_until_complete(upsert_chunk(deduplicated_chunk))
-                processed_rows += len(chunk) # Count total rows processed from CSV, even if some were deduped
-                chunk = []
-                
-                progress = int((processed_rows / total_rows) * 100)
-                redis_client.set(f"progress:{task_id}", progress)
-                print(f"Updated progress for {task_id}: {progress}%")
-                self.update_state(state='PROGRESS', meta={'current': processed_rows, 'total': total_rows, 'percent': progress})
-
-        if chunk:
-            deduplicated_chunk = list({r['sku']: r for r in chunk}.values())
-            loop.run_until_complete(upsert_chunk(deduplicated_chunk))
-            processed_rows += len(chunk)
-            redis_client.set(f"progress:{task_id}", 100)
-    
+# One event loop per worker process. The engine's pooled asyncpg connections are
+# bound to the loop that opened them, so reusing the loop lets every task reuse
+# the pool instead of reconnecting.
+_loop = None
+
+def get_worker_loop():
+    global _loop
+    if _loop is None or _loop.is_closed():
+        _loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(_loop)
+    return _loop
+
+def run_async(coro):
+    return get_worker_loop().run_until_complete(coro)
+
+@worker_process_init.connect
+def init_worker_process(**kwargs):
+    # Never share pooled connections with the parent process across fork
+    engine.sync_engine.dispose(close=False)
+    if read_engine is not engine:
+        read_engine.sync_engine.dispose(close=False)
+    get_worker_loop()
+
+@worker_init.connect
+def start_metrics_exporter(**kwargs):
+    # Served by the main worker process; pool processes only report their
+    # samples through PROMETHEUS_MULTIPROC_DIR, see app.metrics
+    if settings.METRICS_WORKER_PORT:
+        start_http_server(settings.METRICS_WORKER_PORT, registry=collector_registry())
+
+@before_task_publish.connect
+def stamp_enqueued_at(headers=None, **kwargs):
+    # Lets workers (and app.queues.queue_stats) tell how long a message waited
+    headers.setdefault("enqueued_at", time.time())
+
+@task_prerun.connect
+def observe_queue_wait(task=None, **kwargs):
+    request = task.request
+    sent = request.get("enqueued_at") or (request.headers or {}).get("enqueued_at")
+    if not sent or request.is_eager:
+        return
+    if request.eta:
+        # Countdown tasks only start waiting at their ETA
+        eta = datetime.fromisoformat(request.eta) if isinstance(request.eta, str) else request.eta
+        sent = max(sent, eta.timestamp())
+    queue = (request.delivery_info or {}).get("routing_key") or DEFAULT_QUEUE
+    queue_wait_seconds.labels(queue).observe(max(time.time() - sent, 0))
+
+@worker_process_shutdown.connect
+def remove_process_metrics(pid=None, **kwargs):
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        multiprocess.mark_process_dead(pid or os.getpid())
+
+class ImportTask(celery_app.Task):
+    # Position of the upload's task_id among the task's positional arguments
+    import_id_arg = 1
+
+    def on_failure(self, exc, celery_task_id, args, kwargs, einfo):
+        # Lets progress streams close instead of waiting for 100% forever
+        import_id = kwargs.get("task_id") or args[self.import_id_arg]
+        publish_failed(import_id, str(exc) or exc.__class__.__name__)
+        # Keeps the checkpoint, so the import can be restarted from the admin API
+        mark_failed(import_id, str(exc) or exc.__class__.__name__)
+        release_import(import_id)
+        if release_indexes(import_id):
+            run_async(create_secondary_indexes())
+
+@task_revoked.connect
+def release_revoked_import(request=None, **kwargs):
+    # A revoked import never runs to release its large import slot itself
+    task = celery_app.tasks.get(request.task) if request else None
+    if isinstance(task, ImportTask):
+        release_import(request.kwargs.get("task_id") or request.args[task.import_id_arg])
+
+def report_progress(task, publisher, processed_rows, bytes_read, total_bytes, errors=0):
+    # Progress comes from the bytes consumed so far, which avoids a separate
+    # pass over the file just to count rows. The row total is extrapolated
+    # from the average row size seen so far.
+    progress = min(int(bytes_read * 100 / total_bytes), 99) if total_bytes else 99
+    estimated_total = int(processed_rows * total_bytes / bytes_read) if bytes_read else processed_rows
+    publisher.update(progress, processed_rows, errors)
+    heartbeat(publisher.task_id)
+    task.update_state(state='PROGRESS', meta={
+        'current': processed_rows,
+        'total': max(estimated_total, processed_rows),
+        'errors': errors,
+        'percent': progress,
+        'bytes_read': bytes_read,
+        'total_bytes': total_bytes,
+    })
+
+def shards_key(task_id):
+    return f"progress:{task_id}:shards"
+
+def report_shard_progress(task, publisher, shard, processed_rows, bytes_read, total_bytes, errors=0):
+    # Every shard records its own byte and row counts; the progress published
+    # for the import is the sum across shards.
+    key = shards_key(publisher.task_id)
+    pipe = redis_client.pipeline()
+    pipe.hset(key, mapping={f"bytes:{shard}": bytes_read, f"rows:{shard}": processed_rows, f"errors:{shard}": errors})
+    pipe.expire(key, PROGRESS_TTL)
+    pipe.hgetall(key)
+    counts = pipe.execute()[-1]
+    done_bytes = sum(int(value) for field, value in counts.items() if field.startswith(b"bytes:"))
+    done_rows = sum(int(value) for field, value in counts.items() if field.startswith(b"rows:"))
+    done_errors = sum(int(value) for field, value in counts.items() if field.startswith(b"errors:"))
+
+    progress = min(int(done_bytes * 100 / total_bytes), 99) if total_bytes else 99
+    publisher.update(progress, done_rows, done_errors)
+    heartbeat(publisher.task_id)
+    task.update_state(state='PROGRESS', meta={
+        'current': processed_rows,
+        'shard': shard,
+        'percent': progress,
+        'bytes_read': done_bytes,
+        'total_bytes': total_bytes,
+    })
+
+def shard_started_at(task_id):
+    started_at = redis_client.hget(shards_key(task_id), "started_at")
+    return float(started_at) if started_at else None
+
+def import_counts(accepted_rows, inserted, updated, rejected):
+    # Unchanged also covers rows superseded by a later row for the same SKU
+    return {
+        "inserted": inserted,
+        "updated": updated,
+        "unchanged": accepted_rows - inserted - updated,
+        "rejected": rejected,
+    }
+
+def import_summary(timings, processed_rows, seconds):
+    # Stored in the task result, so a slow import shows where its time went
+    return {
+        "seconds": round(seconds, 3),
+        "rows_per_sec": round(processed_rows / seconds) if seconds else None,
+        "timings": timings.summary(),
+    }
+
+def maybe_defer_indexes(task_id, file_path, fmt):
+    # Large loads skip secondary index maintenance and rebuild once at the end
+    if not settings.IMPORT_DEFER_INDEXES_MIN_ROWS:
+        return False
+    if not should_defer(estimate_rows(file_path, fmt), run_async(estimate_product_count())):
+        return False
+    defer_indexes(task_id)
+    run_async(drop_secondary_indexes())
+    return True
+
+def restore_indexes(publisher, timings, processed_rows, errors=0):
+    # Rebuilt before the import reports completion, so a finished import is
+    # searchable at full speed again
+    if not release_indexes(publisher.task_id):
+        return False
+    publisher.update(99, processed_rows, errors, stage="indexing")
+    with timings.stage("indexes"):
+        run_async(heartbeating(publisher.task_id, create_secondary_indexes()))
+    return True
+
+def finish_import(file_path, publisher, processed_rows, counts, content_hash=None, seconds=None):
+    if seconds is not None:
+        record_import(seconds, counts)
+    # Far too many rows to invalidate one by one, bump the cache version instead
+    invalidate_all_products()
+    if content_hash:
+        # Recorded against the new catalogue version, so uploading the same
+        # file again right away is answered without re-importing it
+        remember_imported_upload(content_hash, publisher.task_id, os.path.getsize(file_path))
+    extra = {"rejects_url": f"/api/imports/{publisher.task_id}/rejects"} if counts["rejected"] else {}
+    publisher.complete(processed_rows, errors=counts["rejected"], **counts, **extra)
+    # What the import changed is in the change feed between these two
+    # positions, along with whatever else was written meanwhile
+    changes = {"changes_since": change_start(publisher.task_id), "changes_until": run_async(current_change_seq())}
+    finish_tracking(publisher.task_id)
+    release_import(publisher.task_id)
     os.remove(file_path)
-    
+    refresh_product_counts.delay()
+
     # Trigger webhooks after successful import
     if processed_rows > 0:
-        trigger_webhooks.delay("product.import_completed", {"count": processed_rows})
+        trigger_webhooks.delay("product.import_completed", {"count": processed_rows, **counts, **changes})
+
+def worker_id(task):
+    return f"{task.request.hostname}:{os.getpid()}"
+
+# acks_late + reject_on_worker_lost: an import whose worker is killed goes back
+# to the queue instead of being lost, and continues from its last checkpoint.
+@celery_app.task(bind=True, base=ImportTask, acks_late=True, reject_on_worker_lost=True)
+def process_csv_upload(self, file_path: str, task_id: str, load_mode: str = None, shards: int = None, content_hash: str = None):
+    if not os.path.exists(file_path):
+        # Redelivered after the import finished and removed its upload
+        release_import(task_id)
+        return {"status": "Skipped", "reason": "Upload no longer exists"}
+    if not acquire_import(task_id, worker_id(self)):
+        # Either another worker is still on it, or the previous attempt's
+        # process died and its lock hasn't expired yet: look again later
+        raise self.retry(countdown=settings.IMPORT_STALL_SECONDS, max_retries=None)
+    register_import(task_id, file_path=file_path, load_mode=load_mode, shards=shards, content_hash=content_hash)
+    remember_change_start(task_id, run_async(current_change_seq()))
+
+    started = time.perf_counter()
+    load_mode = load_mode or settings.IMPORT_LOAD_MODE
+    total_bytes = os.path.getsize(file_path)
+    publisher = ProgressPublisher(task_id)
+
+    fmt = upload_format(file_path)
+    indexes_deferred = maybe_defer_indexes(task_id, file_path, fmt)
+    if fmt != "csv" or settings.IMPORT_CSV_READER == "arrow":
+        return import_columnar(self, file_path, task_id, fmt, publisher, content_hash)
 
-    return {"status": "Completed", "total_processed": processed_rows}
+    if is_compressed(file_path):
+        # Byte ranges of a compressed stream can't be read independently
+        shards = 1
+    elif shards is None:
+        shards = settings.IMPORT_SHARD_COUNT if total_bytes >= settings.IMPORT_SHARD_MIN_BYTES else 1
+    if shards > 1:
+        return start_sharded_import(file_path, task_id, shards, content_hash)
+
+    # Rows before the checkpoint are committed. Rows after it may be too, but
+    # upserts are idempotent, so they are simply applied again.
+    checkpoint = load_checkpoint(task_id)
+    base = checkpoint or {"rows": 0, "inserted": 0, "updated": 0}
+    if not checkpoint:
+        discard_rejects(task_id)
+
+    # Progress is measured on the stored (possibly compressed) bytes consumed
+    with open_upload(file_path) as (stream, raw):
+        reader = CsvRecordReader(stream)
+        if checkpoint:
+            seek_forward(stream, checkpoint["offset"])
+            reader = CsvRecordReader(stream, columns=reader.columns, first_line=checkpoint["line"])
+        with RejectWriter(rejects_path(task_id), reader.columns) as rejects:
+            if checkpoint:
+                rejects.resume(checkpoint["line"])
+            reader.on_reject = rejects.write
+
+            def on_checkpoint(offset, line, rows, inserted, updated):
+                # A resume keeps the rejects before the checkpoint, so they must be on disk first
+                rejects.flush()
+                save_checkpoint(
+                    task_id, offset, line, base["rows"] + rows,
+                    inserted=base["inserted"] + inserted, updated=base["updated"] + updated,
+                )
+
+            pipeline = ImportPipeline(
+                partial(make_writer, load_mode),
+                concurrency=settings.IMPORT_WRITER_CONCURRENCY,
+                queue_depth=settings.IMPORT_QUEUE_DEPTH,
+                chunk_size=settings.IMPORT_CHUNK_SIZE,
+                on_batch=lambda committed: report_progress(self, publisher, base["rows"] + committed, raw.tell(), total_bytes, rejects.count),
+                on_reject=rejects.write_record,
+                on_checkpoint=on_checkpoint,
+            )
+            # copy mode merges everything in one statement at the end
+            processed_rows = base["rows"] + run_async(heartbeating(task_id, pipeline.run(reader)))
+    restore_indexes(publisher, pipeline.timings, processed_rows, rejects.count)
+
+    # The copy writers only merge into products when they finish, so 100% is
+    # reported once everything is committed for both modes.
+    counts = import_counts(
+        processed_rows - pipeline.rejected_rows,
+        base["inserted"] + pipeline.inserted_rows,
+        base["updated"] + pipeline.updated_rows,
+        rejects.count,
+    )
+    # Resumed imports only time (and count rows/sec for) this attempt
+    seconds = time.perf_counter() - started
+    finish_import(file_path, publisher, processed_rows, counts, content_hash, seconds)
+
+    return {
+        "status": "Completed", "total_processed": processed_rows, "load_mode": load_mode, **counts,
+        "indexes_deferred": indexes_deferred,
+        **import_summary(pipeline.timings, processed_rows - base["rows"], seconds),
+    }
+
+def import_columnar(task, file_path, task_id, fmt, publisher, content_hash=None):
+    # Always a single task without checkpoints: Arrow reads ahead in blocks,
+    # so there is no exact resume position. A redelivered import starts over,
+    # which the idempotent upserts allow.
+    started = time.perf_counter()
+    total_bytes = os.path.getsize(file_path)
+    discard_rejects(task_id)
+    with open_upload(file_path) as (stream, raw), RejectWriter(rejects_path(task_id), REJECT_COLUMNS) as rejects:
+        source = ArrowSource(fmt, file_path, stream, raw, total_bytes, settings.IMPORT_ARROW_BATCH_ROWS, on_reject=rejects.write)
+        pipeline = ColumnarImport(
+            source,
+            on_batch=lambda committed: report_progress(task, publisher, committed, int(source.fraction * total_bytes), total_bytes, rejects.count),
+            on_reject=rejects.write_record,
+        )
+        processed_rows = run_async(pipeline.run())
+    indexes_deferred = restore_indexes(publisher, pipeline.timings, processed_rows, rejects.count)
+
+    counts = import_counts(processed_rows - pipeline.rejected_rows, pipeline.inserted_rows, pipeline.updated_rows, rejects.count)
+    seconds = time.perf_counter() - started
+    finish_import(file_path, publisher, processed_rows, counts, content_hash, seconds)
+
+    return {
+        "status": "Completed", "total_processed": processed_rows, "format": fmt, "reader": "arrow", **counts,
+        "indexes_deferred": indexes_deferred,
+        **import_summary(pipeline.timings, processed_rows, seconds),
+    }
+
+def start_sharded_import(file_path, task_id, shards, content_hash=None):
+    with open(file_path, 'rb') as f:
+        reader = CsvRecordReader(f)
+        columns, data_start, data_start_line = reader.columns, reader.data_start, reader.data_start_line
+
+    ranges = split_byte_ranges(file_path, data_start, shards, start_line=data_start_line)
+    # Rows are tagged with a SKU partition while staging, so the finalizer can
+    # merge partitions concurrently without two merges touching the same SKU.
+    partitions = settings.IMPORT_WRITER_CONCURRENCY
+    pipe = redis_client.pipeline()
+    pipe.delete(shards_key(task_id))
+    pipe.hset(shards_key(task_id), "started_at", time.time())
+    pipe.expire(shards_key(task_id), PROGRESS_TTL)
+    pipe.execute()
+    # Sharded imports always start over
+    discard_shard_rejects(task_id)
+
+    header = group(
+        import_csv_shard.s(file_path, task_id, shard, columns, start, end, first_line, partitions)
+        for shard, (start, end, first_line) in enumerate(ranges)
+    )
+    callback = finalize_sharded_import.s(file_path, task_id, partitions, content_hash)
+    chord(header)(callback.on_error(abort_sharded_import.si(task_id)))
+
+    return {"status": "Sharded", "shards": len(ranges)}
+
+# A redelivered shard stages its range again from the start; the duplicate rows
+# carry the same line numbers and collapse in the merge's DISTINCT ON.
+@celery_app.task(bind=True, base=ImportTask, acks_late=True, reject_on_worker_lost=True)
+def import_csv_shard(self, file_path: str, task_id: str, shard: int, columns: dict, start: int, end: int, first_line: int, partitions: int):
+    total_bytes = os.path.getsize(file_path)
+    publisher = ProgressPublisher(task_id, started_at=shard_started_at(task_id))
+    # A redelivered shard reads its range again from the start
+    discard_rejects(task_id, shard)
+
+    with open(file_path, 'rb') as f, RejectWriter(rejects_path(task_id, shard), columns) as rejects:
+        f.seek(start)
+        reader = CsvRecordReader(f, columns=columns, end=end, first_line=first_line, on_reject=rejects.write)
+        # Shards already run in parallel, so one staging writer per shard is enough
+        pipeline = ImportPipeline(
+            lambda session: ShardStagingWriter(session, task_id, partitions),
+            concurrency=1,
+            queue_depth=settings.IMPORT_QUEUE_DEPTH,
+            chunk_size=settings.IMPORT_CHUNK_SIZE,
+            on_batch=lambda committed: report_shard_progress(self, publisher, shard, committed, reader.offset - start, total_bytes, rejects.count),
+            on_reject=rejects.write_record,
+        )
+        processed_rows = run_async(pipeline.run(reader))
+    return {"rows": processed_rows - pipeline.rejected_rows, "rejected": rejects.count, "timings": pipeline.timings.summary()}
+
+@celery_app.task(base=ImportTask, import_id_arg=2, acks_late=True, reject_on_worker_lost=True)
+def finalize_sharded_import(shard_results: list, file_path: str, task_id: str, partitions: int, content_hash: str = None):
+    processed_rows = sum(result["rows"] for result in shard_results)
+    rejected = sum(result["rejected"] for result in shard_results)
+    started_at = shard_started_at(task_id)
+    publisher = ProgressPublisher(task_id, started_at=started_at)
+    publisher.update(99, processed_rows, rejected, stage="merging")
+    # Stage seconds are summed over the shards, which ran in parallel
+    timings = StageTimings()
+    for result in shard_results:
+        timings.merge(result.get("timings", {}))
+    merged = run_async(heartbeating(task_id, merge_sharded_import(task_id, partitions, timings)))
+    counts = import_counts(processed_rows, *merged, rejected)
+    combine_shard_rejects(task_id, len(shard_results))
+    indexes_deferred = restore_indexes(publisher, timings, processed_rows, rejected)
+
+    redis_client.delete(shards_key(task_id))
+    seconds = time.time() - started_at if started_at else None
+    finish_import(file_path, publisher, processed_rows, counts, content_hash, seconds)
+
+    return {
+        "status": "Completed", "total_processed": processed_rows, "shards": len(shard_results), **counts,
+        "indexes_deferred": indexes_deferred,
+        **import_summary(timings, processed_rows, seconds or 0),
+    }
+
+@celery_app.task
+def abort_sharded_import(task_id: str):
+    # A shard failed: drop whatever the other shards staged. The upload is
+    # left in place, as it is when a single-task import fails.
+    run_async(discard_sharded_import(task_id))
+    redis_client.delete(shards_key(task_id))
+    publish_failed(task_id, "An import shard failed")
+    mark_failed(task_id, "An import shard failed")
+    release_import(task_id)
+    if release_indexes(task_id):
+        run_async(create_secondary_indexes())
+
+@celery_app.task
+def purge_products(task_id: str):
+    # Delete all, reported on the same progress channel as imports
+    publisher = ProgressPublisher(task_id)
+    try:
+        if run_async(try_truncate_products(settings.PURGE_LOCK_TIMEOUT_MS)):
+            deleted, method = None, "truncate"
+        else:
+            deleted, method = purge_in_batches(publisher), "batches"
+    except Exception as e:
+        publish_failed(task_id, str(e) or e.__class__.__name__)
+        raise
+
+    invalidate_all_products()
+    if method == "truncate":
+        reset_counts()
+    else:
+        # Rows may have been written while the batches ran
+        refresh_product_counts.delay()
+    publisher.complete(deleted or 0, method=method)
+    trigger_webhooks.delay("product.deleted_all", {})
+    return {"status": "Completed", "method": method, "deleted": deleted}
+
+def purge_in_batches(publisher):
+    # TRUNCATE couldn't get its lock: delete in keyset batches instead, each
+    # its own short transaction, so readers and writers are never blocked long
+    total = run_async(estimate_product_count())
+    deleted = 0
+    last_sku = None
+    while True:
+        count, last_sku = run_async(delete_products_batch(last_sku, settings.PURGE_BATCH_SIZE))
+        if not count:
+            return deleted
+        deleted += count
+        progress = min(int(deleted * 100 / total), 99) if total else 99
+        publisher.update(progress, deleted, stage="deleting")
+
+@celery_app.task
+def refresh_product_counts():
+    # Rebuilds the exact active/inactive counts behind the dashboard stats
+    try:
+        active, inactive = run_async(recount_products())
+    finally:
+        recount_done()
+    return {"active": active, "inactive": inactive}
 
 @celery_app.task
 def trigger_webhooks(event_type: str, payload: dict):
-    import requests
-    from app.database import AsyncSessionLocal
-    from app.models import Webhook
-    from sqlalchemy.future import select
-    
-    # Helper for async DB access in sync task
-    loop = asyncio.get_event_loop()
-    if loop.is_closed():
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-
-    async def get_active_webhooks():
-        async with AsyncSessionLocal() as session:
-            result = await session.execute(select(Webhook).filter(Webhook.event_type == event_type, Webhook.is_active == True))
-            return result.scalars().all()
-
-    webhooks = loop.run_until_complete(get_active_webhooks())
-    
+    return run_async(dispatch_event(event_type, payload))
+
+@celery_app.task
+def flush_webhook_outbox():
+    # Drain everything buffered so far, one batch per webhook per chunk of events
     results = []
-    for webhook in webhooks:
-        try:
-            response = requests.post(webhook.url, json=payload, timeout=5)
-            results.append({"url": webhook.url, "status": response.status_code})
-        except Exception as e:
-            results.append({"url": webhook.url, "error": str(e)})
-            
-    return results
+    while True:
+        events = pop_events(settings.WEBHOOK_BATCH_MAX_EVENTS)
+        if not events:
+            return results
+        results.extend(run_async(dispatch_events(events)))
@@ -0,0 +1,243 @@
+import csv
+import hashlib
+import importlib.util
+import json
+import os
+import zlib
+
+import redis
+from starlette.concurrency import run_in_threadpool
+
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:  # python-multipart < 0.0.13
+    from multipart.multipart import MultipartParser, parse_options_header
+
+from app.cache import PRODUCT_VERSION_KEY, async_redis_client
+from app.config import settings
+from app.readers import REQUIRED_COLUMNS, detect_compression, header_columns, upload_format, zstd_module
+
+# Give up looking for the end of the header line after this many bytes
+MAX_HEADER_BYTES = 64 * 1024
+PARQUET_MAGIC = b"PAR1"
+
+redis_client = redis.Redis.from_url(settings.CELERY_BROKER_URL)
+
+
+class UploadRejected(Exception):
+    pass
+
+
+class HeaderSniffer:
+    """Validates the CSV header from the first bytes of an upload, decompressing if needed.
+
+    NDJSON uploads have their first record checked instead, Parquet uploads
+    only their magic bytes (the schema is in the footer).
+    """
+
+    def __init__(self, fmt="csv"):
+        self.format = fmt
+        self.compression = None
+        self.columns = None
+        self._prefix = b""
+        self._decompressor = None
+        self._text = b""
+
+    def feed(self, data):
+        if self.columns is not None:
+            return
+        if self._decompressor is None and self.compression is None:
+            # The magic bytes may arrive split over several chunks
+            self._prefix += data
+            if len(self._prefix) < 4:
+                return
+            data, self._prefix = self._prefix, b""
+            self.compression = detect_compression(data) or "none"
+            if self.format != "csv" and importlib.util.find_spec("pyarrow") is None:
+                raise UploadRejected("Parquet and NDJSON uploads need the pyarrow package")
+            if self.format == "parquet":
+                if not data.startswith(PARQUET_MAGIC):
+                    raise UploadRejected("Upload is not a Parquet file")
+                self.columns = {}
+                return
+            if self.compression == "gzip":
+                self._decompressor = zlib.decompressobj(wbits=zlib.MAX_WBITS | 16)
+            elif self.compression == "zstd":
+                try:
+                    self._decompressor = zstd_module().ZstdDecompressor().decompressobj()
+                except ValueError as e:
+                    raise UploadRejected(str(e))
+
+        if self._decompressor is not None:
+            try:
+                data = self._decompressor.decompress(data)
+            except Exception:
+                raise UploadRejected(f"Upload is not valid {self.compression} data")
+        self._text += data
+
+        newline = self._text.find(b"\n")
+        if newline >= 0:
+            self._validate(self._text[:newline])
+        elif len(self._text) > MAX_HEADER_BYTES:
+            raise UploadRejected("Could not find the CSV header line")
+
+    def finish(self):
+        if self.columns is None and self.format == "parquet":
+            raise UploadRejected("Upload is not a Parquet file")
+        if self.columns is None:
+            if self._prefix:
+                self.compression = "none"
+                self._text += self._prefix
+            if not self._text:
+                raise UploadRejected("Uploaded file is empty")
+            self._validate(self._text)
+
+    def _validate(self, line):
+        if self.format == "ndjson":
+            return self._validate_record(line)
+        try:
+            header = next(csv.reader([line.decode("utf-8").rstrip("\r")]))
+            self.columns = header_columns(header)
+        except (UnicodeDecodeError, StopIteration):
+            raise UploadRejected("CSV header is not valid UTF-8 text")
+        except ValueError as e:
+            raise UploadRejected(str(e))
+
+    def _validate_record(self, line):
+        try:
+            record = json.loads(line)
+        except ValueError:
+            record = None
+        if not isinstance(record, dict):
+            raise UploadRejected("The first NDJSON line is not a JSON object")
+        self.columns = {name.strip().lower(): i for i, name in enumerate(record)}
+        missing = [name for name in REQUIRED_COLUMNS if name not in self.columns]
+        if missing:
+            raise UploadRejected(f"NDJSON records are missing required fields: {', '.join(missing)}")
+
+
+class SpooledUpload:
+    def __init__(self, path):
+        self.path = path
+        self.filename = None
+        self.size = 0
+        self.sha256 = hashlib.sha256()
+        self.sniffer = HeaderSniffer()
+
+    @property
+    def content_hash(self):
+        return self.sha256.hexdigest()
+
+    @property
+    def compression(self):
+        return self.sniffer.compression
+
+    @property
+    def format(self):
+        return self.sniffer.format
+
+
+async def spool_multipart_upload(request, file_path, allowed_suffixes, field_name="file"):
+    """Stream the `field_name` part of a multipart request body to file_path.
+
+    The body is parsed as it arrives instead of being buffered by Starlette
+    first; disk writes go through the threadpool so the event loop never blocks.
+    The CSV header is validated from the first bytes, so a bad file is rejected
+    before the rest of it is transferred.
+    """
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in params:
+        raise UploadRejected("Expected a multipart/form-data upload")
+
+    upload = SpooledUpload(file_path)
+    part = {"headers": {}, "field": b"", "value": b""}
+    pending = []
+
+    def on_part_begin():
+        part["headers"] = {}
+
+    def on_header_field(data, start, end):
+        part["field"] += data[start:end]
+
+    def on_header_value(data, start, end):
+        part["value"] += data[start:end]
+
+    def on_header_end():
+        part["headers"][part["field"].lower()] = part["value"]
+        part["field"] = part["value"] = b""
+
+    def on_headers_finished():
+        _, disposition = parse_options_header(part["headers"].get(b"content-disposition", b""))
+        part["is_file"] = disposition.get(b"name") == field_name.encode()
+        if part["is_file"]:
+            upload.filename = disposition.get(b"filename", b"").decode()
+            upload.sniffer.format = upload_format(upload.filename)
+
+    def on_part_data(data, start, end):
+        if part.get("is_file"):
+            pending.append(data[start:end])
+
+    parser = MultipartParser(params[b"boundary"], {
+        "on_part_begin": on_part_begin,
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished,
+        "on_part_data": on_part_data,
+    })
+
+    f = await run_in_threadpool(open, file_path, "wb")
+    try:
+        async for chunk in request.stream():
+            parser.write(chunk)
+            if not pending:
+                continue
+            if upload.filename is not None and not upload.filename.lower().endswith(allowed_suffixes):
+                raise UploadRejected("Invalid file format. Please upload a CSV, NDJSON or Parquet file.")
+
+            data = b"".join(pending)
+            pending.clear()
+            upload.sniffer.feed(data)
+            upload.sha256.update(data)
+            upload.size += len(data)
+            await run_in_threadpool(f.write, data)
+
+        parser.finalize()
+        if upload.filename is None:
+            raise UploadRejected(f"No '{field_name}' file in the upload")
+        upload.sniffer.finish()
+    except BaseException:
+        await run_in_threadpool(f.close)
+        await run_in_threadpool(os.remove, file_path)
+        raise
+    await run_in_threadpool(f.close)
+    return upload
+
+
+# Bumped by every write to single products (the API, bulk endpoints and the
+# UI); imports and delete-all bump the product cache version instead
+CATALOGUE_VERSION_KEY = "catalogue:version"
+
+
+async def catalogue_changed():
+    await async_redis_client.incr(CATALOGUE_VERSION_KEY)
+
+
+def _duplicate_key(content_hash):
+    # Scoped to both versions: any product write after the original upload
+    # makes re-importing the same file meaningful again.
+    version, edits = (int(value or 0) for value in redis_client.mget(PRODUCT_VERSION_KEY, CATALOGUE_VERSION_KEY))
+    return f"upload:sha256:{version}.{edits}:{content_hash}"
+
+
+def find_imported_upload(content_hash):
+    value = redis_client.get(_duplicate_key(content_hash))
+    return json.loads(value) if value else None
+
+
+def remember_imported_upload(content_hash, task_id, size):
+    redis_client.set(
+        _duplicate_key(content_hash),
+        json.dumps({"task_id": task_id, "size": size}),
+        ex=settings.UPLOAD_DEDUP_TTL,
+    )
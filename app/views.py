@@ -1,9 +1,19 @@
 from fastapi import APIRouter, Request, Depends
+from typing import Literal
+from urllib.parse import urlencode
 from fastapi.templating import Jinja2Templates
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from app.database import get_db
+from app.database import get_db, get_read_db
 from app.models import Product, Webhook
+from app.queries import decode_cursor, fetch_page, filter_products
+from app.cache import invalidate_product, invalidate_webhooks, product_cache
+from app.schemas import ProductResponse
+from app.stats import count_change, count_products, product_counts
+from app.uploads import catalogue_changed
+from fastapi.responses import HTMLResponse
+import json
+import math
 
 router = APIRouter()
 templates = Jinja2Templates(directory="app/templates")
@@ -19,36 +29,57 @@ async def products_ui(
     limit: int = 20, 
     search: str = None, 
     is_active: str = None,
-    db: AsyncSession = Depends(get_db)
+    after: str = None,
+    before: str = None,
+    db: AsyncSession = Depends(get_read_db)
 ):
-    offset = (page - 1) * limit
-    query = select(Product)
-    
-    if search:
-        search_filter = f"%{search}%"
-        query = query.filter(
-            (Product.sku.ilike(search_filter)) | 
-            (Product.name.ilike(search_filter)) |
-            (Product.description.ilike(search_filter))
-        )
-    
+    active_bool = None
     if is_active and is_active != "all":
         active_bool = is_active.lower() == "true"
-        query = query.filter(Product.is_active == active_bool)
-        
-    # Get total count for pagination (optional but good for UX, skipping for now to keep it simple)
-    
-    result = await db.execute(query.offset(offset).limit(limit))
-    products = result.scalars().all()
-    
+    query = filter_products(select(Product), search, active_bool, search_description=True)
+
+    try:
+        page_result = await fetch_page(
+            db,
+            query,
+            limit,
+            after=decode_cursor(after) if after else None,
+            before=decode_cursor(before) if before else None,
+        )
+    except ValueError:
+        # Stale or hand-edited cursor, start over from the first page
+        page = 1
+        page_result = await fetch_page(db, query, limit)
+
+    # Totals never count the table: Redis counts or the planner estimate when
+    # unfiltered, a capped count cached for a few seconds when searching
+    stats = await product_counts(db)
+    total, capped = await count_products(db, search, active_bool, search_description=True, counts=stats)
+    total_pages = max(math.ceil(total / limit), 1) if total is not None else None
+
+    def page_url(target_page, **cursor):
+        params = {"page": target_page, "limit": limit, **cursor}
+        if search:
+            params["search"] = search
+        if is_active:
+            params["is_active"] = is_active
+        return f"/products-ui?{urlencode(params)}"
+
     return templates.TemplateResponse(
         "products.html", 
         {
             "request": request, 
-            "products": products, 
+            "products": page_result.items, 
             "page": page, 
+            "total": total,
+            "total_pages": total_pages,
+            "capped": capped,
+            "estimate": stats["estimate"] and not search,
+            "stats": stats,
             "search": search, 
-            "is_active": is_active
+            "is_active": is_active,
+            "next_url": page_url(page + 1, after=page_result.next_cursor) if page_result.next_cursor else None,
+            "prev_url": page_url(max(page - 1, 1), before=page_result.prev_cursor) if page_result.prev_cursor else None,
         }
     )
 
@@ -58,16 +89,34 @@ async def webhooks_ui(request: Request, db: AsyncSession = Depends(get_db)):
     webhooks = result.scalars().all()
     return templates.TemplateResponse("webhooks.html", {"request": request, "webhooks": webhooks})
 
+async def load_product(db, sku):
+    result = await db.execute(select(Product).filter(Product.sku == sku))
+    return result.scalars().first()
+
 @router.get("/products-ui/row/{sku}")
 async def get_product_row(request: Request, sku: str, db: AsyncSession = Depends(get_db)):
-    result = await db.execute(select(Product).filter(Product.sku == sku))
-    product = result.scalars().first()
-    return templates.TemplateResponse("partials/product_row.html", {"request": request, "product": product})
+    async def render_row():
+        product = await load_product(db, sku)
+        if not product:
+            return None
+        return templates.get_template("partials/product_row.html").render(request=request, product=product)
+
+    html = await product_cache.get_or_load("row", sku, render_row)
+    if html is None:
+        return templates.TemplateResponse("partials/product_row.html", {"request": request, "product": None})
+    return HTMLResponse(html)
 
 @router.get("/products-ui/row/{sku}/edit")
 async def get_product_edit_row(request: Request, sku: str, db: AsyncSession = Depends(get_db)):
-    result = await db.execute(select(Product).filter(Product.sku == sku))
-    product = result.scalars().first()
+    # The edit form only needs the product fields, so it renders from the cached JSON
+    async def load_json():
+        product = await load_product(db, sku)
+        if not product:
+            return None
+        return ProductResponse.model_validate(product).model_dump_json()
+
+    body = await product_cache.get_or_load("json", sku, load_json)
+    product = json.loads(body) if body is not None else None
     return templates.TemplateResponse("partials/product_edit_row.html", {"request": request, "product": product})
 
 from app.schemas import ProductUpdate
@@ -86,15 +135,19 @@ async def update_product_row(
     product = result.scalars().first()
     
     if product:
+        was_active = product.is_active
         product.name = name
         product.description = description
         product.is_active = is_active.lower() == 'true'
         await db.commit()
         await db.refresh(product)
+        await invalidate_product(sku)
+        await catalogue_changed()
+        await count_change(was_active, product.is_active)
         
         # Trigger webhook
-        from app.tasks import trigger_webhooks
-        trigger_webhooks.delay("product.updated", {"sku": sku})
+        from app.outbox import emit_event
+        await emit_event("product.updated", {"sku": sku})
         
     return templates.TemplateResponse("partials/product_row.html", {"request": request, "product": product})
 
@@ -117,6 +170,7 @@ async def update_webhook_row(
     url: str = Form(...), 
     event_type: str = Form(...), 
     is_active: str = Form(...),
+    delivery_mode: Literal["event", "batch"] = Form("event"),
     db: AsyncSession = Depends(get_db)
 ):
     result = await db.execute(select(Webhook).filter(Webhook.id == webhook_id))
@@ -126,7 +180,9 @@ async def update_webhook_row(
         webhook.url = url
         webhook.event_type = event_type
         webhook.is_active = is_active.lower() == 'true'
+        webhook.delivery_mode = delivery_mode
         await db.commit()
         await db.refresh(webhook)
+        await invalidate_webhooks()
         
     return templates.TemplateResponse("partials/webhook_row.html", {"request": request, "webhook": webhook})
@@ -0,0 +1,161 @@
+import asyncio
+import random
+import time
+from urllib.parse import urlsplit
+
+import httpx
+from sqlalchemy import insert
+from sqlalchemy.future import select
+
+from app.cache import subscription_cache
+from app.config import settings
+from app.database import AsyncSessionLocal
+from app.metrics import StageTimings, webhook_batch_events, webhook_deliveries, webhook_delivery_seconds, webhook_stage_seconds
+from app.models import Webhook, WebhookDelivery
+from app.outbox import make_event
+
+# Status codes worth another attempt; any other 4xx is the receiver rejecting the payload
+RETRY_STATUS_CODES = {408, 425, 429, 500, 502, 503, 504}
+
+# Both are bound to the event loop that created them: the app's loop in the web
+# process and the per-process loop in Celery workers.
+_client = None
+_host_limits = {}
+
+
+def get_client():
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            timeout=settings.WEBHOOK_TIMEOUT,
+            limits=httpx.Limits(
+                max_connections=settings.WEBHOOK_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.WEBHOOK_MAX_CONNECTIONS,
+            ),
+        )
+    return _client
+
+
+async def close_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+    _host_limits.clear()
+
+
+def _host_limit(url):
+    host = urlsplit(url).netloc
+    if host not in _host_limits:
+        _host_limits[host] = asyncio.Semaphore(settings.WEBHOOK_PER_HOST_CONCURRENCY)
+    return _host_limits[host]
+
+
+def backoff_delay(attempt):
+    # Exponential backoff with full jitter
+    cap = min(settings.WEBHOOK_BACKOFF_MAX, settings.WEBHOOK_BACKOFF_BASE * 2 ** attempt)
+    return random.uniform(0, cap)
+
+
+async def deliver(url, payload, event_type, webhook_id=None, max_retries=None):
+    if max_retries is None:
+        max_retries = settings.WEBHOOK_MAX_RETRIES
+
+    client = get_client()
+    result = {"webhook_id": webhook_id, "url": url, "event_type": event_type}
+    attempt = 0
+    while True:
+        attempt += 1
+        status_code = None
+        error = None
+        started = time.perf_counter()
+        async with _host_limit(url):
+            try:
+                response = await client.post(url, json=payload)
+                status_code = response.status_code
+            except httpx.HTTPError as e:
+                error = str(e) or e.__class__.__name__
+        latency_ms = int((time.perf_counter() - started) * 1000)
+
+        success = status_code is not None and 200 <= status_code < 300
+        retryable = error is not None or status_code in RETRY_STATUS_CODES
+        if success or not retryable or attempt > max_retries:
+            webhook_deliveries.labels("success" if success else "failure").inc()
+            webhook_delivery_seconds.observe(latency_ms / 1000)
+            result.update(
+                status_code=status_code,
+                success=success,
+                attempts=attempt,
+                latency_ms=latency_ms,
+                error=error,
+            )
+            return result
+
+        # Sleep outside the host semaphore so other deliveries can use the slot
+        await asyncio.sleep(backoff_delay(attempt - 1))
+
+
+async def record_deliveries(results):
+    if not results:
+        return
+    async with AsyncSessionLocal() as session:
+        # The subscription cache may still list a webhook deleted since. Its
+        # deliveries are kept without the reference, as ON DELETE SET NULL
+        # does for older ones; FOR KEY SHARE holds off deletes until commit.
+        ids = {result["webhook_id"] for result in results if result.get("webhook_id") is not None}
+        if ids:
+            existing = set((await session.execute(
+                select(Webhook.id).filter(Webhook.id.in_(ids)).with_for_update(key_share=True)
+            )).scalars())
+            results = [
+                result if result.get("webhook_id") in existing else {**result, "webhook_id": None}
+                for result in results
+            ]
+        await session.execute(insert(WebhookDelivery), results)
+        await session.commit()
+
+
+async def get_active_webhooks(event_types):
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(select(Webhook).filter(Webhook.event_type.in_(event_types), Webhook.is_active == True))
+        return result.scalars().all()
+
+
+async def _deliver_batch(webhook, events):
+    payload = {"event_type": webhook.event_type, "events": [event["payload"] for event in events]}
+    return [await deliver(webhook.url, payload, webhook.event_type, webhook_id=webhook.id)]
+
+
+async def _deliver_each(webhook, events):
+    # One request per event, sent in order so receivers see events as they happened
+    return [
+        await deliver(webhook.url, event["payload"], webhook.event_type, webhook_id=webhook.id)
+        for event in events
+    ]
+
+
+async def dispatch_events(events):
+    by_type = {}
+    for event in events:
+        by_type.setdefault(event["event_type"], []).append(event)
+    if not by_type:
+        return []
+
+    webhook_batch_events.observe(len(events))
+    timings = StageTimings(webhook_stage_seconds)
+    with timings.stage("lookup"):
+        webhooks = await subscription_cache.get(list(by_type), get_active_webhooks)
+    with timings.stage("deliver"):
+        # All endpoints are sent to at once; a slow receiver only holds up its own host
+        deliveries = await asyncio.gather(*(
+            (_deliver_batch if webhook.delivery_mode == "batch" else _deliver_each)(webhook, by_type[webhook.event_type])
+            for webhook in webhooks
+        ))
+    results = [result for delivery in deliveries for result in delivery]
+    with timings.stage("record"):
+        await record_deliveries(results)
+    return results
+
+
+async def dispatch_event(event_type, payload):
+    return await dispatch_events([make_event(event_type, payload)])
@@ -0,0 +1,133 @@
+"""Load-test the product list, product detail and progress endpoints.
+
+By default the app is served in this process through httpx's ASGI transport,
+against the database and Redis from bench/harness.py, so no web server is
+needed and peak RSS covers the app; client and app then share one event loop.
+With --base-url the requests go to a running server instead (RSS is then
+only the client's).
+
+    python -m bench.api_load --seed 500000 --concurrency 1 16 --output api.json
+"""
+import argparse
+import asyncio
+import random
+import time
+import uuid
+
+import httpx
+
+from bench.harness import (
+    RssSampler,
+    latency_stats,
+    prepare_database,
+    seed_catalogue,
+    use_eager_celery,
+    write_results,
+)
+from bench.generator import WORDS
+from app.progress import ProgressPublisher
+from app.queries import encode_cursor
+from app.tasks import run_async
+
+
+def scenarios(rows, rng):
+    # Each scenario builds the (path, params) of its next request. SKUs are the
+    # generator's, so they exist whenever the catalogue was seeded with --seed.
+    def random_sku():
+        return f"SKU-{rng.randrange(rows):09d}".lower()
+
+    # A finished import: the stream sends its snapshot and ends
+    progress_task = str(uuid.uuid4())
+    ProgressPublisher(progress_task).complete(rows)
+
+    return {
+        "list_first_page": lambda: ("/api/products", {"limit": 20}),
+        "list_cursor": lambda: ("/api/products", {"limit": 20, "cursor": encode_cursor(random_sku())}),
+        "list_search": lambda: ("/api/products", {"limit": 20, "search": rng.choice(WORDS)}),
+        "get_product": lambda: (f"/api/products/{random_sku()}", {}),
+        "progress": lambda: (f"/api/progress/{progress_task}", {}),
+    }
+
+
+async def run_scenario(client, make_request, requests_count, concurrency):
+    timings = []
+    errors = 0
+    remaining = requests_count
+
+    async def worker():
+        nonlocal remaining, errors
+        while remaining > 0:
+            remaining -= 1
+            path, params = make_request()
+            started = time.perf_counter()
+            response = await client.get(path, params=params)
+            timings.append((time.perf_counter() - started) * 1000)
+            if response.status_code >= 400:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return {
+        "requests": len(timings),
+        "errors": errors,
+        "seconds": round(elapsed, 3),
+        "requests_per_sec": round(len(timings) / elapsed, 1),
+        **latency_stats(timings),
+    }
+
+
+async def load_test(base_url, rows, seed, names, requests_count, concurrencies):
+    if base_url:
+        client = httpx.AsyncClient(base_url=base_url, timeout=30)
+    else:
+        from app.main import app
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench", timeout=30)
+
+    rng = random.Random(seed)
+    all_scenarios = scenarios(rows, rng)
+    results = []
+    async with client:
+        for name in names:
+            for concurrency in concurrencies:
+                with RssSampler() as rss:
+                    result = await run_scenario(client, all_scenarios[name], requests_count, concurrency)
+                result = {"scenario": name, "concurrency": concurrency, **result, "peak_rss_mb": round(rss.peak_mb, 1)}
+                results.append(result)
+                print(
+                    f"{name:<16} c={concurrency:<4} {result['requests_per_sec']:>8} req/s  "
+                    f"p50={result['p50_ms']:>8}ms p99={result['p99_ms']:>8}ms  errors={result['errors']}"
+                )
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--base-url", help="Load-test a running server instead of the app in this process")
+    parser.add_argument("--seed", type=int, metavar="ROWS", help="Replace the catalogue with this many generated rows first")
+    parser.add_argument("--rows", type=int, help="Rows of an already seeded catalogue (defaults to --seed)")
+    parser.add_argument("--scenarios", nargs="+", default=["list_first_page", "list_cursor", "list_search", "get_product", "progress"])
+    parser.add_argument("--requests", type=int, default=1000, help="Requests per scenario and concurrency")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 16])
+    parser.add_argument("--random-seed", type=int, default=42)
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    rows = args.rows or args.seed
+    if not rows:
+        parser.error("pass --seed to generate a catalogue, or --rows for the size of the seeded one")
+
+    use_eager_celery()
+    prepare_database()
+    if args.seed:
+        seed_catalogue(args.seed, args.random_seed)
+
+    # On the worker loop, which owns the engine's pooled connections
+    results = run_async(load_test(args.base_url, rows, args.random_seed, args.scenarios, args.requests, args.concurrency))
+
+    if args.output:
+        write_results(args.output, "api_load", results, **vars(args))
+
+
+if __name__ == "__main__":
+    main()
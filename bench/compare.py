@@ -0,0 +1,68 @@
+"""Compare two benchmark result files written with --output, e.g. from two commits.
+
+Results are matched on their parameters (rows, mode, scenario, ...) and every
+metric is printed with its change from the baseline.
+
+    python -m bench.compare results/main.json results/branch.json
+"""
+import argparse
+import json
+
+# Higher is better for these; for every other metric lower is better
+THROUGHPUT_METRICS = {"rows_per_sec", "requests_per_sec", "mb_per_sec"}
+METRICS = THROUGHPUT_METRICS | {"seconds", "import_seconds", "p50_ms", "p99_ms", "max_ms", "peak_rss_mb", "rss_peak_mb"}
+
+
+# What a result measured, across all benchmarks: every parameter a benchmark varies
+KEY_FIELDS = (
+    "rows", "mode", "csv_reader", "defer_indexes", "phase",
+    "scenario", "concurrency", "format", "gzip", "paging", "page", "search",
+)
+
+
+def result_key(result):
+    return tuple((field, result[field]) for field in KEY_FIELDS if field in result)
+
+
+def results_by_key(results):
+    by_key = {}
+    for result in results:
+        key = result_key(result)
+        if key in by_key:
+            raise SystemExit(f"Two results measured {dict(key)}; add the parameter that tells them apart to KEY_FIELDS")
+        by_key[key] = result
+    return by_key
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    args = parser.parse_args()
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+    print(f"{baseline['benchmark']}: {baseline.get('commit')} -> {candidate.get('commit')}")
+
+    baseline_results = results_by_key(baseline["results"])
+    for key, result in results_by_key(candidate["results"]).items():
+        before = baseline_results.get(key)
+        label = " ".join(f"{name}={value}" for name, value in key)
+        if before is None:
+            print(f"{label}: no baseline")
+            continue
+        changes = []
+        for metric in sorted(METRICS & result.keys() & before.keys()):
+            old, new = before[metric], result[metric]
+            if not old or new is None:
+                continue
+            change = (new - old) * 100 / old
+            better = change > 0 if metric in THROUGHPUT_METRICS else change < 0
+            changes.append(f"{metric} {old} -> {new} ({change:+.1f}%{'' if abs(change) < 1 else ' better' if better else ' worse'})")
+        print(f"{label}: " + ", ".join(changes))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""Measure export throughput and peak RSS while streaming the whole catalogue.
+
+Runs app.export.export_products in-process against the database configured in
+bench/harness.py and discards the output, sampling this process's RSS as it
+goes. Memory should stay flat however many rows are exported. Use --seed to
+load a generated catalogue of that many rows first (replaces the products table).
+
+    python -m bench.export --seed 5000000 --formats csv ndjson --gzip
+"""
+import argparse
+import time
+
+from bench.harness import prepare_database, rss_mb, seed_catalogue, use_eager_celery, write_results
+from app.export import EXPORT_FORMATS, export_products
+from app.tasks import run_async
+
+
+async def timed_export(fmt, gzip, sample_every):
+    exported_bytes = 0
+    samples = [rss_mb()]
+    next_sample = sample_every
+    started = time.perf_counter()
+    async for chunk in export_products(fmt, gzip=gzip):
+        exported_bytes += len(chunk)
+        if exported_bytes >= next_sample:
+            samples.append(rss_mb())
+            next_sample += sample_every
+    elapsed = time.perf_counter() - started
+    samples.append(rss_mb())
+    return {
+        "format": fmt,
+        "gzip": gzip,
+        "bytes": exported_bytes,
+        "seconds": round(elapsed, 3),
+        "mb_per_sec": round(exported_bytes / 1024 / 1024 / elapsed, 1),
+        "rss_start_mb": round(samples[0], 1),
+        "rss_peak_mb": round(max(samples), 1),
+        "rss_end_mb": round(samples[-1], 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--seed", type=int, help="Replace the catalogue with this many generated rows first")
+    parser.add_argument("--formats", nargs="+", choices=list(EXPORT_FORMATS), default=list(EXPORT_FORMATS))
+    parser.add_argument("--gzip", action="store_true", help="Also measure gzip-compressed exports")
+    parser.add_argument("--sample-mb", type=int, default=16, help="Sample RSS every this many output MB")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    use_eager_celery()
+    prepare_database()
+    if args.seed:
+        seed_catalogue(args.seed)
+
+    results = []
+    for fmt in args.formats:
+        for gzip in ([False, True] if args.gzip else [False]):
+            result = run_async(timed_export(fmt, gzip, args.sample_mb * 1024 * 1024))
+            results.append(result)
+            print(
+                f"{fmt:<7} gzip={str(gzip):<5} {result['seconds']:8.2f}s  {result['mb_per_sec']:>7} MB/s  "
+                f"RSS {result['rss_start_mb']} -> peak {result['rss_peak_mb']} MB"
+            )
+
+    if args.output:
+        write_results(args.output, "export", results, **vars(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""Write a deterministic synthetic product catalogue as CSV.
+
+The same arguments always produce the same file. --revision changes every
+product's name without changing the SKUs, so importing revision 1 over
+revision 0 updates every row, and importing the same revision again leaves
+every row unchanged.
+
+    python -m bench.generator catalogue.csv --rows 1000000 --duplicates 0.05 --invalid 0.001
+"""
+import argparse
+import csv
+import json
+import random
+
+from app.readers import MAX_NAME_LENGTH, MAX_SKU_LENGTH
+
+WORDS = [
+    "alpha", "bravo", "charlie", "delta", "echo", "foxtrot", "golf", "hotel",
+    "india", "juliett", "kilo", "lima", "mike", "november", "oscar", "papa",
+]
+
+# Each one is rejected by the reader, see app.readers.CsvRecordReader
+INVALID_KINDS = ("missing_sku", "long_sku", "long_name", "nul")
+
+
+def words_text(rng, min_words, max_words):
+    return " ".join(rng.choices(WORDS, k=rng.randint(min_words, max_words)))
+
+
+def generate_catalogue(path, rows, seed=42, duplicate_ratio=0.0, invalid_ratio=0.0,
+                       name_words=(2, 6), description_words=(3, 20), revision=0):
+    """Write `rows` data rows to `path` and return what went into them.
+
+    duplicate_ratio is the share of rows that repeat an earlier SKU (the last
+    one wins on import), invalid_ratio the share of rows the importer rejects.
+    """
+    rng = random.Random(seed)
+    stats = {"rows": rows, "unique_skus": 0, "duplicates": 0, "invalid": 0}
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["sku", "name", "description", "is_active"])
+        for _ in range(rows):
+            name = words_text(rng, *name_words).title()
+            if revision:
+                name = f"{name} r{revision}"
+            description = words_text(rng, *description_words)
+            is_active = rng.choice(["true", "false"])
+
+            if invalid_ratio and rng.random() < invalid_ratio:
+                stats["invalid"] += 1
+                kind = rng.choice(INVALID_KINDS)
+                sku = f"SKU-BAD-{stats['invalid']:09d}"
+                if kind == "missing_sku":
+                    sku = ""
+                elif kind == "long_sku":
+                    sku = sku.ljust(MAX_SKU_LENGTH + 1, "X")
+                elif kind == "long_name":
+                    name = name.ljust(MAX_NAME_LENGTH + 1, "x")
+                else:
+                    description += "\x00"
+            elif stats["unique_skus"] and rng.random() < duplicate_ratio:
+                stats["duplicates"] += 1
+                sku = f"SKU-{rng.randrange(stats['unique_skus']):09d}"
+            else:
+                sku = f"SKU-{stats['unique_skus']:09d}"
+                stats["unique_skus"] += 1
+
+            writer.writerow([sku, name, description, is_active])
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("path")
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--duplicates", type=float, default=0.0, help="Share of rows repeating an earlier SKU")
+    parser.add_argument("--invalid", type=float, default=0.0, help="Share of rows the importer rejects")
+    parser.add_argument("--name-words", type=int, nargs=2, default=[2, 6], metavar=("MIN", "MAX"))
+    parser.add_argument("--description-words", type=int, nargs=2, default=[3, 20], metavar=("MIN", "MAX"))
+    parser.add_argument("--revision", type=int, default=0)
+    args = parser.parse_args()
+
+    stats = generate_catalogue(
+        args.path, args.rows, seed=args.seed, duplicate_ratio=args.duplicates, invalid_ratio=args.invalid,
+        name_words=tuple(args.name_words), description_words=tuple(args.description_words), revision=args.revision,
+    )
+    print(json.dumps(stats))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""Compare import throughput (rows/sec) of the "insert" and "copy" load modes.
+
+Runs process_csv_upload eagerly in this process against the database and Redis
+from bench/harness.py, so parsing, writing and progress reporting are all
+included. Every mode imports a generated catalogue three times: into an empty
+table, as a new revision that changes every row, and the same revision again
+(every row unchanged). With --defer-indexes on off, each mode also runs once
+with the secondary product indexes dropped during the load and rebuilt after
+it (the rebuild is included in the timings) and once maintaining them.
+
+    python -m bench.import_modes --rows 100000 1000000 5000000 --output import.json
+"""
+import argparse
+import itertools
+import os
+import shutil
+import tempfile
+import time
+import uuid
+
+from bench.harness import (
+    RssSampler,
+    prepare_database,
+    truncate_products,
+    use_eager_celery,
+    write_results,
+)
+from bench.generator import generate_catalogue
+from app.config import settings
+from app.importer import LOAD_MODES
+from app.tasks import process_csv_upload
+
+# Phase name -> catalogue revision imported in it
+PHASES = (("insert", 0), ("update", 1), ("unchanged", 1))
+
+
+def timed_import(source, workdir, load_mode):
+    # The task deletes its input file, so every run gets a fresh copy.
+    task_id = str(uuid.uuid4())
+    file_path = os.path.join(workdir, f"{task_id}.csv")
+    shutil.copyfile(source, file_path)
+    with RssSampler() as rss:
+        started = time.perf_counter()
+        # Single task: an eager chord doesn't hand its callback's result back
+        result = process_csv_upload.apply(
+            args=[file_path, task_id], kwargs={"load_mode": load_mode, "shards": 1},
+        ).get()
+        elapsed = time.perf_counter() - started
+    return result, elapsed, rss.peak_mb
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=[100_000, 1_000_000, 5_000_000])
+    parser.add_argument("--modes", nargs="+", choices=LOAD_MODES, default=list(LOAD_MODES))
+    parser.add_argument("--duplicates", type=float, default=0.0, help="Share of rows repeating an earlier SKU")
+    parser.add_argument("--invalid", type=float, default=0.0, help="Share of rows the importer rejects")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--csv-reader", choices=["python", "arrow"], default="python",
+                        help="arrow parses with pyarrow and ignores the load mode")
+    parser.add_argument("--defer-indexes", nargs="+", choices=["on", "off"], default=["off"],
+                        help="on drops the secondary indexes for every import, off never does")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    settings.IMPORT_CSV_READER = args.csv_reader
+    use_eager_celery()
+    prepare_database()
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for rows in args.rows:
+            sources = {}
+            for revision in sorted({revision for _, revision in PHASES}):
+                sources[revision] = os.path.join(workdir, f"source-{rows}-r{revision}.csv")
+                generate_catalogue(
+                    sources[revision], rows, seed=args.seed, duplicate_ratio=args.duplicates,
+                    invalid_ratio=args.invalid, revision=revision,
+                )
+            for load_mode, defer in itertools.product(args.modes, args.defer_indexes):
+                # Threshold 1: every import is large enough to defer
+                settings.IMPORT_DEFER_INDEXES_MIN_ROWS = 1 if defer == "on" else 0
+                truncate_products()
+                for phase, revision in PHASES:
+                    task_result, elapsed, peak_rss = timed_import(sources[revision], workdir, load_mode)
+                    result = {
+                        "rows": rows,
+                        # The arrow reader ignores the load mode, but keeps it so results stay distinct
+                        "mode": load_mode,
+                        "csv_reader": args.csv_reader,
+                        "defer_indexes": defer,
+                        "phase": phase,
+                        # Wall time includes the tasks the import queues (eager here)
+                        "seconds": round(elapsed, 3),
+                        "import_seconds": task_result["seconds"],
+                        "rows_per_sec": task_result["rows_per_sec"],
+                        "peak_rss_mb": round(peak_rss, 1),
+                        **{key: task_result.get(key) for key in ("inserted", "updated", "unchanged", "rejected", "indexes_deferred", "timings")},
+                    }
+                    results.append(result)
+                    print(
+                        f"{rows:>9} rows  {load_mode:<6} indexes {defer:<3} {phase:<9} {elapsed:8.2f}s  "
+                        f"{result['rows_per_sec']:>9} rows/s  peak RSS {result['peak_rss_mb']} MB"
+                    )
+            for source in sources.values():
+                os.remove(source)
+
+    if args.output:
+        write_results(args.output, "import_modes", results, **vars(args))
+
+
+if __name__ == "__main__":
+    main()
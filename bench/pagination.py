@@ -0,0 +1,82 @@
+"""Measure p50/p99 latency of GET /api/products for offset vs cursor paging.
+
+Needs a running web app (BASE_URL) with a populated catalogue (see
+`python -m bench.api_load --seed`) and the same DATABASE_URL, which is used
+once to look up the cursor for the deep page.
+
+    python -m bench.pagination --base-url http://localhost:8000 --search alpha
+"""
+import argparse
+import asyncio
+import time
+
+import requests
+from sqlalchemy import select
+
+from bench.harness import latency_stats, write_results
+from app.database import engine
+from app.models import Product
+from app.queries import encode_cursor, filter_products
+
+
+async def sku_before_offset(offset, search):
+    # The cursor for page N is the last SKU of page N - 1
+    query = filter_products(select(Product.sku), search).order_by(Product.sku).offset(offset - 1).limit(1)
+    async with engine.connect() as conn:
+        sku = (await conn.execute(query)).scalar()
+    await engine.dispose()
+    return sku
+
+
+def measure(session, url, params, requests_count):
+    timings = []
+    for _ in range(requests_count):
+        started = time.perf_counter()
+        response = session.get(url, params=params)
+        response.raise_for_status()
+        timings.append((time.perf_counter() - started) * 1000)
+    return latency_stats(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--deep-page", type=int, default=10_000)
+    parser.add_argument("--search", default="alpha", help="Search term for the filtered runs")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per scenario")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    url = f"{args.base_url}/api/products"
+    session = requests.Session()
+    results = []
+    for search in (None, args.search):
+        for page in (1, args.deep_page):
+            offset = (page - 1) * args.limit
+            cursor = None
+            if offset:
+                sku = asyncio.run(sku_before_offset(offset, search))
+                if sku is None:
+                    print(f"Not enough rows for page {page} (search={search!r}), skipping")
+                    continue
+                cursor = encode_cursor(sku)
+
+            base_params = {"limit": args.limit}
+            if search:
+                base_params["search"] = search
+            scenarios = {
+                "offset": {**base_params, "skip": offset},
+                "cursor": {**base_params, **({"cursor": cursor} if cursor else {})},
+            }
+            for paging, params in scenarios.items():
+                result = {"paging": paging, "page": page, "search": search, **measure(session, url, params, args.requests)}
+                results.append(result)
+                print(f"{paging:<6} page={page:<6} search={search!s:<8} p50={result['p50_ms']:>8}ms p99={result['p99_ms']:>8}ms")
+
+    if args.output:
+        write_results(args.output, "pagination", results, **vars(args))
+
+
+if __name__ == "__main__":
+    main()
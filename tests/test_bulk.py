@@ -0,0 +1,52 @@
+import asyncio
+from types import SimpleNamespace
+
+from app.bulk import bulk_delete, bulk_upsert, summarize
+
+
+class FakeResult:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def all(self):
+        return self.rows
+
+
+class FakeSession:
+    def __init__(self, rows=()):
+        self.rows = list(rows)
+        self.params = []
+
+    async def execute(self, statement, params):
+        self.params.append(params)
+        return FakeResult(self.rows)
+
+
+def item(sku, name="n", description=None, is_active=True):
+    return SimpleNamespace(sku=sku, name=name, description=description, is_active=is_active)
+
+
+def test_invalid_items_are_reported_and_skipped():
+    db = FakeSession([("a1", True, None, True)])
+    items = [item("a1"), item("x" * 256), item("a\x002"), item("a3", name="n" * 501), item("")]
+    results, changes = asyncio.run(bulk_upsert(db, items))
+
+    assert db.params[0]["skus"] == ["a1"]
+    assert changes == [(None, True)]
+    response = summarize(results)
+    assert response["counts"] == {"created": 1, "invalid": 4}
+    assert {result["sku"][:3]: result["error"] for result in response["results"] if result["error"]} == {
+        "xxx": "sku is longer than 255 characters",
+        "a\x002": "contains a NUL character",
+        "a3": "name is longer than 500 characters",
+        "": "missing sku",
+    }
+
+
+def test_delete_skips_invalid_skus():
+    db = FakeSession([("a1", True)])
+    results, changes = asyncio.run(bulk_delete(db, ["a1", "a\x00", "a1", "a2"]))
+
+    assert db.params[0]["skus"] == ["a1", "a2"]
+    assert results == [("a\x00", "invalid", "contains a NUL character"), ("a1", "deleted", None), ("a2", "not_found", None)]
+    assert changes == [(True, None)]
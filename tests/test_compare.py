@@ -0,0 +1,22 @@
+import pytest
+
+from bench.compare import result_key, results_by_key
+
+
+def test_result_key_uses_only_parameters():
+    result = {"rows": 1000, "mode": "copy", "csv_reader": "arrow", "rows_per_sec": 5000.0, "seconds": 0.2}
+    assert result_key(result) == (("rows", 1000), ("mode", "copy"), ("csv_reader", "arrow"))
+
+
+def test_results_differing_in_any_parameter_are_kept_apart():
+    results = [
+        {"rows": 1000, "mode": "copy", "csv_reader": "python", "defer_indexes": False, "seconds": 1.0},
+        {"rows": 1000, "mode": "copy", "csv_reader": "arrow", "defer_indexes": False, "seconds": 0.5},
+        {"rows": 1000, "mode": "copy", "csv_reader": "python", "defer_indexes": True, "seconds": 0.8},
+    ]
+    assert list(results_by_key(results).values()) == results
+
+
+def test_results_with_the_same_key_are_refused():
+    with pytest.raises(SystemExit, match="Two results measured"):
+        results_by_key([{"rows": 1000, "seconds": 1.0}, {"rows": 1000, "seconds": 2.0}])
@@ -0,0 +1,68 @@
+import asyncio
+import io
+
+from app import importer
+from app.importer import ImportPipeline, partition_for
+from app.metrics import StageTimings
+from app.readers import CsvRecordReader
+
+DATA = b"sku,name,description\na1,n,d\na4,n,d\na5,n,d\na6,n,d\na2,n,d\n"
+
+
+class FakeSession:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class GatedWriter:
+    commits_batches = True
+
+    def __init__(self, gate):
+        self.gate = gate
+        self.inserted = 0
+        self.updated = 0
+        self.timings = StageTimings()
+
+    async def start(self):
+        pass
+
+    async def write(self, records):
+        if records[0][1] == "a1":
+            await self.gate.wait()
+        self.inserted += len(records)
+
+    async def rollback(self):
+        pass
+
+    async def finish(self):
+        pass
+
+
+def test_checkpoint_waits_for_the_slowest_writer(monkeypatch):
+    monkeypatch.setattr(importer, "AsyncSessionLocal", FakeSession)
+    # a1 and a2 share a writer, a4..a6 go to the other one
+    assert {partition_for(sku, 2) for sku in ("a1", "a2")} != {partition_for(sku, 2) for sku in ("a4", "a5", "a6")}
+
+    async def run():
+        gate = asyncio.Event()
+        checkpoints = []
+
+        def on_checkpoint(offset, line, rows, inserted, updated):
+            checkpoints.append((offset, line, rows))
+            if len(checkpoints) == 3:
+                gate.set()
+
+        pipeline = ImportPipeline(lambda session: GatedWriter(gate), 2, 10, 1, on_checkpoint=on_checkpoint)
+        await pipeline.run(CsvRecordReader(io.BytesIO(DATA)))
+        return checkpoints
+
+    checkpoints = asyncio.run(run())
+
+    # While a1 is stuck, the rows committed after it don't move the checkpoint;
+    # once it lands the checkpoint moves to a2, then to the end of the file
+    a1, a2 = DATA.index(b"a1"), DATA.index(b"a2")
+    assert checkpoints == [(a1, 2, 0)] * 3 + [(a2, 6, 4), (len(DATA), 7, 5)]
+
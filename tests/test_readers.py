@@ -0,0 +1,121 @@
+import asyncio
+import io
+from types import SimpleNamespace
+
+import pytest
+
+from app.readers import CsvRecordReader, split_byte_ranges
+
+FIXTURE = (
+    b"sku,name,description,is_active\n"
+    b"A1,n1,d1,true\n"
+    b"A2,n2,d2,FALSE\n"
+    b"X4,n4,d\n"
+    b",n5,d5,true\n"
+    b"A6,n6,d6,true,extra\n"
+    b"A7,n7,d7,\n"
+    # Last, as the Arrow reader reports record rather than line numbers
+    b'A3,"multi\nline",d3,True\n'
+)
+
+
+def read_python(data):
+    rejects = []
+    reader = CsvRecordReader(io.BytesIO(data), on_reject=lambda line, reason, row: rejects.append((line, reason, row)))
+    return [record[1:] for record in reader], rejects
+
+
+class FakeSession:
+    def __init__(self):
+        self.params = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def execute(self, statement, params):
+        self.params.append(params)
+        return SimpleNamespace(one=lambda: (len(params["skus"]), 0))
+
+    async def commit(self):
+        pass
+
+
+def read_arrow(data, monkeypatch):
+    pytest.importorskip("pyarrow")
+    from app import columnar
+
+    session = FakeSession()
+    monkeypatch.setattr(columnar, "AsyncSessionLocal", lambda: session)
+    rejects = []
+    source = columnar.ArrowSource("csv", None, io.BytesIO(data), io.BytesIO(data), len(data), 100,
+                                  on_reject=lambda line, reason, row: rejects.append((line, reason, row)))
+    pipeline = columnar.ColumnarImport(source, on_reject=lambda record, reason: rejects.append((None, reason, None)))
+    asyncio.run(pipeline.run())
+    records = []
+    for params in session.params:
+        records += zip(params["skus"], params["names"], params["descriptions"], params["is_active"])
+    assert pipeline.inserted_rows == len(records)
+    return records, rejects
+
+
+def test_readers_agree(monkeypatch):
+    python_records, python_rejects = read_python(FIXTURE)
+    arrow_records, arrow_rejects = read_arrow(FIXTURE, monkeypatch)
+
+    # The default reader pads short rows and ignores extra fields
+    assert python_records == [
+        ("a1", "n1", "d1", True),
+        ("a2", "n2", "d2", False),
+        ("x4", "n4", "d", False),
+        ("a6", "n6", "d6", True),
+        ("a7", "n7", "d7", False),
+        ("a3", "multi\nline", "d3", True),
+    ]
+    assert [reject[1] for reject in python_rejects] == ["missing sku"]
+
+    # The Arrow reader rejects them, and otherwise agrees
+    assert arrow_records == [record for record in python_records if record[0] not in ("x4", "a6")]
+    assert sorted(reject for reject in arrow_rejects if reject[0]) == [
+        (4, "malformed CSV: expected 4 fields, saw 3", ["X4", "n4", "d"]),
+        (6, "malformed CSV: expected 4 fields, saw 5", ["A6", "n6", "d6", "true", "extra"]),
+    ]
+    assert [reject[1] for reject in arrow_rejects if not reject[0]] == ["missing sku"]
+
+
+def test_split_byte_ranges(tmp_path):
+    path = tmp_path / "products.csv"
+    path.write_bytes(FIXTURE)
+    start = FIXTURE.index(b"\n") + 1
+
+    ranges = split_byte_ranges(path, start, 4, start_line=2, block_size=4)
+
+    # Contiguous from start to EOF, every range starting at a row
+    assert ranges[0][0] == start and ranges[-1][1] == len(FIXTURE)
+    assert all(end == next_start for (_, end, _), (next_start, _, _) in zip(ranges, ranges[1:]))
+    assert len(ranges) > 1
+    inside_quotes = FIXTURE.index(b'line",d3')
+    for range_start, _, first_line in ranges:
+        assert FIXTURE[range_start - 1:range_start] == b"\n" and range_start != inside_quotes
+        assert first_line == FIXTURE[:range_start].count(b"\n") + 1
+
+
+def test_split_byte_ranges_skips_newlines_in_quotes(tmp_path):
+    path = tmp_path / "products.csv"
+    data = b'sku,name,description\na1,"one\ntwo\nthree",d\na2,n,d\n'
+    path.write_bytes(data)
+    start = data.index(b"\n") + 1
+
+    # Every boundary inside the quoted field moves past it
+    ranges = split_byte_ranges(path, start, 8, start_line=2)
+    assert [first_line for _, _, first_line in ranges] == [2, 5]
+    assert ranges[1][0] == data.index(b"a2")
+
+
+def test_split_byte_ranges_single_shard(tmp_path):
+    path = tmp_path / "products.csv"
+    path.write_bytes(FIXTURE)
+
+    assert split_byte_ranges(path, 10, 1, start_line=3) == [(10, len(FIXTURE), 3)]
@@ -0,0 +1,58 @@
+import gzip
+
+import pytest
+
+from app.uploads import HeaderSniffer, UploadRejected
+
+CSV = b"\xef\xbb\xbfSKU,Name,description,is_active\r\na1,n1,d1,true\n"
+
+
+def sniff(chunks, fmt="csv"):
+    sniffer = HeaderSniffer(fmt)
+    for chunk in chunks:
+        sniffer.feed(chunk)
+    sniffer.finish()
+    return sniffer
+
+
+def test_header_split_over_chunks():
+    # Byte by byte, so the magic bytes and the header both arrive in pieces
+    sniffer = sniff([CSV[i:i + 1] for i in range(len(CSV))])
+    assert sniffer.compression == "none"
+    assert sniffer.columns == {"sku": 0, "name": 1, "description": 2, "is_active": 3}
+
+
+def test_gzip_header():
+    data = gzip.compress(CSV)
+    sniffer = sniff([data[:2], data[2:10], data[10:]])
+    assert sniffer.compression == "gzip"
+    assert sniffer.columns["is_active"] == 3
+
+
+def test_short_upload_without_newline():
+    sniffer = sniff([b"sku,name,description"])
+    assert sniffer.columns == {"sku": 0, "name": 1, "description": 2}
+
+
+@pytest.mark.parametrize("chunks, fmt, message", [
+    ([b""], "csv", "Uploaded file is empty"),
+    # Shorter than the magic bytes, only checked by finish()
+    ([b"sku"], "csv", "CSV header is missing required columns: name, description"),
+    ([b"sku,name\nA1,n1\n"], "csv", "CSV header is missing required columns: description"),
+    ([b"\xff\xfe,name,description\n"], "csv", "CSV header is not valid UTF-8 text"),
+    ([b"sku" * 30000], "csv", "Could not find the CSV header line"),
+    ([b"\x1f\x8bnot gzip at all\n"], "csv", "Upload is not valid gzip data"),
+    ([b"not parquet"], "parquet", "Upload is not a Parquet file"),
+])
+def test_rejected(chunks, fmt, message):
+    if fmt != "csv":
+        pytest.importorskip("pyarrow")
+    with pytest.raises(UploadRejected, match=message):
+        sniff(chunks, fmt)
+
+
+def test_ndjson_first_record():
+    pytest.importorskip("pyarrow")
+    assert set(sniff([b'{"sku": "a1", "name": "n", "description": null}\n'], "ndjson").columns) == {"sku", "name", "description"}
+    with pytest.raises(UploadRejected, match="missing required fields: description"):
+        sniff([b'{"sku": "a1", "name": "n"}\n'], "ndjson")